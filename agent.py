@@ -4,16 +4,13 @@ Agent que transforma el 'plan' de reasoning.synthesize en texto conversacional.
 Diseñado para Modo C: identidad persistente y estilo que evoluciona con memoria.
 """
 
-import os
-import json
 import random
 from typing import Any, Dict, List, Optional
 
+import metrics
 from reasoning import synthesize
 from evolution_engine import process_interaction
-from state_manager import load_state, save_state  # para persistir cambios cuando hace falta
-
-PROPOSALS_DIR = "proposals"
+from proposal_store import PROPOSALS
 
 
 # -------------------------
@@ -43,6 +40,7 @@ def persona_prefix(persona: str) -> str:
 # -------------------------
 # Convertir plan -> texto
 # -------------------------
+@metrics.timed("plan_to_text")
 def plan_to_text(plan: Dict[str, Any]) -> str:
     message = plan.get("message", "")
     level = plan.get("level", 1)
@@ -133,12 +131,14 @@ def plan_to_text(plan: Dict[str, Any]) -> str:
 # -------------------------
 # THINK / AGENT REPLY
 # -------------------------
-def think(user_message: str, state: Dict[str, Any]) -> str:
+def think(user_message: str, state: Dict[str, Any],
+          memories: Optional[List[str]] = None) -> str:
     """
     Llama a reasoning.synthesize(user_message, state) y convierte el plan a texto.
+    memories: recuerdos ya recuperados fuera del actor (opcional).
     """
     try:
-        plan = synthesize(user_message, state)
+        plan = synthesize(user_message, state, memories)
     except TypeError as e:
         return f"Error interno en el módulo de razonamiento: {e}"
     except Exception as e:
@@ -158,11 +158,13 @@ def think(user_message: str, state: Dict[str, Any]) -> str:
     return str(plan)
 
 
-def agent_reply(user_message: str, state: Dict[str, Any]) -> str:
+@metrics.timed("agent_reply")
+def agent_reply(user_message: str, state: Dict[str, Any],
+                memories: Optional[List[str]] = None) -> str:
     """
     Respuesta principal: piensa, genera propuesta (proceso interno) y devuelve texto.
     """
-    ai_response = think(user_message, state)
+    ai_response = think(user_message, state, memories)
 
     # registrar interacción como propuesta (no bloqueante)
     try:
@@ -177,46 +179,59 @@ def agent_reply(user_message: str, state: Dict[str, Any]) -> str:
 # -------------------------
 # utilities: proposals & summarize
 # -------------------------
-def list_proposals(state: Optional[Dict[str, Any]] = None) -> List[str]:
-    if isinstance(state, dict):
-        p = state.get("proposals")
-        if isinstance(p, list):
-            return p
-    os.makedirs(PROPOSALS_DIR, exist_ok=True)
-    return sorted(os.listdir(PROPOSALS_DIR))
+def list_proposals(state: Optional[Dict[str, Any]] = None,
+                   offset: int = 0,
+                   limit: Optional[int] = None) -> List[str]:
+    # estados antiguos con las propuestas en la lista; si está vacía
+    # (siempre, en _default_state) manda el manifiesto
+    p = _state_proposals(state)
+    if p:
+        return p[offset:None if limit is None else offset + limit]
+    return PROPOSALS.ids(offset=offset, limit=limit)
+
+
+def _state_proposals(state: Optional[Dict[str, Any]]) -> List[str]:
+    p = state.get("proposals") if isinstance(state, dict) else None
+    return p if isinstance(p, list) else []
+
+
+def query_proposals(since: Optional[float] = None,
+                    until: Optional[float] = None,
+                    applied: Optional[bool] = None,
+                    offset: int = 0,
+                    limit: Optional[int] = None) -> List[str]:
+    """Ids de propuestas por rango de tiempo y estado aplicado/pendiente."""
+    return PROPOSALS.query(since=since, until=until, applied=applied,
+                           offset=offset, limit=limit)
+
+
+def proposal_counts(state: Optional[Dict[str, Any]] = None) -> Dict[str, int]:
+    """total / aplicadas / pendientes (consultas al manifiesto, sin listar)."""
+    if _state_proposals(state):
+        total = len(state["proposals"])
+        applied = len(state.get("applied_proposals", []))
+    else:
+        total = PROPOSALS.count()
+        applied = PROPOSALS.count(applied=True)
+    return {"total": total, "applied": applied, "pending": total - applied}
 
 
 def read_proposal(pid: str) -> Optional[Dict[str, Any]]:
-    path = os.path.join(PROPOSALS_DIR, pid)
-    if not os.path.exists(path):
-        return None
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                return {"text": f.read()}
-        except Exception:
-            return None
+    return PROPOSALS.get(pid)
 
 
 def apply_proposal(state: Dict[str, Any], proposal: str) -> Dict[str, Any]:
     state.setdefault("applied_proposals", [])
     if proposal not in state["applied_proposals"]:
         state["applied_proposals"].append(proposal)
+    PROPOSALS.mark_applied(proposal)
     state["version"] = round(float(state.get("version", 1.0)) + 0.1, 4)
-    save_state(state)
+    # lo persiste quien posee el estado (state_actor)
     return state
 
 
 def clear_proposals():
-    os.makedirs(PROPOSALS_DIR, exist_ok=True)
-    for name in os.listdir(PROPOSALS_DIR):
-        try:
-            os.remove(os.path.join(PROPOSALS_DIR, name))
-        except Exception:
-            pass
+    PROPOSALS.clear()
 
 
 def safe_summarize(text: Optional[str], max_len: int = 200) -> str:
@@ -0,0 +1,402 @@
+# asgi_app.py
+"""
+Punto de entrada ASGI (asyncio), sin dependencias más allá de la stdlib:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+Mismas rutas que api.py: /ask, /ask/batch, /status, /state, /proposals*,
+/actions/summarize, /whatsapp, /metrics (+ /ping, /health y la UI estática).
+
+- Ninguna petición ocupa un hilo mientras espera: las mutaciones van al
+  actor de estado (state_actor), global o de la sesión (sessions.py), y
+  se esperan como futures; el actor hace la persistencia en su hilo.
+- Lecturas de propuestas (SQLite / ficheros) en el executor por defecto.
+- El retrieval (CPU) corre en un pool acotado (RETRIEVAL_WORKERS hilos,
+  como mucho RETRIEVAL_MAX_PENDING en cola); si está saturado, la
+  petición cae al retrieval dentro del actor en vez de encolarse.
+"""
+
+import asyncio
+import json
+import mimetypes
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs
+
+import agent
+import main
+import memory_index
+import metrics
+import reasoning
+from proposal_store import PROPOSAL_WRITER
+from scheduler import SCHEDULER
+from sessions import SESSIONS
+from src.interface import webhook_whatsapp
+from state_actor import ACTOR, shallow_copy
+
+STATIC_DIR = "static"
+MAX_BODY = 1024 * 1024
+RETRIEVAL_WORKERS = int(os.environ.get("PRIMORDIAL_RETRIEVAL_WORKERS", 4))
+RETRIEVAL_MAX_PENDING = RETRIEVAL_WORKERS * 16
+TOP_K = 6
+
+_retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS,
+                                     thread_name_prefix="retrieval")
+_retrieval_slots: Optional[asyncio.Semaphore] = None
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status: int, payload: Any):
+        super().__init__(status)
+        self.status = status
+        self.payload = payload
+
+
+# -------------------------
+# helpers
+# -------------------------
+async def _actor(fn, *args, write=True):
+    """Ejecuta fn(state, *args) en el actor sin bloquear el event loop."""
+    return await asyncio.wrap_future(ACTOR.submit(fn, *args, write=write))
+
+
+async def _session(sid, fn, *args):
+    """fn(state, *args) en el actor de la sesión sid, sin bloquear el bucle."""
+    return await asyncio.wrap_future(SESSIONS.submit(sid, fn, *args))
+
+
+async def _blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def _memories(message: str):
+    """Recuerdos desde el pool acotado; None = que los busque el actor."""
+    global _retrieval_slots
+    if _retrieval_slots is None:
+        _retrieval_slots = asyncio.Semaphore(RETRIEVAL_MAX_PENDING)
+    if _retrieval_slots.locked():
+        return None
+    async with _retrieval_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _retrieval_pool, reasoning.retrieve_unsynced, message, TOP_K)
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise HTTPError(400, {"error": "cliente desconectado"})
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY:
+            raise HTTPError(413, {"error": "cuerpo demasiado grande"})
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _json_body(body: bytes, force: bool = True) -> Dict[str, Any]:
+    try:
+        data = json.loads(body.decode("utf-8")) if body else None
+    except ValueError:
+        if force:
+            raise HTTPError(400, {"error": "JSON inválido"})
+        data = None
+    return data if isinstance(data, dict) else {}
+
+
+async def _send(send, status: int, body: bytes, content_type: str) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode("latin-1")),
+            (b"content-length", str(len(body)).encode("ascii")),
+            (b"access-control-allow-origin", b"*"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(send, payload: Any, status: int = 200) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await _send(send, status, body, "application/json")
+
+
+# -------------------------
+# comandos del actor
+# -------------------------
+def _ask(state, msg, memories=None):
+    # Memoria previa
+    main.add_short(state, f"USER: {msg}")
+
+    # Respuesta
+    ai_response = agent.agent_reply(msg, state, memories)
+
+    # Memoria final
+    main.add_short(state, f"ASSISTANT: {ai_response}")
+    main._promote_short_to_long_if_needed(state)
+    main.limit_memory(state)
+
+    return ai_response, state.get("version", 1.0)
+
+
+def _status_payload(state):
+    meta = state.get("meta", {})
+
+    curiosity = meta.get("curiosity", 0)
+    coherence = meta.get("coherence", 0)
+
+    last_summary = ""
+    for item in reversed(state.get("long_memory", [])):
+        text = item.get("text", "")
+        if isinstance(text, str) and "Resumen automático" in text:
+            last_summary = text
+            break
+
+    return {
+        "version": state.get("version", 1.0),
+        "persona": meta.get("persona"),
+        "mental_parameters": {
+            "curiosity": curiosity,
+            "coherence": coherence
+        },
+        "curiosity": curiosity,
+        "coherence": coherence,
+        "evolution_level": state.get("level", "—"),
+        "short_memory": len(state.get("short_memory", [])),
+        "long_memory": len(state.get("long_memory", [])),
+        "proposals": agent.proposal_counts(state),
+        "last_summary": last_summary,
+        "proposal_writer": PROPOSAL_WRITER.stats(),
+        "state_actor": ACTOR.stats(),
+        "sessions": SESSIONS.stats(),
+        "scheduler": SCHEDULER.stats(),
+        "retrieval_cache": memory_index.cache_stats(),
+    }
+
+
+def _select_proposals(state, since, until, applied, offset, limit):
+    if since is None and until is None and applied is None:
+        return list(agent.list_proposals(state, offset, limit))
+    return agent.query_proposals(
+        since=since, until=until,
+        applied=None if applied is None else applied.lower() == "true",
+        offset=offset, limit=limit)
+
+
+# -------------------------
+# rutas
+# -------------------------
+async def ask(scope, receive):
+    data = _json_body(await _read_body(receive))
+    msg = str(data.get("message", "")).strip()
+
+    if not msg:
+        return {"response": "Debes enviar un mensaje."}
+
+    sid = data.get("session") or data.get("session_id")
+    with metrics.span("ask"):
+        if sid:
+            ai_response, version = await _session(str(sid), _ask, msg)
+        else:
+            memories = await _memories(msg)
+            ai_response, version = await _actor(_ask, msg, memories)
+    return {"response": ai_response, "version": version}
+
+
+async def ask_batch(scope, receive):
+    # {"messages": [...], "session": opcional} -> respuestas + tiempos
+    data = _json_body(await _read_body(receive))
+    messages = data.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise HTTPError(400, {"error": "messages debe ser una lista no vacía"})
+    if len(messages) > main.MAX_BATCH_MESSAGES:
+        raise HTTPError(413, {"error": f"como máximo {main.MAX_BATCH_MESSAGES} "
+                                       f"mensajes por lote"})
+    sid = data.get("session") or data.get("session_id")
+    # un tramo por comando del actor, cada uno esperado como future
+    start = time.perf_counter()
+    results = []
+    for chunk in main.batch_chunks(messages):
+        results.extend(await asyncio.wrap_future(
+            main.submit_batch_chunk(chunk, sid)))
+    return main.batch_result(results, start)
+
+
+async def status(scope, receive):
+    return await _actor(_status_payload, write=False)
+
+
+async def state_route(scope, receive):
+    return await _actor(shallow_copy, write=False)
+
+
+def _arg(query, name, cast=str, default=None):
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        return cast(values[0])
+    except ValueError:
+        return default
+
+
+async def proposals_list(scope, receive):
+    # filtros opcionales: ?since=<ts>&until=<ts>&applied=true|false
+    # paginación: ?offset=<n>&limit=<n>
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return await _actor(
+        _select_proposals,
+        _arg(query, "since", float), _arg(query, "until", float),
+        _arg(query, "applied"), _arg(query, "offset", int, 0),
+        _arg(query, "limit", int), write=False)
+
+
+async def proposals_read(scope, receive, pid):
+    if "/" in pid or "\\" in pid:
+        raise HTTPError(400, {"error": "invalid id"})
+    content = await _blocking(agent.read_proposal, pid)
+    if content is None:
+        raise HTTPError(404, {"error": "no encontrado"})
+    return content
+
+
+async def proposals_apply(scope, receive, pid):
+    if not os.path.exists("autorun_enabled"):
+        raise HTTPError(403, {
+            "error": "autorun not enabled. Create file 'autorun_enabled'"
+        })
+    await _actor(agent.apply_proposal, pid)
+    return {"ok": True, "msg": "Propuesta aplicada"}
+
+
+async def do_summarize(scope, receive):
+    data = _json_body(await _read_body(receive), force=False)
+    return {"result": agent.safe_summarize(data.get("text", ""))}
+
+
+async def whatsapp(scope, receive):
+    data = _json_body(await _read_body(receive))
+    # sesión propia del remitente, esperada como future
+    reply = await asyncio.wrap_future(webhook_whatsapp.submit_whatsapp(data))
+    return webhook_whatsapp.reply_payload(reply)
+
+
+ROUTES = {
+    ("POST", "/ask"): ask,
+    ("POST", "/ask/batch"): ask_batch,
+    ("GET", "/status"): status,
+    ("GET", "/state"): state_route,
+    ("GET", "/proposals"): proposals_list,
+    ("POST", "/actions/summarize"): do_summarize,
+    ("POST", "/whatsapp"): whatsapp,
+}
+
+
+def _static_file(path: str) -> Optional[str]:
+    root = os.path.realpath(STATIC_DIR)
+    full = os.path.realpath(os.path.join(root, path.lstrip("/")))
+    if not full.startswith(root + os.sep) or not os.path.isfile(full):
+        return None
+    return full
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _serve_static(send, path: str, missing: str) -> None:
+    full = _static_file(path)
+    if full is None:
+        await _send(send, 404, missing.encode("utf-8"),
+                    "text/html; charset=utf-8")
+        return
+    ctype = mimetypes.guess_type(full)[0] or "application/octet-stream"
+    await _send(send, 200, await _blocking(_read_file, full), ctype)
+
+
+async def _http(scope, receive, send) -> None:
+    method = scope["method"]
+    path = scope["path"]
+
+    if method == "OPTIONS":
+        await send({
+            "type": "http.response.start",
+            "status": 204,
+            "headers": [
+                (b"access-control-allow-origin", b"*"),
+                (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+                (b"access-control-allow-headers", b"Content-Type"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b""})
+        return
+    if path in ("/ping", "/health"):
+        await _send(send, 200, b"ok" if path == "/ping" else b"OK",
+                    "text/plain; charset=utf-8")
+        return
+    if path == "/metrics" and method == "GET":
+        # solo contadores en memoria (sin actor ni disco): en el bucle
+        body = metrics.render()
+        await _send(send, 200, body.encode("utf-8"), metrics.CONTENT_TYPE)
+        return
+
+    handler = ROUTES.get((method, path))
+    args = ()
+    if handler is None and path.startswith("/proposals/"):
+        rest = path[len("/proposals/"):]
+        if method == "GET" and rest:
+            handler, args = proposals_read, (rest,)
+        elif method == "POST" and rest.endswith("/apply"):
+            handler, args = proposals_apply, (rest[:-len("/apply")],)
+
+    if handler is None:
+        if method != "GET":
+            await _send_json(send, {"error": "no encontrado"}, 404)
+        elif path == "/":
+            await _serve_static(send, "index.html", "UI no encontrada")
+        elif path == "/status-ui":
+            await _serve_static(send, "status.html", "UI status no encontrada")
+        else:
+            await _serve_static(send, path, "Archivo no encontrado")
+        return
+
+    try:
+        payload = await handler(scope, receive, *args)
+    except HTTPError as e:
+        await _send_json(send, e.payload, e.status)
+        return
+    await _send_json(send, payload)
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            os.makedirs("proposals", exist_ok=True)
+            os.makedirs("logs", exist_ok=True)
+            # índice listo antes de servir retrieval fuera del actor
+            await _actor(memory_index.sync_state, write=False)
+            main.run_background_thread()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await _blocking(main.stop_background)
+            await _blocking(PROPOSAL_WRITER.close)
+            _retrieval_pool.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    elif scope["type"] == "http":
+        await _http(scope, receive, send)
@@ -0,0 +1,245 @@
+# backup_store.py
+"""
+Backups incrementales direccionados por contenido.
+
+- El estado se parte en chunks:
+    * "scalars": todas las claves que no son listas (meta, version, level...)
+    * cada lista (short_memory, long_memory, ...) en segmentos definidos por
+      contenido: un segmento termina tras una entrada cuyo hash de clave
+      cae en la frontera. Así, recortar por la cabeza o añadir al final
+      solo cambia el primer/último segmento.
+- Cada chunk (JSON canónico comprimido con zlib) se guarda una sola vez
+  en objects/<hh>/<sha256>.
+- Un backup es un manifiesto pequeño (manifests/<ts>.json) con los hashes.
+- Retención por tiempo: todos los de la última hora, uno por hora durante
+  un día y uno por día durante un mes. Los objetos no referenciados se
+  borran tras podar manifiestos.
+
+Uso:
+    python backup_store.py list
+    python backup_store.py restore <id> [salida.json]
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+import snapshot_codec
+from memory import entry_key
+from memory_log import plain_state
+
+# tamaño medio (en entradas) de los segmentos de listas
+SEGMENT_AVG = 64
+SEGMENT_MAX = SEGMENT_AVG * 4
+
+KEEP_ALL_SECONDS = 3600
+HOURLY_SECONDS = 24 * 3600
+DAILY_SECONDS = 30 * 24 * 3600
+
+
+def _boundary(entry) -> bool:
+    text, ts = entry_key(entry)
+    h = zlib.crc32(f"{ts}\x00{text}".encode("utf-8"))
+    return h % SEGMENT_AVG == 0
+
+
+def split_segments(items: List[Any]) -> List[List[Any]]:
+    segments = []
+    current = []
+    for item in items:
+        current.append(item)
+        if _boundary(item) or len(current) >= SEGMENT_MAX:
+            segments.append(current)
+            current = []
+    if current:
+        segments.append(current)
+    return segments
+
+
+class BackupStore:
+
+    def __init__(self, root: str):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.manifests_dir = os.path.join(root, "manifests")
+        self._lock = threading.Lock()
+
+    # --- objetos ---
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _put(self, data: Any) -> Tuple[str, int]:
+        """Guarda un chunk si no existe. Devuelve (hash, bytes escritos)."""
+        raw = json.dumps(data, sort_keys=True, ensure_ascii=False,
+                         separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blob = zlib.compress(raw)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        metrics.add_bytes("backups", len(blob))
+        return digest, len(blob)
+
+    def _get(self, digest: str) -> Any:
+        with open(self._object_path(digest), "rb") as f:
+            return json.loads(zlib.decompress(f.read()).decode("utf-8"))
+
+    # --- backups ---
+    def backup(self, state: Dict[str, Any], now: Optional[float] = None) -> Dict[str, Any]:
+        """Crea un backup; solo escribe los chunks nuevos."""
+        now = time.time() if now is None else now
+        state = plain_state(state)
+        with self._lock:
+            written = 0
+            scalars = {k: v for k, v in state.items() if not isinstance(v, list)}
+            scalars_hash, n = self._put(scalars)
+            written += n
+            lists = {}
+            for key, value in state.items():
+                if not isinstance(value, list):
+                    continue
+                hashes = []
+                for segment in split_segments(value):
+                    digest, n = self._put(segment)
+                    hashes.append(digest)
+                    written += n
+                lists[key] = hashes
+
+            manifest = {
+                "ts": now,
+                "scalars": scalars_hash,
+                "lists": lists,
+                "keys": list(state.keys()),
+            }
+            os.makedirs(self.manifests_dir, exist_ok=True)
+            stamp = datetime.fromtimestamp(now, timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+            bid = stamp
+            n = 1
+            while os.path.exists(os.path.join(self.manifests_dir, bid + ".json")):
+                bid = f"{stamp}-{n}"
+                n += 1
+            raw = json.dumps(manifest)
+            with open(os.path.join(self.manifests_dir, bid + ".json"), "w",
+                      encoding="utf-8") as f:
+                f.write(raw)
+            metrics.add_bytes("backups", len(raw))
+            self._apply_retention(now)
+            return {"id": bid, "bytes_written": written}
+
+    def list_backups(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.manifests_dir):
+            return []
+        out = []
+        for name in sorted(os.listdir(self.manifests_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.manifests_dir, name), "r",
+                          encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except Exception:
+                continue
+            out.append({"id": name[:-5], "ts": manifest.get("ts", 0)})
+        return out
+
+    def restore(self, bid: str) -> Dict[str, Any]:
+        with open(os.path.join(self.manifests_dir, bid + ".json"), "r",
+                  encoding="utf-8") as f:
+            manifest = json.load(f)
+        state = dict(self._get(manifest["scalars"]))
+        for key, hashes in manifest.get("lists", {}).items():
+            items = []
+            for digest in hashes:
+                items.extend(self._get(digest))
+            state[key] = items
+        order = manifest.get("keys") or list(state.keys())
+        return {k: state[k] for k in order if k in state}
+
+    # --- retención ---
+    def _apply_retention(self, now: float) -> None:
+        backups = self.list_backups()
+        keep = set()
+        seen_buckets = set()
+        # del más reciente al más antiguo: el primero de cada bucket se queda
+        for b in reversed(backups):
+            age = now - b["ts"]
+            if age <= KEEP_ALL_SECONDS:
+                keep.add(b["id"])
+                continue
+            if age <= HOURLY_SECONDS:
+                bucket = ("h", int(b["ts"] // 3600))
+            elif age <= DAILY_SECONDS:
+                bucket = ("d", int(b["ts"] // 86400))
+            else:
+                continue
+            if bucket not in seen_buckets:
+                seen_buckets.add(bucket)
+                keep.add(b["id"])
+        removed = [b["id"] for b in backups if b["id"] not in keep]
+        for bid in removed:
+            try:
+                os.remove(os.path.join(self.manifests_dir, bid + ".json"))
+            except OSError:
+                pass
+        if removed:
+            self._collect_garbage()
+
+    def _collect_garbage(self) -> None:
+        live = set()
+        for b in self.list_backups():
+            try:
+                with open(os.path.join(self.manifests_dir, b["id"] + ".json"),
+                          "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except Exception:
+                # manifiesto ilegible: no arriesgarse a borrar objetos
+                return
+            live.add(manifest.get("scalars"))
+            for hashes in manifest.get("lists", {}).values():
+                live.update(hashes)
+        if not os.path.isdir(self.objects_dir):
+            return
+        for prefix in os.listdir(self.objects_dir):
+            pdir = os.path.join(self.objects_dir, prefix)
+            if not os.path.isdir(pdir):
+                continue
+            for name in os.listdir(pdir):
+                if name not in live:
+                    try:
+                        os.remove(os.path.join(pdir, name))
+                    except OSError:
+                        pass
+
+
+def _main(argv):
+    import state_manager
+    store = state_manager.BACKUPS
+    if len(argv) >= 1 and argv[0] == "list":
+        for b in store.list_backups():
+            print(b["id"])
+        return 0
+    if len(argv) >= 2 and argv[0] == "restore":
+        state = store.restore(argv[1])
+        if len(argv) >= 3:
+            snapshot_codec.dump_json(state, argv[2])
+        else:
+            print(json.dumps(state, indent=2, ensure_ascii=False))
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,233 @@
+# benchmarks/pipeline_bench.py
+"""
+Benchmark del pipeline de /ask con memorias de 100, 1k, 10k y 100k entradas.
+
+Mide, por tamaño (short_memory y long_memory con n entradas cada una):
+    retrieve      reasoning.retrieve
+    synthesize    reasoning.synthesize
+    agent_reply   agent.agent_reply
+    think         main.think (actor + persistencia)
+    save_state    state_manager.save_state tras añadir una entrada
+    load_state    recarga completa desde disco (StateStore.reload)
+    ask_http      POST /ask con el test client de Flask (api.py)
+
+Se ejecuta en un directorio temporal (no toca el estado del repo), sin
+red y con semillas fijas. Resultado en JSON (mediana, p95 y mínimo en ms).
+
+Uso:
+    python benchmarks/pipeline_bench.py [--sizes 100,1000,10000,100000]
+        [--repeat 20] [--storage log|sqlite] [--out resultados.json]
+    python benchmarks/pipeline_bench.py --compare baseline.json [--threshold 0.25]
+    python benchmarks/pipeline_bench.py --compare baseline.json --current nuevo.json
+
+Con --compare sale con código 1 si alguna mediana empeora más que
+--threshold (fracción) respecto a la baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import memory  # noqa: E402
+from snapshot_bench import synthetic_state  # noqa: E402
+
+SIZES = "100,1000,10000,100000"
+REPEAT = 20
+THRESHOLD = 0.25
+# por debajo de esta mediana (ms) las diferencias son ruido
+MIN_MS = 0.05
+
+QUERIES = ("hola como estas", "qué día es hoy", "memoria del agente",
+           "cuánto mar y sol", "pregunta sobre la casa y el perro")
+
+
+def _timings(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1000.0)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1,
+                                    int(len(samples) * 0.95))], 4),
+        "min_ms": round(samples[0], 4),
+        "n": repeat,
+    }
+
+
+def bench_size(n, repeat, modules):
+    main, reasoning, agent, state_manager, client = modules
+    # que el pipeline no recorte ni consolide la memoria por debajo de n
+    for key in ("short_memory", "long_memory"):
+        memory.set_capacity(key, max(2 * n, memory.CAPACITY[key]))
+    random.seed(n)
+    queries = iter(QUERIES * (repeat * 4 + 8))
+
+    state = synthetic_state(n, seed=n)
+    state_manager.STORE.save(state)
+    state = state_manager.load_state()
+    main.limit_memory(state)
+
+    results = {"entries": n}
+    results["retrieve"] = _timings(
+        lambda: reasoning.retrieve(next(queries), state, top_k=6), repeat)
+    results["synthesize"] = _timings(
+        lambda: reasoning.synthesize(next(queries), state), repeat)
+    # synthesize añade a long_memory: recortar fuera de la medida
+    main.limit_memory(state)
+    results["agent_reply"] = _timings(
+        lambda: agent.agent_reply(next(queries), state), repeat)
+    main.limit_memory(state)
+    state_manager.save_state(state)
+
+    results["think"] = _timings(lambda: main.think(next(queries)), repeat)
+
+    def save_one():
+        main.add_short(state, next(queries))
+        state_manager.save_state(state)
+
+    state = state_manager.load_state()
+    results["save_state"] = _timings(save_one, repeat)
+    results["load_state"] = _timings(state_manager.STORE.reload,
+                                     max(3, repeat // 4))
+
+    if client is not None:
+        results["ask_http"] = _timings(
+            lambda: client.post("/ask", json={"message": next(queries)}),
+            repeat)
+    return results
+
+
+def run(sizes, repeat, storage):
+    """Ejecuta el benchmark en un directorio temporal y devuelve el informe."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="primordial-bench-") as tmp:
+        os.chdir(tmp)
+        os.environ["PRIMORDIAL_STORAGE"] = storage
+        try:
+            # los módulos crean sus ficheros relativos al directorio actual
+            import main
+            import reasoning
+            import agent
+            import memory_index
+            import state_manager
+            try:
+                import api
+                client = api.app.test_client()
+            except ImportError:
+                client = None
+            modules = (main, reasoning, agent, state_manager, client)
+            rows = {str(n): bench_size(n, repeat, modules) for n in sizes}
+            from proposal_store import PROPOSAL_WRITER
+            PROPOSAL_WRITER.close()
+        finally:
+            os.chdir(cwd)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "storage": storage,
+            "retrieval": memory_index.BACKEND,
+            "sizes": sizes,
+            "repeat": repeat,
+            "ts": time.time(),
+        },
+        "results": rows,
+    }
+
+
+def compare(baseline, current, threshold=THRESHOLD, min_ms=MIN_MS):
+    """Filas (tamaño, op, base, actual, ratio, regresión)."""
+    rows = []
+    for size, ops in current["results"].items():
+        base_ops = baseline.get("results", {}).get(size, {})
+        for op, cur in ops.items():
+            base = base_ops.get(op)
+            if not isinstance(cur, dict) or not isinstance(base, dict):
+                continue
+            b, c = base["median_ms"], cur["median_ms"]
+            ratio = c / b if b > 0 else float("inf")
+            regressed = c > min_ms and ratio > 1 + threshold
+            rows.append((size, op, b, c, ratio, regressed))
+    return rows
+
+
+def _print_table(report, out=sys.stderr):
+    for size, ops in report["results"].items():
+        print(f"--- {size} entradas", file=out)
+        for op, r in ops.items():
+            if isinstance(r, dict):
+                print(f"  {op:<12} mediana {r['median_ms']:>10.3f} ms   "
+                      f"p95 {r['p95_ms']:>10.3f} ms", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default=SIZES)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--storage", choices=("log", "sqlite"),
+                        default=os.environ.get("PRIMORDIAL_STORAGE", "log"))
+    parser.add_argument("--out", help="guardar el informe JSON en este fichero")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="comparar con un informe guardado")
+    parser.add_argument("--current", metavar="INFORME",
+                        help="con --compare: usar este informe en vez de medir")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="empeoramiento máximo permitido (0.25 = +25%%)")
+    parser.add_argument("--min-ms", type=float, default=MIN_MS,
+                        help="ignorar operaciones más rápidas que esto")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.current:
+        with open(args.current, "r", encoding="utf-8") as f:
+            report = json.load(f)
+    else:
+        sizes = ([int(s) for s in args.sizes.split(",") if s.strip()]
+                 if args.sizes != SIZES or baseline is None
+                 else baseline["meta"]["sizes"])
+        report = run(sizes, args.repeat, args.storage)
+        _print_table(report)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline is None:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    rows = compare(baseline, report, args.threshold, args.min_ms)
+    failed = [r for r in rows if r[5]]
+    for size, op, b, c, ratio, regressed in rows:
+        mark = "REGRESIÓN" if regressed else ""
+        print(f"{size:>7} {op:<12} {b:>10.3f} -> {c:>10.3f} ms "
+              f"x{ratio:5.2f} {mark}", file=sys.stderr)
+    print(json.dumps({
+        "compared": len(rows),
+        "regressions": [{"size": s, "op": o, "baseline_ms": b,
+                         "current_ms": c, "ratio": round(r, 3)}
+                        for s, o, b, c, r, _x in failed],
+    }, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# benchmarks/snapshot_bench.py
+"""
+Compara el snapshot JSON histórico (indent=2) con el formato binario
+de snapshot_codec: tiempo de carga, tiempo de guardado y tamaño,
+con 1k, 10k y 100k entradas de memoria.
+
+Uso:
+    python benchmarks/snapshot_bench.py [--sizes 1000,10000,100000] [--json]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot_codec  # noqa: E402
+
+WORDS = ("hola como estas memoria agente evolutivo pregunta respuesta "
+         "casa perro gato sol luna mar cuánto qué día noche").split()
+
+
+def synthetic_state(n, seed=0):
+    rnd = random.Random(seed)
+
+    def text():
+        return " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 16)))
+
+    t0 = 1765000000.0
+    return {
+        "version": 8.77,
+        "short_memory": [{"ts": t0 + i, "text": "USER: " + text()}
+                         for i in range(n)],
+        "long_memory": [{"ts": t0 + i, "text": text(), "importance": 0.5}
+                        for i in range(n)],
+        "meta": {"persona": "evolutiva reflexiva",
+                 "curiosity": 0.42, "coherence": 0.12},
+        "level": 2,
+        "applied_proposals": [],
+    }
+
+
+def _best(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def bench_size(n, tmpdir, repeat=3):
+    state = synthetic_state(n)
+    json_path = os.path.join(tmpdir, f"state_{n}.json")
+    bin_path = os.path.join(tmpdir, f"state_{n}.bin")
+
+    def save_json():
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2, ensure_ascii=False)
+
+    def load_json():
+        with open(json_path, "r", encoding="utf-8") as f:
+            json.load(f)
+
+    results = {"entries": n}
+    results["json_save_s"] = _best(save_json, repeat)
+    results["json_load_s"] = _best(load_json, repeat)
+    results["json_bytes"] = os.path.getsize(json_path)
+    results["bin_save_s"] = _best(
+        lambda: snapshot_codec.dump_file(state, bin_path), repeat)
+    results["bin_load_s"] = _best(
+        lambda: snapshot_codec.load_file(bin_path), repeat)
+    results["bin_bytes"] = os.path.getsize(bin_path)
+    assert snapshot_codec.load_file(bin_path) == state
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true",
+                        help="emitir resultados como JSON")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rows = [bench_size(n, tmpdir, args.repeat) for n in sizes]
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return rows
+
+    print(f"{'entradas':>9} | {'save json':>10} {'save bin':>10} | "
+          f"{'load json':>10} {'load bin':>10} | {'MB json':>8} {'MB bin':>8}")
+    for r in rows:
+        print(f"{r['entries']:>9} | {r['json_save_s'] * 1000:>8.1f}ms "
+              f"{r['bin_save_s'] * 1000:>8.1f}ms | "
+              f"{r['json_load_s'] * 1000:>8.1f}ms "
+              f"{r['bin_load_s'] * 1000:>8.1f}ms | "
+              f"{r['json_bytes'] / 1e6:>8.2f} {r['bin_bytes'] / 1e6:>8.2f}")
+    return rows
+
+
+if __name__ == "__main__":
+    main()
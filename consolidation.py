@@ -0,0 +1,340 @@
+# consolidation.py
+"""
+Consolidación de long_memory: en vez de descartar siempre las más
+antiguas, fusiona casi duplicados y descarta primero lo que menos vale.
+
+1. Fusión (de la más nueva a la más antigua):
+   - mismo texto normalizado ("Hola", "hola!", "HOLA.") -> una entrada;
+   - conjuntos de palabras con Jaccard >= MERGE_SIMILARITY -> una entrada.
+   Los textos sin palabras (emoji, "¿?", "...") no se fusionan.
+   Se queda el texto más reciente con la importancia máxima del grupo,
+   "count" (veces vista) y "hits" sumados.
+2. Valor de cada entrada superviviente:
+       W_IMPORTANCE * importance (0.5 si no tiene)
+     + W_RECENCY    * 2 ** (-edad / RECENCY_HALF_LIFE)
+     + W_HITS       * hits normalizados (veces devuelta por retrieve)
+     - W_REDUNDANCY * similitud con una entrada más nueva (casi duplicada
+                      pero por debajo del umbral de fusión)
+3. Si quedan más de TARGET_FILL * capacidad, se descartan las de menor
+   valor (nunca las KEEP_RECENT más nuevas).
+
+Si no hay nada que fusionar ni descartar (ni FLUSH_REPEATS repeticiones
+que memory_dedupe no dejó entrar), la lista no se toca: no hay escritura
+y hits y repeticiones siguen contándose en proceso. Si lo hay, long_memory
+se reescribe de una vez (una op "set" en el log y el índice de retrieval
+se reconstruye).
+
+Se ejecuta como trabajo de fondo (main.py, cada CONSOLIDATE_EVERY
+interacciones) y, como red de seguridad, desde limit_memory cuando la
+lista pasa de HIGH_WATER * capacidad (sesiones, procesos no líderes).
+
+promote_short(): cada PROMOTE_EVERY entradas nuevas de short_memory
+pasa a long_memory el mensaje de usuario más informativo de la ventana.
+"""
+
+import math
+import re
+import threading
+import time
+import weakref
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+import memory
+import memory_dedupe
+import memory_index
+import metrics
+
+# fusión / redundancia (Jaccard de conjuntos de palabras)
+MERGE_SIMILARITY = 0.8
+REDUNDANT_SIMILARITY = 0.5
+# candidatos comparados por entrada (postings de sus palabras más raras)
+MAX_CANDIDATES = 16
+RARE_TOKENS = 2
+
+# pesos del valor de una entrada
+W_IMPORTANCE = 1.0
+W_RECENCY = 0.5
+W_HITS = 0.5
+W_REDUNDANCY = 0.5
+DEFAULT_IMPORTANCE = 0.5
+RECENCY_HALF_LIFE = 7 * 24 * 3600.0
+HITS_SATURATE = 20
+
+# ocupación tras consolidar / a partir de la cual se consolida en línea
+TARGET_FILL = 0.85
+HIGH_WATER = 0.95
+KEEP_RECENT = 20
+
+# trabajo de fondo: cada cuántas interacciones
+CONSOLIDATE_EVERY = 100
+CONSOLIDATE_MIN_INTERVAL = 30
+# reescribir solo para guardar repeticiones si se acumulan al menos estas
+FLUSH_REPEATS = 50
+
+# promoción short -> long
+PROMOTE_EVERY = 30
+PROMOTE_MIN_TOKENS = 3
+
+_TOKEN = re.compile(r"\w+")
+_ROLE = re.compile(r"^[A-Z][A-Z_]*(?: [^\s:]{1,32})?: ")
+
+# veces que retrieve devolvió cada texto, por MemoryLog (estado global y
+# cada sesión por separado; se vuelca en "hits" de la entrada al consolidar)
+_hits: Dict[int, Counter] = {}
+_hits_lock = threading.Lock()
+
+LAST_RUN: Dict[str, Any] = {}
+
+
+# -------------------------
+# señales
+# -------------------------
+def record_hits(lm, texts: Iterable[str]) -> None:
+    """Cuenta los textos devueltos por retrieve desde la MemoryLog lm."""
+    texts = list(texts)
+    if lm is None or not texts:
+        return
+    with _hits_lock:
+        hits = _hits.get(id(lm))
+        if hits is None:
+            hits = _hits[id(lm)] = Counter()
+            weakref.finalize(lm, _hits.pop, id(lm), None)
+        hits.update(texts)
+
+
+def _take_hits(lm) -> Counter:
+    with _hits_lock:
+        taken = _hits.get(id(lm))
+        if taken is None:
+            return Counter()
+        _hits[id(lm)] = Counter()
+    return taken
+
+
+def _return_hits(lm, taken: Counter) -> None:
+    if not taken:
+        return
+    with _hits_lock:
+        hits = _hits.get(id(lm))
+        if hits is not None:
+            hits.update(taken)
+
+
+def _words(text: str) -> List[str]:
+    return _TOKEN.findall(memory_index.normalize(_ROLE.sub("", text)))
+
+
+def _token_set(words: List[str]) -> frozenset:
+    # sin palabras cortas ("el", "la", "de"), pero con los números
+    content = [w for w in words if len(w) > 2 or w.isdigit()]
+    return frozenset(content or words)
+
+
+# -------------------------
+# consolidación
+# -------------------------
+@metrics.timed("consolidate")
+def consolidate(state: Dict[str, Any], target: Optional[int] = None,
+                now: Optional[float] = None) -> Dict[str, Any]:
+    """Fusiona y descarta en long_memory. Devuelve estadísticas."""
+    start = time.perf_counter()
+    now = time.time() if now is None else now
+    lm = memory.memory_list(state, "long_memory")
+    n = len(lm)
+    capacity = lm.maxlen or memory.CAPACITY["long_memory"]
+    if target is None:
+        target = int(capacity * TARGET_FILL)
+    hits_taken = _take_hits(lm)
+
+    texts = [lm.text(i) for i in range(n)]
+    words = [_words(t) for t in texts]
+    keys = [" ".join(w) for w in words]
+    sets = [_token_set(w) for w in words]
+    df = Counter()
+    for s in sets:
+        df.update(s)
+
+    # 1. fusión, de la más nueva a la más antigua
+    rep_of_key: Dict[str, int] = {}
+    postings: Dict[str, List[int]] = {}
+    merged_into = [-1] * n
+    redundancy = [0.0] * n
+    for i in range(n - 1, -1, -1):
+        # sin palabras: no es "el mismo texto" que otra sin palabras
+        rep = rep_of_key.get(keys[i]) if keys[i] else None
+        best = 0.0
+        mine = sets[i]
+        if rep is None and mine:
+            size = len(mine)
+            rare = sorted(mine, key=df.__getitem__)[:RARE_TOKENS]
+            seen = set()
+            for w in rare:
+                for j in postings.get(w, ())[:MAX_CANDIDATES]:
+                    other = sets[j]
+                    # Jaccard <= min/max de los tamaños: descartar sin cruzar
+                    if j in seen or (min(size, len(other))
+                                     < REDUNDANT_SIMILARITY * max(size, len(other))):
+                        continue
+                    seen.add(j)
+                    inter = len(mine & other)
+                    sim = inter / (size + len(other) - inter)
+                    if sim > best:
+                        best, rep = sim, j
+            if best < MERGE_SIMILARITY:
+                rep = None
+        if rep is not None:
+            merged_into[i] = rep
+            continue
+        redundancy[i] = best if best >= REDUNDANT_SIMILARITY else 0.0
+        if keys[i]:
+            rep_of_key.setdefault(keys[i], i)
+        for w in sets[i]:
+            postings.setdefault(w, []).append(i)
+
+    groups: Dict[int, List[int]] = {}
+    for i, rep in enumerate(merged_into):
+        if rep >= 0:
+            groups.setdefault(rep, []).append(i)
+    survivors = [i for i in range(n) if merged_into[i] < 0]
+
+    # 2. valor y 3. descarte
+    evicted = set()
+    if len(survivors) > target:
+        protected = set(survivors[-KEEP_RECENT:])
+        scored = []
+        for i in survivors:
+            if i in protected:
+                continue
+            imp = max([lm.importance(j, DEFAULT_IMPORTANCE)
+                       for j in groups.get(i, ())]
+                      + [lm.importance(i, DEFAULT_IMPORTANCE)])
+            ts = lm.ts(i)
+            recency = (0.0 if ts is None else
+                       2.0 ** (-max(0.0, now - ts) / RECENCY_HALF_LIFE))
+            hits = sum(hits_taken.get(texts[j], 0)
+                       for j in groups.get(i, []) + [i])
+            hits += _stored(lm, i, "hits")
+            hits_norm = min(1.0, math.log1p(hits) / math.log1p(HITS_SATURATE))
+            value = (W_IMPORTANCE * imp + W_RECENCY * recency
+                     + W_HITS * hits_norm - W_REDUNDANCY * redundancy[i])
+            scored.append((value, i))
+        scored.sort()
+        excess = len(survivors) - target
+        evicted = {i for _v, i in scored[:excess]}
+
+    # repeticiones descartadas al entrar (memory_dedupe)
+    repeats = memory_dedupe.take_pending(lm)
+    stats = {"entries_before": n, "merged": n - len(survivors),
+             "evicted": len(evicted)}
+    if not (groups or evicted or sum(repeats.values()) >= FLUSH_REPEATS):
+        # nada que reescribir: hits y repeticiones esperan a la próxima
+        _return_hits(lm, hits_taken)
+        memory_dedupe.return_pending(lm, repeats)
+    else:
+        kept = []
+        for i in survivors:
+            if i in evicted:
+                continue
+            group = groups.get(i)
+            members = (group or []) + [i]
+            hits = sum(hits_taken.get(texts[j], 0) for j in members)
+            seen = sum(repeats.get(texts[j], 0) for j in members)
+            if not group and not hits and not seen:
+                kept.append(lm[i])
+                continue
+            entry = lm[i]
+            if not isinstance(entry, dict):
+                # entrada antigua en texto plano: se guarda como dict
+                entry = {"text": texts[i]}
+            if group or seen:
+                entry["count"] = seen + sum(_stored(lm, j, "count", 1)
+                                            for j in members)
+            if group:
+                imp = max(lm.importance(j, DEFAULT_IMPORTANCE)
+                          for j in members)
+                if imp != DEFAULT_IMPORTANCE or "importance" in entry:
+                    entry["importance"] = imp
+            entry["hits"] = sum(_stored(lm, j, "hits") for j in members) + hits
+            if not entry["hits"]:
+                del entry["hits"]
+            kept.append(entry)
+        lm[:] = kept
+        # que la búsqueda sin sincronizar (asgi_app) no devuelva fusionadas
+        memory_index.sync_state(state)
+    stats["entries"] = len(lm)
+    stats["ms"] = round((time.perf_counter() - start) * 1000.0, 3)
+    LAST_RUN.clear()
+    LAST_RUN.update(stats, ts=now)
+    return stats
+
+
+def _stored(lm, i: int, key: str, default: int = 0) -> int:
+    """Contador guardado en la entrada i ("hits", "count")."""
+    value = lm[i].get(key, default) if isinstance(lm[i], dict) else default
+    return value if isinstance(value, int) and not isinstance(value, bool) \
+        else default
+
+
+def maybe_consolidate(state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Consolida si long_memory pasa de HIGH_WATER (barato si no)."""
+    lm = memory.memory_list(state, "long_memory")
+    capacity = lm.maxlen or memory.CAPACITY["long_memory"]
+    if len(lm) < capacity * HIGH_WATER:
+        return None
+    return consolidate(state)
+
+
+# -------------------------
+# promoción short -> long
+# -------------------------
+def promote_short(state: Dict[str, Any],
+                  every: int = PROMOTE_EVERY) -> Optional[str]:
+    """
+    Cada `every` entradas nuevas de short_memory (desde la última
+    promoción, meta["promoted_ts"]) añade a long_memory el mensaje de
+    usuario con más palabras distintas; la importancia sube si se repite
+    en la ventana.
+    """
+    short = memory.memory_list(state, "short_memory")
+    meta = state.get("meta")
+    if not isinstance(meta, dict):
+        meta = state["meta"] = {}
+    since = meta.get("promoted_ts", 0.0)
+
+    window = []
+    for i in range(len(short) - 1, -1, -1):
+        ts = short.ts(i)
+        if ts is not None and ts <= since:
+            break
+        window.append(i)
+        if len(window) >= every:
+            break
+    if len(window) < every:
+        return None
+
+    newest = short.ts(window[0])
+    meta["promoted_ts"] = newest if newest is not None else time.time()
+
+    seen = Counter()
+    best, best_size = None, 0
+    for i in window:
+        text = short.text(i)
+        if not text.startswith("USER: "):
+            continue
+        words = _words(text)
+        key = " ".join(words)
+        seen[key] += 1
+        size = len(set(words))
+        if size >= PROMOTE_MIN_TOKENS and size > best_size:
+            best, best_size = (text[len("USER: "):], key), size
+    if best is None:
+        return None
+
+    text, key = best
+    importance = min(0.9, DEFAULT_IMPORTANCE + 0.1 * (seen[key] - 1))
+    entry = memory.make_entry(text, importance=importance)
+    entry["source"] = "short_memory"
+    memory.memory_list(state, "long_memory").append(entry)
+    memory_index.sync_state(state)
+    return text
@@ -1,43 +1,71 @@
 # evolution_engine.py (corregido)
 import os
-import json
 import time
-from state_manager import load_state, save_state
+import metrics
+from state_actor import ACTOR
+from proposal_store import PROPOSALS, PROPOSAL_WRITER
+from scheduler import SCHEDULER
+from version_store import VERSIONS_DIR, VersionStore
 import agent
 
-VERSIONS_DIR = "versions"
-PROPOSALS_DIR = "proposals"
 EVOLUTION_DIR = "evolutionary"
 
+# evolución por cambios: tras EVOLVE_EVERY interacciones, o antes si hay
+# alguna pendiente desde hace EVOLVE_MAX_WAIT s; nunca más de una vez
+# cada EVOLVE_MIN_INTERVAL s
+EVOLVE_EVERY = 20
+EVOLVE_MAX_WAIT = 600
+EVOLVE_MIN_INTERVAL = 120
+# sondeo de interacciones de otros workers (mantenimiento, evolución...):
+# solo con varios workers; sin propuestas nuevas el intervalo se duplica
+# hasta INTERACTIONS_POLL_MAX
+WORKERS = int(os.environ.get("PRIMORDIAL_WORKERS", 1))
+INTERACTIONS_POLL = 5
+INTERACTIONS_POLL_MAX = 300
+PRUNE_IDLE = 300
+
+VERSIONS = VersionStore(VERSIONS_DIR)
+
 os.makedirs(VERSIONS_DIR, exist_ok=True)
-os.makedirs(PROPOSALS_DIR, exist_ok=True)
 os.makedirs(EVOLUTION_DIR, exist_ok=True)
 
 
-def evolve_code():
-    state = load_state()
+def evolve_code(interactions=0):
+    # el delta se calcula con el estado bloqueado (actor); el fichero se
+    # escribe después, fuera del actor, y la versión del estado solo sube
+    # cuando el fichero existe (si commit falla, nada apunta a él)
+    prepared = ACTOR.read(_evolve, interactions)
+    if isinstance(prepared, str):
+        return prepared
+    new_version, meta, blob = prepared
+    name = VERSIONS.commit(new_version, meta, blob)
+    ACTOR.call(_set_version, new_version)
+    return f"Versión evolucionada creada: {VERSIONS_DIR}/{name}"
+
+
+def _evolve(state, interactions=0):
     version = state.get("version", 1.0)
 
-    proposals = agent.list_proposals()
-    if not proposals:
+    total = agent.proposal_counts()["total"]
+    if not total:
         return "No hay propuestas para evolucionar."
 
     new_version = round(version + 0.1, 2)
-    new_file = f"{VERSIONS_DIR}/agent_v{new_version}.txt"
-
-    content = "\n".join([
-        f"Versión evolutiva: {new_version}",
-        f"Propuestas procesadas: {len(proposals)}",
-        json.dumps(state, indent=4)
-    ])
+    # la versión guardada ya lleva el número nuevo; el estado aún no
+    snapshot = dict(state)
+    snapshot["version"] = new_version
 
-    with open(new_file, "w", encoding="utf-8") as f:
-        f.write(content)
+    meta, blob = VERSIONS.prepare(
+        snapshot,
+        version=new_version,
+        proposals=total,
+        interactions=interactions,
+        ts=time.time())
+    return new_version, meta, blob
 
-    state["version"] = new_version
-    save_state(state)
 
-    return f"Versión evolucionada creada: {new_file}"
+def _set_version(state, version):
+    state["version"] = version
 
 
 def prune_directories(max_logs=200):
@@ -51,28 +79,65 @@ def prune_directories(max_logs=200):
                     pass
 
 
-def auto_evolution_loop():
-    while True:
-        try:
-            evolve_code()
-            prune_directories()
-        except Exception:
-            pass
-        time.sleep(120)
-
-
+# -------------------------
+# trabajos del planificador
+# -------------------------
+_seen_seq = None
+_seen_written = 0
+_remote = 0
+_poll = INTERACTIONS_POLL
+
+
+def _watch_interactions(scheduler=SCHEDULER):
+    """
+    Con varios workers las interacciones de los demás procesos solo se
+    ven en el manifiesto de propuestas (una por interacción): emite
+    "interaction" por las propuestas nuevas que no escribió este proceso
+    (las propias ya se emitieron en process_interaction).
+    """
+    global _seen_seq, _seen_written, _remote, _poll
+    written = PROPOSAL_WRITER.written
+    try:
+        seq = PROPOSALS.last_seq()
+    except Exception:
+        return
+    if _seen_seq is not None and seq >= _seen_seq:
+        # lo escrito aquí entre las dos lecturas se descuenta en la siguiente
+        _remote += (seq - _seen_seq) - (written - _seen_written)
+        if _remote > 0:
+            scheduler.emit("interaction", _remote)
+            _remote = 0
+    # en reposo se sondea cada vez menos
+    poll = (min(_poll * 2, INTERACTIONS_POLL_MAX) if seq == _seen_seq
+            else INTERACTIONS_POLL)
+    if poll != _poll:
+        _poll = poll
+        scheduler.set_every("interactions_watch", poll)
+    _seen_seq, _seen_written = seq, written
+
+
+def schedule_jobs(scheduler=SCHEDULER):
+    """
+    Evolución tras EVOLVE_EVERY interacciones (de cualquier worker), o
+    antes si hay alguna pendiente desde hace EVOLVE_MAX_WAIT s; poda de
+    directorios en reposo.
+    """
+    scheduler.add("evolution", evolve_code, on=("interaction",),
+                  after=EVOLVE_EVERY, max_delay=EVOLVE_MAX_WAIT,
+                  min_interval=EVOLVE_MIN_INTERVAL, pass_events=True)
+    if WORKERS > 1:
+        scheduler.add("interactions_watch",
+                      lambda: _watch_interactions(scheduler),
+                      every=_poll)
+    scheduler.add("prune", prune_directories, idle=PRUNE_IDLE)
+
+
+@metrics.timed("process_interaction")
 def process_interaction(user_message, ai_response, state):
+    # registra mensaje + respuesta + referencia al estado (no una copia);
+    # la escritura la hace el hilo de PROPOSAL_WRITER
     try:
-        os.makedirs(PROPOSALS_DIR, exist_ok=True)
-        timestamp = int(time.time())
-        filename = f"{PROPOSALS_DIR}/proposal_{timestamp}.json"
-        data = {
-            "timestamp": timestamp,
-            "user_message": user_message,
-            "ai_response": ai_response,
-            "state_snapshot": state
-        }
-        with open(filename, "w", encoding="utf8") as f:
-            json.dump(data, f, indent=4)
+        PROPOSAL_WRITER.submit(user_message, ai_response, state)
     except Exception as e:
         print("Error en process_interaction:", e)
+    SCHEDULER.emit("interaction")
@@ -0,0 +1,40 @@
+# gunicorn.conf.py
+"""
+Despliegue multi-worker:
+
+    gunicorn -c gunicorn.conf.py api:app      (o server:app)
+
+- Los workers comparten el estado a través de state.db (motor SQLite)
+  y se excluyen con un flock sobre state.lock (state_manager) solo al
+  recargar y al guardar; el cálculo de cada lote va en paralelo.
+- Backups: en cada checkpoint del WAL (sqlite_store, backups/).
+- Solo un worker (el que gana background.lock) ejecuta los trabajos de
+  fondo (scheduler.py); si muere, otro toma el relevo.
+- preload_app queda desactivado: cada worker abre sus propias
+  conexiones SQLite y ficheros de lock después del fork.
+"""
+
+import multiprocessing
+import os
+
+# antes de que los workers importen la app
+os.environ.setdefault("PRIMORDIAL_STORAGE", "sqlite")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY",
+                             min(4, multiprocessing.cpu_count())))
+# el líder solo sondea interacciones de otros workers si los hay
+os.environ.setdefault("PRIMORDIAL_WORKERS", str(workers))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = False
+timeout = 60
+
+
+def post_worker_init(worker):
+    import main
+    main.run_background_thread()
+
+
+def worker_exit(server, worker):
+    import main
+    main.stop_background()
@@ -0,0 +1,325 @@
+# ingest.py
+"""
+Importación masiva de conversaciones a long_memory (sin pasar por /ask).
+
+    python ingest.py historial.jsonl [--session ID] [--batch 5000]
+    python ingest.py proposals/      (proposals.jsonl + proposal_*.json)
+
+Pipeline de generadores, memoria constante:
+    fuente (líneas/ficheros, con posición) -> textos del registro
+    -> normalizar -> deduplicar (LRU acotado de hashes) -> lotes
+
+Cada lote se añade con memory.extend_long_entries (mismas entradas que
+add_long_entry), se persiste y después se escribe el checkpoint
+(posición en la fuente). El índice de retrieval se sincroniza en bloque
+al final, solo con lo que quedó en la ventana.
+Si se interrumpe, volver a lanzar el mismo comando continúa desde el
+último lote guardado (--restart para empezar de cero).
+
+Capacidad: sin --limit solo se quedan las últimas PRIMORDIAL_MAX_LONG
+entradas (1000 por defecto) de todo lo importado. Para conservar más,
+pasar --limit N y arrancar el servidor con PRIMORDIAL_MAX_LONG >= N
+(si no, la capacidad del servidor vuelve a recortar en la siguiente
+interacción).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import memory
+import memory_index
+from memory_log import to_ts
+
+CHECKPOINT_DIR = ".ingest"
+BATCH_SIZE = 5000
+DEDUPE_CAPACITY = 200000
+MIN_TEXT = 3
+MAX_TEXT = 4000
+
+# campos con texto, en orden, de los registros JSON aceptados
+TEXT_FIELDS = ("text", "message", "user_message", "ai_response",
+               "title", "body", "content")
+
+_WS = re.compile(r"\s+")
+# ordena después de cualquier proposal_*.json
+LEGACY_DONE = "\uffff"
+
+
+# -------------------------
+# fuentes: (posición, registro)
+# -------------------------
+def read_jsonl(path: str, offset: int = 0) -> Iterator[Tuple[Dict, Any]]:
+    """Registros de un JSONL desde offset; la posición es el byte siguiente."""
+    if offset > os.path.getsize(path):
+        # el fichero se truncó o se reemplazó: empezar de nuevo
+        offset = 0
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                rec = None
+            yield {"offset": offset}, rec
+
+
+def read_proposals_dir(root: str, position: Dict) -> Iterator[Tuple[Dict, Any]]:
+    """proposal_*.json legados (por nombre) y después proposals.jsonl."""
+    last_file = position.get("file") or ""
+    for name in sorted(os.listdir(root)):
+        if not (name.startswith("proposal_") and name.endswith(".json")):
+            continue
+        if name <= last_file:
+            continue
+        try:
+            with open(os.path.join(root, name), "r", encoding="utf-8") as f:
+                rec = json.load(f)
+        except Exception:
+            rec = None
+        yield {"file": name, "offset": 0}, rec
+
+    log = os.path.join(root, "proposals.jsonl")
+    if os.path.exists(log):
+        for pos, rec in read_jsonl(log, position.get("offset", 0)):
+            # los ficheros legados ya están hechos
+            pos["file"] = LEGACY_DONE
+            yield pos, rec
+
+
+def open_source(path: str, position: Dict) -> Iterator[Tuple[Dict, Any]]:
+    if os.path.isdir(path):
+        return read_proposals_dir(path, position)
+    return read_jsonl(path, position.get("offset", 0))
+
+
+# -------------------------
+# transformación
+# -------------------------
+def record_texts(rec: Any) -> Iterator[Tuple[str, Optional[float]]]:
+    """(texto, ts float o None) de un registro."""
+    if isinstance(rec, str):
+        yield rec, None
+        return
+    if not isinstance(rec, dict):
+        return
+    ts = to_ts(rec.get("ts", rec.get("timestamp")))
+    for field in TEXT_FIELDS:
+        value = rec.get(field)
+        if isinstance(value, str):
+            yield value, ts
+
+
+def clean_text(text: str) -> Optional[str]:
+    text = _WS.sub(" ", text).strip()
+    if len(text) < MIN_TEXT:
+        return None
+    return text[:MAX_TEXT]
+
+
+def text_hash(text: str) -> bytes:
+    # el texto ya viene limpio (clean_text): basta con ignorar mayúsculas
+    return hashlib.blake2b(text.casefold().encode("utf-8"),
+                           digest_size=8).digest()
+
+
+class Deduper:
+    """Hashes vistos recientemente (LRU acotado: memoria constante)."""
+
+    def __init__(self, capacity: int = DEDUPE_CAPACITY):
+        self.capacity = capacity
+        self._seen: "OrderedDict[bytes, None]" = OrderedDict()
+
+    def seen(self, text: str) -> bool:
+        h = text_hash(text)
+        if h in self._seen:
+            self._seen.move_to_end(h)
+            return True
+        self._seen[h] = None
+        if len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+        return False
+
+
+def entries(source: Iterable[Tuple[Dict, Any]], dedupe: Deduper,
+            importance: float, stats: Dict[str, int]
+            ) -> Iterator[Tuple[Dict, List[Dict]]]:
+    """(posición, entradas nuevas del registro), un elemento por registro."""
+    for pos, rec in source:
+        stats["records"] += 1
+        out = []
+        for raw, ts in record_texts(rec):
+            text = clean_text(raw)
+            if text is None:
+                stats["skipped"] += 1
+                continue
+            if dedupe.seen(text):
+                stats["duplicates"] += 1
+                continue
+            out.append(memory.make_long_entry(text, importance, ts))
+        yield pos, out
+
+
+def batches(items: Iterable[Tuple[Dict, List[Dict]]], size: int
+            ) -> Iterator[Tuple[Dict, List[Dict]]]:
+    """
+    Lotes de ~size entradas, cortados entre registros, con la posición
+    tras el último registro incluido.
+    """
+    batch: List[Dict] = []
+    pos = None
+    for pos, new in items:
+        batch.extend(new)
+        if len(batch) >= size:
+            yield pos, batch
+            batch = []
+    if pos is not None:
+        yield pos, batch
+
+
+# -------------------------
+# checkpoint
+# -------------------------
+def checkpoint_path(source: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(source).encode("utf-8")).hexdigest()
+    return os.path.join(CHECKPOINT_DIR, digest[:16] + ".json")
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(path: str, data: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+# -------------------------
+# ingest
+# -------------------------
+def _apply_batch(state, batch, limit):
+    memory.extend_long_entries(state, batch, limit)
+    return len(state.get("long_memory", []))
+
+
+def _kept(state):
+    return len(state.get("long_memory", []))
+
+
+def _sync_index(state):
+    memory_index.sync_state(state)
+
+
+def _seed(state, dedupe):
+    for entry in state.get("long_memory", [])[-dedupe.capacity:]:
+        text = memory.entry_text(entry)
+        if text:
+            dedupe.seen(text)
+
+
+def ingest(source: str, session: Optional[str] = None,
+           batch_size: int = BATCH_SIZE, limit: Optional[int] = None,
+           importance: float = 0.5, dedupe_capacity: int = DEDUPE_CAPACITY,
+           checkpoint: Optional[str] = None, restart: bool = False,
+           progress=None) -> Dict[str, Any]:
+    """Importa source en long_memory (global o de una sesión)."""
+    checkpoint = checkpoint or checkpoint_path(source)
+    ckpt = {} if restart else load_checkpoint(checkpoint)
+    position = ckpt.get("position", {})
+    stats = {"records": 0, "added": 0, "duplicates": 0, "skipped": 0,
+             "batches": 0}
+
+    if session:
+        from sessions import SESSIONS
+
+        def run(fn, *args):
+            return SESSIONS.call(session, fn, *args)
+    else:
+        from state_actor import ACTOR
+
+        def run(fn, *args):
+            return ACTOR.call(fn, *args)
+
+    dedupe = Deduper(dedupe_capacity)
+    run(_seed, dedupe)
+
+    start = time.perf_counter()
+    items = entries(open_source(source, position), dedupe, importance, stats)
+    for pos, batch in batches(items, batch_size):
+        if batch:
+            run(_apply_batch, batch, limit)
+            stats["added"] += len(batch)
+            stats["batches"] += 1
+        # solo tras persistir el lote
+        save_checkpoint(checkpoint, {
+            "source": os.path.abspath(source),
+            "position": pos,
+            "ts": time.time(),
+        })
+        if progress is not None:
+            progress(stats)
+    # índice en bloque: una sola sincronización con lo que quedó en la
+    # ventana (los lotes intermedios que ya se recortaron no se indexan)
+    run(_sync_index)
+    stats["kept"] = run(_kept)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source", help="fichero JSONL o directorio de propuestas")
+    parser.add_argument("--session", help="importar en esta sesión (sessions.py)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    parser.add_argument("--limit", type=int, default=None,
+                        help="tamaño máximo de long_memory (por defecto, "
+                             "su capacidad: PRIMORDIAL_MAX_LONG, 1000; ver "
+                             "arriba para conservar más)")
+    parser.add_argument("--importance", type=float, default=0.5)
+    parser.add_argument("--dedupe", type=int, default=DEDUPE_CAPACITY,
+                        help="hashes recientes recordados para deduplicar")
+    parser.add_argument("--checkpoint", help="fichero de checkpoint")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignorar el checkpoint y empezar de cero")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        print(f"No existe: {args.source}", file=sys.stderr)
+        return 1
+
+    def progress(stats):
+        print(f"lotes={stats['batches']} registros={stats['records']} "
+              f"añadidas={stats['added']} duplicadas={stats['duplicates']}",
+              file=sys.stderr)
+
+    stats = ingest(args.source, session=args.session, batch_size=args.batch,
+                   limit=args.limit, importance=args.importance,
+                   dedupe_capacity=args.dedupe, checkpoint=args.checkpoint,
+                   restart=args.restart,
+                   progress=None if args.quiet else progress)
+    print(json.dumps(stats, ensure_ascii=False))
+    if args.limit is None and stats["added"] > stats["kept"]:
+        print(f"Aviso: long_memory se quedó en {stats['kept']} entradas "
+              f"(PRIMORDIAL_MAX_LONG); usar --limit para conservar más",
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
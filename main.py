@@ -4,24 +4,49 @@ Core runtime: gestión de estado, memoria y loop de background.
 Compatible con agent.py, reasoning.py y evolution_engine.py
 """
 
-import json
 import os
 import time
-import threading
-from datetime import datetime
 
 # módulos del proyecto
 import agent
-from evolution_engine import auto_evolution_loop
-from state_manager import load_state, save_state
-
-# Lock para evitar concurrencia en I/O
-_state_lock = threading.Lock()
-
-# Parámetros de control
-MAX_SHORT_MEM = 300
-MAX_LONG_MEM = 1000
-AUTO_PROMOTE_SHORT_TO_LONG_EVERY = 30
+import consolidation
+import memory
+import memory_index
+import metrics
+import evolution_engine
+from process_lock import LeaderElection
+from scheduler import SCHEDULER
+from state_actor import ACTOR
+from state_manager import STORE
+
+# Parámetros de control (capacidades: memory.CAPACITY; consolidación y
+# promoción: consolidation.py)
+# mensajes como máximo por llamada a think_batch
+MAX_BATCH_MESSAGES = 1000
+# mensajes por comando del actor dentro de think_batch (entre tramos se
+# atienden las demás peticiones)
+BATCH_CHUNK = 50
+# mantenimiento: segundos sin interacciones / como mucho desde la primera
+MAINTENANCE_DEBOUNCE = 10
+MAINTENANCE_MAX_DELAY = 60
+
+# solo el proceso que tiene este lock ejecuta los bucles de fondo
+LEADER_LOCK_FILE = "background.lock"
+LEADER = LeaderElection(LEADER_LOCK_FILE)
+
+
+# tamaño de las listas de memoria en /metrics (leído en cada scrape, sin
+# pasar por el actor: un scrape no espera a los lotes en curso)
+def _memory_sizes():
+    state = STORE.current()
+    if state is None:
+        return {}
+    return {f"list={key}": len(state.get(key) or [])
+            for key in ("short_memory", "long_memory")}
+
+
+metrics.gauge("memory_entries", "Entradas en cada lista de memoria.",
+              _memory_sizes)
 
 
 # ---------------------------------------------------------
@@ -29,47 +54,32 @@ AUTO_PROMOTE_SHORT_TO_LONG_EVERY = 30
 # ---------------------------------------------------------
 def add_short(state, text):
     """Añade un evento a short_memory con timestamp."""
-    if not isinstance(text, str):
-        text = str(text)
-
-    entry = {"ts": datetime.utcnow().isoformat(), "text": text}
-    state.setdefault("short_memory", []).append(entry)
-
-    # límite
-    if len(state["short_memory"]) > MAX_SHORT_MEM:
-        state["short_memory"] = state["short_memory"][-MAX_SHORT_MEM:]
+    memory.add_short_entry(state, text)
 
 
 def add_long(state, text):
     """Añade un evento a long_memory con timestamp."""
-    if not isinstance(text, str):
-        text = str(text)
-
-    entry = {"ts": datetime.utcnow().isoformat(), "text": text}
-    state.setdefault("long_memory", []).append(entry)
-
-    if len(state["long_memory"]) > MAX_LONG_MEM:
-        state["long_memory"] = state["long_memory"][-MAX_LONG_MEM:]
+    memory.memory_list(state, "long_memory").append(memory.make_entry(text))
 
+    memory_index.sync_state(state)
 
-def limit_memory(state, max_long=MAX_LONG_MEM, max_short=MAX_SHORT_MEM):
-    """Evita que crezcan demasiado las memorias."""
-    if isinstance(state.get("short_memory"), list):
-        state["short_memory"] = state["short_memory"][-max_short:]
-    if isinstance(state.get("long_memory"), list):
-        state["long_memory"] = state["long_memory"][-max_long:]
 
-
-def _promote_short_to_long_if_needed(state):
+def limit_memory(state, max_long=None, max_short=None):
     """
-    Promociona de short a long cada X mensajes.
-    En vez de copiar el último literal, guarda un meta-evento más útil.
+    Evita que crezcan demasiado las memorias (por defecto memory.CAPACITY).
+    Las MemoryLog ya descartan al añadir y avisan al índice de retrieval,
+    así que normalmente esto solo compara longitudes.
     """
-    short = state.get("short_memory", [])
+    memory.bound(state, "short_memory", max_short)
+    memory.bound(state, "long_memory", max_long)
+    # cerca del límite: fusionar / descartar por valor antes de que la
+    # capacidad descarte a ciegas las más antiguas
+    consolidation.maybe_consolidate(state)
+
 
-    if len(short) and (len(short) % AUTO_PROMOTE_SHORT_TO_LONG_EVERY == 0):
-        last = short[-1].get("text", "")
-        add_long(state, f"Promoción automática desde short_memory: {last}")
+def _promote_short_to_long_if_needed(state):
+    """Promociona de short a long (ver consolidation.promote_short)."""
+    consolidation.promote_short(state)
 
 
 # ---------------------------------------------------------
@@ -78,102 +88,188 @@ def _promote_short_to_long_if_needed(state):
 def think(message):
     """
     Punto único utilizado por server/api:
-    - carga estado
+    - se ejecuta en el hilo del actor de estado (serializado)
     - genera respuesta vía agent_reply
     - registra memoria
-    - guarda estado
+    - el actor guarda el estado al cerrar el lote
     """
-    with _state_lock:
-        state = load_state()
+    return ACTOR.call(_think, message)
+
+
+def _think(state, message, memories=None):
+    ai_response = _reply_and_record(state, message, memories)
+    limit_memory(state)
+    return ai_response
 
-        # Generar respuesta
-        try:
-            ai_response = agent.agent_reply(message, state)
-        except Exception as e:
-            ai_response = f"Error interno en agent_reply: {e}"
 
-        # Registrar memorias
-        add_short(state, f"USER: {message}")
-        add_short(state, f"ASSISTANT: {ai_response}")
+def _reply_and_record(state, message, memories=None):
+    # Generar respuesta (memories: recuerdos ya recuperados, opcional)
+    try:
+        ai_response = agent.agent_reply(message, state, memories)
+    except Exception as e:
+        ai_response = f"Error interno en agent_reply: {e}"
 
-        # Mantenimiento de memoria
-        _promote_short_to_long_if_needed(state)
-        limit_memory(state)
+    # Registrar memorias
+    add_short(state, f"USER: {message}")
+    add_short(state, f"ASSISTANT: {ai_response}")
 
-        # Guardar
-        save_state(state)
+    # Mantenimiento de memoria
+    _promote_short_to_long_if_needed(state)
 
     return ai_response
 
 
+def think_batch(messages, session=None):
+    """
+    Procesa una lista de mensajes en orden, en tramos de BATCH_CHUNK:
+    cada tramo es un comando del actor con UN guardado al final (replay
+    de conversaciones, precalentar memoria, pruebas de carga), y entre
+    tramos el actor atiende las demás peticiones.
+    session: id de sesión (sessions.py); si no, el estado global.
+    Devuelve respuestas y tiempos por mensaje.
+    """
+    chunks = batch_chunks(messages)
+    start = time.perf_counter()
+    results = []
+    for chunk in chunks:
+        results.extend(submit_batch_chunk(chunk, session).result())
+    return batch_result(results, start)
+
+
+def batch_chunks(messages):
+    """Mensajes como texto en tramos de BATCH_CHUNK (ValueError si sobran)."""
+    messages = [m if isinstance(m, str) else str(m) for m in messages]
+    if len(messages) > MAX_BATCH_MESSAGES:
+        raise ValueError(f"como máximo {MAX_BATCH_MESSAGES} mensajes por lote")
+    return [messages[i:i + BATCH_CHUNK]
+            for i in range(0, len(messages), BATCH_CHUNK)]
+
+
+def submit_batch_chunk(chunk, session=None):
+    """Encola un tramo en el actor (global o de la sesión); Future."""
+    if session:
+        from sessions import SESSIONS
+        return SESSIONS.submit(session, _think_batch, chunk)
+    return ACTOR.submit(_think_batch, chunk)
+
+
+def batch_result(results, start):
+    """Respuesta de think_batch (start: perf_counter al empezar)."""
+    total_ms = (time.perf_counter() - start) * 1000
+    think_ms = sum(r["ms"] for r in results)
+    return {
+        "results": results,
+        "count": len(results),
+        "think_ms": round(think_ms, 3),
+        # incluye la espera en cola y el guardado final
+        "total_ms": round(total_ms, 3),
+    }
+
+
+def _think_batch(state, messages):
+    results = []
+    for message in messages:
+        t = time.perf_counter()
+        ai_response = _reply_and_record(state, message)
+        results.append({
+            "message": message,
+            "response": ai_response,
+            "ms": round((time.perf_counter() - t) * 1000, 3),
+        })
+    limit_memory(state)
+    return results
+
+
 # ---------------------------------------------------------
 # Background loops
 # ---------------------------------------------------------
 _background_started = False
 
 
-def _maintenance_loop():
-    """Normalización periódica del estado."""
-    while True:
+def _maintain(state):
+    meta = state.get("meta", {})
+
+    # Normalización segura 0-1
+    def clamp(v, low=0.0, high=1.0):
+        try:
+            return min(max(float(v), low), high)
+        except:
+            return 0.5
+
+    meta["curiosity"] = clamp(meta.get("curiosity", 0.3))
+    meta["coherence"] = clamp(meta.get("coherence", 0.4))
+    state["meta"] = meta
+
+    # Ajuste evolutivo simple
+    if len(state.get("short_memory", [])) > 200:
+        meta["curiosity"] = clamp(meta["curiosity"] + 0.005)
+    else:
+        meta["curiosity"] = clamp(meta["curiosity"] - 0.001)
+
+    # Incremento de versión suave
+    try:
+        state["version"] = round(float(state.get("version", 1.0)) + 0.0001, 6)
+    except:
+        state["version"] = state.get("version", 1.0)
+
+    limit_memory(state)
+
+
+def _maintenance_job():
+    """Normalización del estado (vía el actor de estado)."""
+    try:
+        ACTOR.call(_maintain)
+
+    except Exception as e:
+        try:
+            os.makedirs("logs", exist_ok=True)
+            with open("logs/maintenance_errors.log", "a") as f:
+                f.write(f"{time.time()} maintenance error: {repr(e)}\n")
+        except:
+            pass
+
+
+def _consolidation_job():
+    try:
+        ACTOR.call(consolidation.consolidate)
+    except Exception as e:
         try:
-            with _state_lock:
-                state = load_state()
-                meta = state.get("meta", {})
-
-                # Normalización segura 0-1
-                def clamp(v, low=0.0, high=1.0):
-                    try:
-                        return min(max(float(v), low), high)
-                    except:
-                        return 0.5
-
-                meta["curiosity"] = clamp(meta.get("curiosity", 0.3))
-                meta["coherence"] = clamp(meta.get("coherence", 0.4))
-                state["meta"] = meta
-
-                # Ajuste evolutivo simple
-                if len(state.get("short_memory", [])) > 200:
-                    meta["curiosity"] = clamp(meta["curiosity"] + 0.005)
-                else:
-                    meta["curiosity"] = clamp(meta["curiosity"] - 0.001)
-
-                # Incremento de versión suave
-                try:
-                    state["version"] = round(float(state.get("version", 1.0)) + 0.0001, 6)
-                except:
-                    state["version"] = state.get("version", 1.0)
-
-                # Guardar
-                limit_memory(state)
-                save_state(state)
-
-        except Exception as e:
-            try:
-                os.makedirs("logs", exist_ok=True)
-                with open("logs/maintenance_errors.log", "a") as f:
-                    f.write(f"{time.time()} maintenance error: {repr(e)}\n")
-            except:
-                pass
-
-        time.sleep(10)
+            os.makedirs("logs", exist_ok=True)
+            with open("logs/maintenance_errors.log", "a") as f:
+                f.write(f"{time.time()} consolidation error: {repr(e)}\n")
+        except:
+            pass
 
 
 def run_background_thread():
-    """Arranca mantenimiento + evolución si no están iniciados."""
+    """
+    Arranca mantenimiento + evolución si no están iniciados.
+    Con varios workers (gunicorn) solo el proceso líder los ejecuta; el
+    resto espera en segundo plano por si el líder muere.
+    """
     global _background_started
     if _background_started:
         return
 
     _background_started = True
+    LEADER.run_when_leader(_start_background_loops)
+
+
+def _start_background_loops():
+    # mantenimiento: tras cada ráfaga de interacciones (no cada 10 s); las
+    # de los demás workers llegan por evolution_engine._watch_interactions
+    SCHEDULER.add("maintenance", _maintenance_job, on=("interaction",),
+                  debounce=MAINTENANCE_DEBOUNCE,
+                  max_delay=MAINTENANCE_MAX_DELAY)
 
-    # hilo mantenimiento
-    t1 = threading.Thread(target=_maintenance_loop, daemon=True)
-    t1.start()
+    # consolidación de long_memory (fusión de duplicados, descarte por valor)
+    SCHEDULER.add("consolidation", _consolidation_job, on=("interaction",),
+                  after=consolidation.CONSOLIDATE_EVERY,
+                  min_interval=consolidation.CONSOLIDATE_MIN_INTERVAL)
 
-    # hilo evolución adaptativa
+    # evolución adaptativa + poda
     try:
-        t2 = threading.Thread(target=auto_evolution_loop, daemon=True)
-        t2.start()
+        evolution_engine.schedule_jobs(SCHEDULER)
     except Exception:
         try:
             os.makedirs("logs", exist_ok=True)
@@ -181,3 +277,10 @@ def run_background_thread():
                 f.write("Error iniciando evolution_engine\n")
         except:
             pass
+
+    SCHEDULER.start()
+
+
+def stop_background():
+    """Apagado limpio: no lanza más trabajos y espera a los que corren."""
+    SCHEDULER.shutdown(wait=True)
@@ -6,47 +6,186 @@ NO escribe en disco.
 Solo opera sobre el diccionario de estado.
 """
 
+import os
 import time
-from datetime import datetime
 
-# límites sugeridos (coherentes con main.py)
-MAX_SHORT = 300
-MAX_LONG = 1000
+from memory_log import MEMORY_KEYS, MemoryLog, to_ts
+
+# capacidad de cada memoria (entradas); al llenarse se descartan las más
+# antiguas. Un único sitio para main.py, state_manager.py e ingest.py.
+MAX_SHORT = int(os.environ.get("PRIMORDIAL_MAX_SHORT", "300"))
+MAX_LONG = int(os.environ.get("PRIMORDIAL_MAX_LONG", "1000"))
+CAPACITY = {"short_memory": MAX_SHORT, "long_memory": MAX_LONG}
 
 
 # ---------------------------------------------------------
-# SHORT MEMORY
+# CREACIÓN DE ENTRADAS (timestamps float, epoch UTC)
 # ---------------------------------------------------------
-def add_short_entry(state, text, limit=MAX_SHORT):
-    """Añade una entrada a short_memory (RAM solamente)."""
+def make_entry(text, ts=None, importance=None):
+    """Entrada de memoria; ts float (acepta ISO), importance opcional."""
     if not isinstance(text, str):
         text = str(text)
+    ts = to_ts(ts) if ts is not None else None
+    entry = {"ts": time.time() if ts is None else ts, "text": text}
+    if importance is not None:
+        entry["importance"] = importance
+    return entry
+
+
+def memory_list(state, key):
+    """
+    La MemoryLog de state[key] (convierte una lista si hace falta), acotada
+    a CAPACITY[key].
+    """
+    value = state.get(key)
+    if not isinstance(value, MemoryLog):
+        value = MemoryLog(value if isinstance(value, list) else (),
+                          maxlen=CAPACITY.get(key))
+        state[key] = value
+    return value
+
+
+def set_capacity(key, limit, state=None):
+    """
+    Cambia la capacidad de una memoria (y la de state[key] si se pasa).
+    Si baja, descarta ya las más antiguas.
+    """
+    CAPACITY[key] = limit
+    if state is not None:
+        bound(state, key)
+
+
+def bound(state, key, limit=None):
+    """
+    Aplica la capacidad a state[key]: O(1) si ya cabe (el recorte lo
+    hace la propia MemoryLog al añadir). Devuelve las descartadas.
+    """
+    limit = CAPACITY.get(key) if limit is None else limit
+    value = memory_list(state, key)
+    before = len(value)
+    if value.maxlen != limit:
+        value.maxlen = limit
+    return before - len(value)
+
+
+def columnar(state):
+    """Convierte short_memory / long_memory del estado a MemoryLog."""
+    for key in MEMORY_KEYS:
+        memory_list(state, key)
+    return state
+
+
+def trim(state, key, limit):
+    """
+    Recorta state[key] a las limit más recientes, sin copiar la lista
+    (la capacidad no cambia: ver bound()).
+    """
+    value = state.get(key)
+    if isinstance(value, MemoryLog):
+        return value.trim_to(limit)
+    if isinstance(value, list) and len(value) > limit:
+        dropped = len(value) - limit
+        del value[:dropped]
+        return dropped
+    return 0
+
+
+# ---------------------------------------------------------
+# IDENTIDAD DE ENTRADAS
+# ---------------------------------------------------------
+def entry_text(entry):
+    """Texto de una entrada (dict o valor suelto)."""
+    if isinstance(entry, dict):
+        text = entry.get("text")
+        return text if isinstance(text, str) else ""
+    return str(entry) if entry is not None else ""
+
+
+def entry_key(entry):
+    """
+    Clave estable de una entrada: (texto, timestamp).
+    Acepta tanto "ts" como "timestamp" (entradas antiguas).
+    """
+    if isinstance(entry, dict):
+        return (entry_text(entry), entry.get("ts", entry.get("timestamp")))
+    return (entry_text(entry), None)
+
 
-    entry = {"ts": datetime.utcnow().isoformat(), "text": text}
-    state.setdefault("short_memory", []).append(entry)
+def align_entries(keys, entries, start=0, max_scan=4096):
+    """
+    Alinea una secuencia de claves conocidas (las de entries[start:] la
+    última vez que se vio la lista) con el contenido actual.
+    Solo contempla lo que hacen los helpers de memoria: añadir al final
+    y recortar por el principio.
+
+    Devuelve (descartadas, primera_nueva):
+      - descartadas: cuántas claves antiguas salieron por la cabeza
+      - primera_nueva: índice en entries de la primera entrada nueva
+    o None si no se puede alinear (hay que reconstruir).
+    Coste proporcional a lo añadido/descartado, no al tamaño de la lista.
+    """
+    n = len(entries)
+    known = len(keys)
+    if n <= start:
+        return (known, n)
+    if not known:
+        return (0, start)
+
+    tail = keys[-1]
+    if (n - start == known and entry_key(entries[-1]) == tail
+            and entry_key(entries[start]) == keys[0]):
+        return (0, n)
+
+    pos = None
+    for i in range(n - 1, max(start - 1, n - 1 - max_scan), -1):
+        if entry_key(entries[i]) == tail:
+            pos = i
+            break
+    if pos is None:
+        return None
 
-    # límite
-    if len(state["short_memory"]) > limit:
-        state["short_memory"] = state["short_memory"][-limit:]
+    dropped = known - (pos - start + 1)
+    if dropped < 0 or keys[dropped] != entry_key(entries[start]):
+        return None
+    return (dropped, pos + 1)
+
+
+# ---------------------------------------------------------
+# SHORT MEMORY
+# ---------------------------------------------------------
+def add_short_entry(state, text, limit=None):
+    """
+    Añade una entrada a short_memory (RAM solamente). Con limit, la lista
+    queda acotada a limit en vez de a su capacidad (ver bound()).
+    """
+    if limit is not None:
+        bound(state, "short_memory", limit)
+    memory_list(state, "short_memory").append(make_entry(text))
 
 
 # ---------------------------------------------------------
 # LONG MEMORY
 # ---------------------------------------------------------
-def add_long_entry(state, text, importance=0.5, limit=MAX_LONG):
+def make_long_entry(text, importance=0.5, ts=None):
+    """Entrada de long_memory (ts float o ISO; por defecto, ahora)."""
+    return make_entry(text, ts, importance)
+
+
+def add_long_entry(state, text, importance=0.5, limit=None):
     """Añade una entrada a long_memory sin guardar en disco."""
-    if not isinstance(text, str):
-        text = str(text)
+    extend_long_entries(state, [make_long_entry(text, importance)], limit)
 
-    entry = {
-        "ts": datetime.utcnow().isoformat(),
-        "text": text,
-        "importance": importance
-    }
-    state.setdefault("long_memory", []).append(entry)
 
-    if len(state["long_memory"]) > limit:
-        state["long_memory"] = state["long_memory"][-limit:]
+def extend_long_entries(state, entries, limit=None):
+    """
+    Añade varias entradas a long_memory (importaciones masivas, ver
+    ingest.py). Sin guardar en disco. Con limit, la lista queda acotada a
+    limit en vez de a su capacidad: la cota se cambia ANTES de añadir,
+    porque la MemoryLog ya recorta a su capacidad dentro de extend().
+    """
+    if limit is not None:
+        bound(state, "long_memory", limit)
+    memory_list(state, "long_memory").extend(entries)
 
 
 # ---------------------------------------------------------
@@ -0,0 +1,321 @@
+# memory_dedupe.py
+"""
+Detección de casi duplicados en long_memory con SimHash + LSH.
+
+- Huella SimHash de 64 bits sobre palabras y pares de palabras del texto
+  normalizado (memory_index.normalize): "Hola", "hola!" y "HOLA." dan la
+  misma huella; textos parecidos, huellas a pocos bits de distancia.
+  Un texto sin palabras (emoji, "¿?") no tiene huella y nunca es duplicado.
+- LSH: la huella se parte en BANDS bandas de 64/BANDS bits, cada una con
+  su diccionario banda -> documentos. Con MAX_DISTANCE < BANDS, dos
+  huellas a esa distancia comparten al menos una banda, así que basta
+  mirar esos cubos (coste sublineal, sin falsos negativos).
+- DedupeIndex es un SyncedIndex: sigue a long_memory con sus números de
+  secuencia y suelta lo descartado por on_evict (ver memory_index).
+
+En línea (reasoning.synthesize): un mensaje casi igual a una entrada ya
+guardada no se añade; se cuenta para esa entrada (en el índice de su
+MemoryLog: estado global y cada sesión por separado) y consolidation.py
+lo vuelca en su "count" en la próxima reescritura.
+
+Fuera de línea, sobre un state.json exportado:
+    python memory_dedupe.py state.json [--out limpio.json]
+        [--keys long_memory,short_memory] [--distance 3] [--dry-run]
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import weakref
+from collections import Counter
+from functools import lru_cache
+from hashlib import blake2b
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import memory_index
+import metrics
+from memory import entry_text, memory_list
+from memory_log import MemoryLog
+
+BITS = 64
+BANDS = 4
+BAND_BITS = BITS // BANDS
+# bits distintos como máximo para considerar dos textos duplicados
+MAX_DISTANCE = 3
+# rasgos por texto (cada contador de bit ocupa un byte)
+MAX_FEATURES = 255
+
+_TOKEN = re.compile(r"\w+")
+_BAND_MASK = (1 << BAND_BITS) - 1
+
+# byte -> sus 8 bits repartidos en 8 bytes (uno por bit)
+_SPREAD_BYTE = [sum(((b >> k) & 1) << (8 * k) for k in range(8))
+                for b in range(256)]
+
+_lock = threading.Lock()
+# totales del proceso para /metrics
+_totals = {"checked": 0, "skipped": 0}
+
+
+# -------------------------
+# huella
+# -------------------------
+def features(text: str) -> List[str]:
+    words = _TOKEN.findall(memory_index.normalize(text))
+    pairs = [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return (words + pairs)[:MAX_FEATURES]
+
+
+@lru_cache(maxsize=65536)
+def _spread(feature: str) -> int:
+    """Hash de 64 bits del rasgo con cada bit en su propio byte."""
+    h = int.from_bytes(blake2b(feature.encode("utf-8"),
+                               digest_size=8).digest(), "little")
+    out = 0
+    for i in range(8):
+        out |= _SPREAD_BYTE[(h >> (8 * i)) & 255] << (64 * i)
+    return out
+
+
+def simhash(text: str) -> Optional[int]:
+    """
+    SimHash de 64 bits: bit k = mayoría de los bits k de los hashes de
+    los rasgos. Los contadores se suman todos a la vez (un byte por bit).
+    None si el texto no tiene rasgos.
+    """
+    feats = features(text)
+    if not feats:
+        return None
+    counts = sum(map(_spread, feats)).to_bytes(BITS, "little")
+    half = len(feats)
+    fp = 0
+    for k, c in enumerate(counts):
+        if 2 * c > half:
+            fp |= 1 << k
+    return fp
+
+
+def distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(fp: int) -> List[int]:
+    return [(fp >> (BAND_BITS * i)) & _BAND_MASK for i in range(BANDS)]
+
+
+# -------------------------
+# índice LSH
+# -------------------------
+class DedupeIndex(memory_index.SyncedIndex):
+    """Huellas de la ventana de long_memory en cubos por banda."""
+
+    def __init__(self):
+        # duplicados vistos por texto de la entrada que se queda,
+        # pendientes de volcar en "count" (sobreviven a rebuild())
+        self.pending: Counter = Counter()
+        super().__init__()
+
+    def _clear_docs(self) -> None:
+        self._fps: Dict[int, int] = {}
+        self._buckets: List[Dict[int, Set[int]]] = [{} for _ in range(BANDS)]
+
+    def _add_doc(self, doc_id: int, text: str) -> None:
+        fp = simhash(text)
+        if fp is None:
+            return
+        self._fps[doc_id] = fp
+        for band, value in zip(self._buckets, _bands(fp)):
+            band.setdefault(value, set()).add(doc_id)
+
+    def _drop_doc(self, doc_id: int) -> None:
+        fp = self._fps.pop(doc_id, None)
+        if fp is None:
+            return
+        for band, value in zip(self._buckets, _bands(fp)):
+            docs = band.get(value)
+            if docs is not None:
+                docs.discard(doc_id)
+                if not docs:
+                    del band[value]
+
+    def nearest(self, text: str, max_distance: int = MAX_DISTANCE
+                ) -> Optional[Tuple[int, int]]:
+        """(posición en la ventana, distancia) del más parecido, o None."""
+        fp = simhash(text)
+        if fp is None:
+            return None
+        best = None
+        with self._lock:
+            for band, value in zip(self._buckets, _bands(fp)):
+                for doc_id in band.get(value, ()):
+                    d = distance(fp, self._fps[doc_id])
+                    # a igual distancia, la más reciente
+                    if d <= max_distance and (best is None or
+                                              (d, -doc_id) < (best[1], -best[0])):
+                        best = (doc_id, d)
+            if best is None:
+                return None
+            return best[0] - self._ids[0], best[1]
+
+    def search(self, query: str, top_k: int = 5,
+               threshold: Optional[float] = None) -> List[Tuple[float, str]]:
+        return []
+
+
+# un índice por MemoryLog (estado global y sesiones); se suelta con ella
+_indexes: Dict[int, DedupeIndex] = {}
+
+
+def index_for(lm: MemoryLog) -> DedupeIndex:
+    index = _indexes.get(id(lm))
+    if index is None:
+        with _lock:
+            index = _indexes.get(id(lm))
+            if index is None:
+                index = _indexes[id(lm)] = DedupeIndex()
+                weakref.finalize(lm, _indexes.pop, id(lm), None)
+    return index
+
+
+def find_duplicate(state: Dict[str, Any], text: str,
+                   max_distance: int = MAX_DISTANCE) -> Optional[int]:
+    """Posición en long_memory de una entrada casi igual a text, o None."""
+    lm = memory_list(state, "long_memory")
+    if not len(lm):
+        return None
+    index = index_for(lm)
+    index.sync(lm)
+    found = index.nearest(text, max_distance)
+    if found is None:
+        return None
+    return len(lm) - len(index) + found[0]
+
+
+def add_unique(state: Dict[str, Any], entry: Dict[str, Any],
+               max_distance: int = MAX_DISTANCE) -> bool:
+    """
+    Añade entry a long_memory salvo que ya haya una casi igual; en ese
+    caso la cuenta como repetición de aquella. True si se añadió.
+    """
+    text = entry_text(entry)
+    pos = find_duplicate(state, text, max_distance)
+    lm = memory_list(state, "long_memory")
+    index = index_for(lm)
+    with _lock:
+        _totals["checked"] += 1
+        if pos is not None:
+            _totals["skipped"] += 1
+            index.pending[lm.text(pos)] += 1
+    if pos is not None:
+        return False
+    lm.append(entry)
+    return True
+
+
+def take_pending(lm: MemoryLog) -> Counter:
+    """Repeticiones por texto pendientes de volcar en lm (las vacía)."""
+    index = _indexes.get(id(lm))
+    if index is None:
+        return Counter()
+    with _lock:
+        taken, index.pending = index.pending, Counter()
+    return taken
+
+
+def return_pending(lm: MemoryLog, taken: Counter) -> None:
+    index = _indexes.get(id(lm))
+    if index is None or not taken:
+        return
+    with _lock:
+        index.pending.update(taken)
+
+
+def _stats() -> Dict[str, float]:
+    with _lock:
+        return {f"result={k}": v for k, v in _totals.items()}
+
+
+metrics.gauge("near_duplicates", "Mensajes comprobados / descartados por "
+              "casi duplicados (SimHash).", _stats)
+
+
+# -------------------------
+# pasada fuera de línea
+# -------------------------
+def dedupe_entries(entries: List[Any], max_distance: int = MAX_DISTANCE
+                   ) -> Tuple[List[Any], int]:
+    """
+    Colapsa casi duplicados en la entrada más reciente de cada grupo
+    (suma "count", importancia máxima). Devuelve (entradas, colapsadas).
+    """
+    index = DedupeIndex()
+    kept: List[Any] = []
+    collapsed = 0
+    for entry in reversed(entries):
+        text = entry_text(entry)
+        found = index.nearest(text, max_distance) if text else None
+        if found is None:
+            index.add(entry)
+            kept.append(dict(entry) if isinstance(entry, dict) else entry)
+            continue
+        collapsed += 1
+        target = kept[found[0]]
+        if isinstance(target, dict):
+            extra = entry.get("count", 1) if isinstance(entry, dict) else 1
+            target["count"] = target.get("count", 1) + extra
+            imp = entry.get("importance") if isinstance(entry, dict) else None
+            current = target.get("importance")
+            # sin importance (o no numérica) en la que se queda: la del duplicado
+            if isinstance(imp, (int, float)) and (
+                    not isinstance(current, (int, float)) or imp > current):
+                target["importance"] = imp
+    kept.reverse()
+    return kept, collapsed
+
+
+def _main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source", help="state.json (estado completo en JSON)")
+    parser.add_argument("--out", help="fichero de salida (por defecto, el "
+                                      "mismo, guardando <source>.bak)")
+    parser.add_argument("--keys", default="long_memory",
+                        help="listas a deduplicar, separadas por comas")
+    parser.add_argument("--distance", type=int, default=MAX_DISTANCE,
+                        help=f"bits distintos como máximo (< {BANDS})")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="solo mostrar cuántas se colapsarían")
+    args = parser.parse_args(argv)
+    if not 0 <= args.distance < BANDS:
+        parser.error(f"--distance debe estar entre 0 y {BANDS - 1}")
+
+    with open(args.source, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    report = {}
+    for key in [k.strip() for k in args.keys.split(",") if k.strip()]:
+        entries = state.get(key)
+        if not isinstance(entries, list):
+            continue
+        kept, collapsed = dedupe_entries(entries, args.distance)
+        report[key] = {"before": len(entries), "after": len(kept),
+                       "collapsed": collapsed}
+        state[key] = kept
+
+    if not args.dry_run:
+        out = args.out or args.source
+        tmp = out + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        if out == args.source:
+            shutil.copy2(args.source, args.source + ".bak")
+        os.replace(tmp, out)
+        report["out"] = out
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,411 @@
+# memory_index.py
+"""
+Índice de recuperación persistente (en proceso) sobre long_memory.
+
+- Texto normalizado precalculado por entrada.
+- Postings de trigramas de caracteres -> ids de documento.
+- Se sincroniza de forma incremental con la lista long_memory:
+  detecta entradas nuevas al final y recortes por el principio
+  sin recorrer toda la lista. Con una MemoryLog usa sus números de
+  secuencia y suelta lo descartado en cuanto se descarta (on_evict).
+- La búsqueda solo visita los documentos que comparten trigramas
+  con la consulta (coste proporcional a los candidatos, no a la ventana).
+- Caché LRU de resultados por consulta normalizada: una consulta repetida
+  solo puntúa las entradas añadidas desde la última vez (O(nuevas)); se
+  recalcula si se descartó alguna entrada del resultado o si el índice se
+  reconstruyó. cache_stats() / /metrics: aciertos y fallos.
+
+NO carga ni guarda estado en disco.
+"""
+
+import contextvars
+import heapq
+import os
+import re
+import threading
+import unicodedata
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+from memory import align_entries, entry_key, entry_text
+from memory_log import MemoryLog
+
+# backend de retrieval: "index" (trigramas), "numpy" (matriz hasheada),
+# "fts" (FTS5 del motor SQLite, PRIMORDIAL_STORAGE=sqlite)
+# o "difflib" (escaneo lineal original, para comparar)
+BACKEND = os.environ.get("PRIMORDIAL_RETRIEVAL", "index")
+# ventana de long_memory cubierta por el índice
+WINDOW = 100000
+# cuántas entradas hacia atrás se buscan para alinear el índice con la lista
+MAX_ALIGN_SCAN = 4096
+# consultas recordadas por índice (0 = sin caché)
+CACHE_SIZE = int(os.environ.get("PRIMORDIAL_RETRIEVAL_CACHE", "256"))
+
+_WS = re.compile(r"\s+")
+
+
+# -------------------------
+# normalización
+# -------------------------
+def normalize(text: str) -> str:
+    """minúsculas, sin acentos, espacios colapsados."""
+    if not text:
+        return ""
+    t = text.lower()
+    if not t.isascii():
+        t = unicodedata.normalize("NFKD", t)
+        t = "".join(c for c in t if not unicodedata.combining(c))
+    return _WS.sub(" ", t).strip()
+
+
+def trigrams(norm: str) -> set:
+    """Trigramas de caracteres con relleno en los bordes."""
+    if not norm:
+        return set()
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# -------------------------
+# base: alineación incremental con una lista de entradas
+# -------------------------
+class SyncedIndex:
+    """
+    Base de los índices de retrieval.
+    Mantiene self._ids / self._keys (deques paralelas de doc_id y clave)
+    alineadas con una ventana de long_memory. Los ids de documento son
+    monótonos: el más antiguo a la izquierda, el más reciente a la derecha.
+    Las subclases implementan _clear_docs/_add_doc/_drop_doc y
+    _search_ids (la búsqueda real, con la caché de search() delante).
+
+    Con una MemoryLog, tras la primera alineación el índice queda enganchado
+    a ella: self._first_seq es la secuencia de self._ids[0], los descartes
+    llegan por on_evict y sync() solo añade desde end_seq, sin comparar
+    claves. Si es otra lista se vuelve a alinear por claves; si es la misma
+    pero reescrita (generation cambia), se reconstruye.
+    """
+
+    # umbral por defecto de search() (depende de la escala del score)
+    THRESHOLD = 0.15
+    # el score de un documento no depende de los demás: un resultado en
+    # caché se completa puntuando solo los documentos nuevos
+    INCREMENTAL = True
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._log = None
+        self._evict_hook = None
+        self.clear()
+
+    def _clear_docs(self) -> None:
+        raise NotImplementedError
+
+    def _add_doc(self, doc_id: int, text: str) -> None:
+        raise NotImplementedError
+
+    def _drop_doc(self, doc_id: int) -> None:
+        raise NotImplementedError
+
+    # --- mantenimiento ---
+    def clear(self) -> None:
+        with self._lock:
+            self._ids: deque = deque()
+            self._keys: deque = deque()
+            self._next_id = 0
+            # (consulta normalizada, top_k, umbral) -> (ventana, resultado)
+            self._cache: OrderedDict = OrderedDict()
+            self._detach()
+            self._clear_docs()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, entry: Any) -> Optional[int]:
+        """Indexa una entrada al final. Devuelve su doc_id."""
+        with self._lock:
+            doc_id = self._next_id
+            self._next_id += 1
+            self._add_doc(doc_id, entry_text(entry))
+            self._ids.append(doc_id)
+            self._keys.append(entry_key(entry))
+            return doc_id
+
+    def drop_oldest(self, n: int) -> None:
+        """Elimina las n entradas más antiguas del índice."""
+        with self._lock:
+            n = max(0, min(n, len(self._ids)))
+            for _ in range(n):
+                self._keys.popleft()
+                self._drop_doc(self._ids.popleft())
+            self._first_seq += n
+
+    def drop_before(self, seq: int) -> None:
+        """Elimina las entradas con secuencia menor que seq."""
+        with self._lock:
+            self.drop_oldest(seq - self._first_seq)
+            if not self._ids:
+                self._first_seq = max(self._first_seq, seq)
+
+    # --- enganche a una MemoryLog ---
+    def _detach(self) -> None:
+        log = self._log() if self._log is not None else None
+        if log is not None:
+            log.remove_hook(self._evict_hook)
+        self._log = None
+        self._log_generation = None
+        self._first_seq = 0
+
+    def _attach(self, log: MemoryLog) -> None:
+        if self._log is None or self._log() is not log:
+            self._detach()
+            if self._evict_hook is None:
+                ref = weakref.ref(self)
+
+                def hook(log, first, n):
+                    index = ref()
+                    if index is None or not index._attached(log):
+                        return False
+                    index.drop_before(first + n)
+
+                self._evict_hook = hook
+            log.on_evict(self._evict_hook)
+            self._log = weakref.ref(log)
+        self._log_generation = log.generation
+        self._first_seq = log.end_seq - len(self._ids)
+
+    def source(self) -> Optional[MemoryLog]:
+        """La MemoryLog a la que está enganchado el índice (o None)."""
+        return self._log() if self._log is not None else None
+
+    def _attached(self, log: Any) -> bool:
+        return (self._log is not None and self._log() is log
+                and log.generation == self._log_generation)
+
+    def rebuild(self, entries: List[Any], start: int = 0) -> None:
+        with self._lock:
+            self.clear()
+            for i in range(start, len(entries)):
+                self.add(entries[i])
+
+    def sync(self, entries: List[Any], start: int = 0) -> None:
+        """
+        Alinea el índice con entries[start:] sin copiar la lista.
+        Caso normal (nada cambió / solo appends / recortes por cabeza):
+        coste proporcional a las entradas nuevas o eliminadas.
+        Si no se puede alinear, reconstruye.
+        """
+        with self._lock:
+            if self._attached(entries):
+                # los descartes ya llegaron por on_evict; queda la ventana
+                # y lo añadido desde la última vez
+                self.drop_before(entries.head_seq + start)
+                first_new = max(start, self._first_seq + len(self._ids)
+                                - entries.head_seq)
+                for i in range(first_new, len(entries)):
+                    self.add(entries[i])
+                return
+            if self._log is not None and self._log() is entries:
+                # misma lista reescrita por el medio: las claves de los
+                # extremos no bastan para alinear
+                aligned = None
+            else:
+                aligned = align_entries(self._keys, entries, start,
+                                        MAX_ALIGN_SCAN)
+            if aligned is None:
+                self.rebuild(entries, start)
+            else:
+                dropped, first_new = aligned
+                self.drop_oldest(dropped)
+                for i in range(first_new, len(entries)):
+                    self.add(entries[i])
+            if isinstance(entries, MemoryLog):
+                self._attach(entries)
+
+    # --- consulta ---
+    def _search_ids(self, query: str, top_k: int, threshold: float,
+                    doc_ids: Optional[range] = None
+                    ) -> List[Tuple[float, int, str]]:
+        """
+        [(score, doc_id, texto)] del top-k, de mayor a menor (a igual
+        score, el doc_id mayor). doc_ids: puntuar solo esos documentos.
+        """
+        raise NotImplementedError
+
+    def search(self, query: str, top_k: int = 5,
+               threshold: Optional[float] = None) -> List[Tuple[float, str]]:
+        """[(score, texto)] del top-k, con la caché de consultas delante."""
+        if threshold is None:
+            threshold = self.THRESHOLD
+        if CACHE_SIZE <= 0:
+            return [(s, t) for s, _d, t in
+                    self._search_ids(query, top_k, threshold)]
+        key = (normalize(query), top_k, threshold)
+        with self._lock:
+            first = self._ids[0] if self._ids else self._next_id
+            window = (first, self._next_id)
+            cached = self._cache.get(key)
+            results = None
+            if cached is not None:
+                (_first, upto), results = cached
+                if any(d < first for _s, d, _t in results) or (
+                        cached[0] != window and not self.INCREMENTAL):
+                    # salió una entrada del resultado: recalcular
+                    results = None
+                elif upto != self._next_id:
+                    fresh = self._search_ids(
+                        query, top_k, threshold,
+                        range(max(upto, first), self._next_id))
+                    results = heapq.nlargest(top_k, results + fresh,
+                                             key=lambda x: (x[0], x[1]))
+                    _count("incremental")
+                else:
+                    _count("hits")
+            if results is None:
+                _count("misses")
+                results = self._search_ids(query, top_k, threshold)
+            self._cache[key] = (window, results)
+            self._cache.move_to_end(key)
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return [(s, t) for s, _d, t in results]
+
+
+# -------------------------
+# índice de trigramas
+# -------------------------
+class TrigramIndex(SyncedIndex):
+    """Índice invertido de trigramas: postings gram -> {doc_id}."""
+
+    def _clear_docs(self) -> None:
+        self._docs: Dict[int, Tuple[str, int, frozenset]] = {}
+        self._postings: Dict[str, set] = {}
+
+    def _add_doc(self, doc_id: int, text: str) -> None:
+        grams = frozenset(trigrams(normalize(text)))
+        self._docs[doc_id] = (text, len(grams), grams)
+        for g in grams:
+            self._postings.setdefault(g, set()).add(doc_id)
+
+    def _drop_doc(self, doc_id: int) -> None:
+        _text, _size, grams = self._docs.pop(doc_id)
+        for g in grams:
+            posting = self._postings.get(g)
+            if posting is not None:
+                posting.discard(doc_id)
+                if not posting:
+                    del self._postings[g]
+
+    # --- consulta ---
+    def _search_ids(self, query: str, top_k: int, threshold: float,
+                    doc_ids: Optional[range] = None
+                    ) -> List[Tuple[float, int, str]]:
+        """
+        Score: coeficiente de Dice sobre trigramas (misma escala 0..1 que
+        SequenceMatcher.ratio()).
+        """
+        qgrams = trigrams(normalize(query))
+        if not qgrams:
+            return []
+        with self._lock:
+            counts: Dict[int, int] = {}
+            if doc_ids is None:
+                for g in qgrams:
+                    for doc_id in self._postings.get(g, ()):
+                        counts[doc_id] = counts.get(doc_id, 0) + 1
+            else:
+                for doc_id in doc_ids:
+                    doc = self._docs.get(doc_id)
+                    if doc is not None:
+                        counts[doc_id] = len(qgrams & doc[2])
+            qlen = len(qgrams)
+            scored = []
+            for doc_id, common in counts.items():
+                text, size, _grams = self._docs[doc_id]
+                score = 2.0 * common / (qlen + size)
+                if score > threshold:
+                    # a igualdad de score, preferir lo más reciente
+                    scored.append((score, doc_id, text))
+        return heapq.nlargest(top_k, scored, key=lambda x: (x[0], x[1]))
+
+
+# índice de proceso para el long_memory del estado global
+_INDEX = TrigramIndex()
+# índice propio del contexto actual (sesiones, ver sessions.py)
+_CURRENT = contextvars.ContextVar("memory_index_current", default=None)
+
+
+# aciertos / fallos de la caché de consultas (todos los índices)
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "incremental": 0, "misses": 0}
+
+
+def _count(what: str) -> None:
+    with _cache_lock:
+        _cache_stats[what] += 1
+
+
+def cache_stats() -> Dict[str, float]:
+    """hits (sin cambios), incremental (solo nuevas), misses y hit_rate."""
+    with _cache_lock:
+        stats = dict(_cache_stats)
+    total = stats["hits"] + stats["incremental"] + stats["misses"]
+    stats["hit_rate"] = round((stats["hits"] + stats["incremental"]) / total,
+                              4) if total else 0.0
+    return stats
+
+
+metrics.gauge("retrieval_cache", "Consultas de retrieval servidas por la "
+              "caché (hits, incremental) o calculadas (misses).",
+              lambda: {f"result={k}": v for k, v in cache_stats().items()
+                       if k != "hit_rate"})
+
+
+def new_index() -> SyncedIndex:
+    """Índice vacío del backend activo (uno por sesión)."""
+    if BACKEND == "numpy":
+        import memory_vectors
+        return memory_vectors.VectorIndex()
+    return TrigramIndex()
+
+
+@contextmanager
+def use_index(index: SyncedIndex):
+    """Durante el bloque, index_for() devuelve index en este hilo/contexto."""
+    token = _CURRENT.set(index)
+    try:
+        yield index
+    finally:
+        _CURRENT.reset(token)
+
+
+def index_for(state: Dict[str, Any]) -> SyncedIndex:
+    """
+    Índice del backend activo asociado al estado: el del contexto si hay
+    uno (use_index), si no el índice del proceso para el estado global.
+    """
+    current = _CURRENT.get()
+    if current is not None:
+        return current
+    if BACKEND == "numpy":
+        import memory_vectors  # numpy solo se importa si se usa
+        return memory_vectors.index_for(state)
+    if BACKEND == "fts":
+        import sqlite_store
+        index = sqlite_store.fts_index()
+        # sin motor SQLite activo se usa el índice de trigramas
+        if index is not None:
+            return index
+    return _INDEX
+
+
+def sync_state(state: Dict[str, Any]) -> Optional[SyncedIndex]:
+    """Sincroniza el índice con las últimas WINDOW entradas de long_memory."""
+    if BACKEND == "difflib":
+        return None
+    lm = state.get("long_memory", [])
+    index = index_for(state)
+    index.sync(lm, max(0, len(lm) - WINDOW))
+    return index
@@ -0,0 +1,462 @@
+# memory_log.py
+"""
+MemoryLog: short_memory / long_memory guardadas por columnas.
+
+Una entrada {"ts": ..., "text": ..., "importance": ...} no se guarda
+como dict sino repartida en columnas:
+    ts          array('d')   timestamp float (epoch UTC); NaN si no hay
+    importance  array('d')   NaN si la entrada no la tiene
+    role        array('B')   código internado del prefijo "USER: ",
+                             "ASSISTANT: ", "WHATSAPP <id>: "... (0 = ninguno)
+    text        bytearray    UTF-8 del texto sin el prefijo, con offset y
+                             longitud por entrada (array('Q') / array('I'))
+    extra       dict         claves poco frecuentes, solo en las entradas
+                             que las tienen
+Con 100k entradas ocupa unas 5 veces menos que la lista de dicts
+(sin objeto dict, float ni str por entrada).
+
+Se comporta como una lista de dicts (len, índices, slices, iteración,
+append/extend, del lst[:n]); cada acceso materializa el dict, así que
+modificar ese dict no cambia la entrada: para eso está __setitem__.
+Recortar por la cabeza (trim_to / del lst[:n]) es O(1): avanza un
+offset y las columnas se compactan de vez en cuando (coste amortizado).
+
+Buffer acotado: con maxlen, append/extend descartan las más antiguas
+(como deque(maxlen=...)). Cada entrada tiene un número de secuencia
+absoluto (head_seq .. end_seq) y on_evict(fn) avisa de los descartes
+por la cabeza, para que los índices (memory_index) suelten esas
+entradas sin volver a comparar la lista.
+
+Los timestamps se unifican a float: "ts" ISO (datetime.utcnow) o la
+clave "timestamp" se convierten al crear la entrada.
+
+Serialización: to_list() / plain_state() devuelven la forma JSON de
+siempre (lista de dicts).
+"""
+
+import itertools
+import math
+import re
+import sys
+from array import array
+from collections.abc import MutableSequence
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# claves del estado que se guardan como MemoryLog
+MEMORY_KEYS = ("short_memory", "long_memory")
+
+# compactar cuando lo descartado (cabeza o textos reemplazados) supera
+# esto y además lo que sigue vivo
+COMPACT_MIN = 1024
+
+_NAN = float("nan")
+_RAW = "\x00raw"
+
+# prefijos de rol internados; el código cabe en un byte
+_ROLES: List[str] = ["", "USER: ", "ASSISTANT: "]
+_ROLE_CODES: Dict[str, int] = {p: i for i, p in enumerate(_ROLES)}
+_ROLE_RE = re.compile(r"[A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ_]*(?: [^\s:]{1,32})?: ")
+_MAX_ROLES = 255
+
+# generaciones únicas en el proceso: dos listas distintas nunca coinciden
+_GENERATIONS = itertools.count(1)
+
+
+def to_ts(value: Any) -> Optional[float]:
+    """Timestamp float desde float/int o ISO (sin zona = UTC)."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    return None
+
+
+def _split_role(text: str) -> Tuple[int, str]:
+    m = _ROLE_RE.match(text)
+    if m is None:
+        return 0, text
+    prefix = m.group(0)
+    code = _ROLE_CODES.get(prefix)
+    if code is None:
+        if len(_ROLES) >= _MAX_ROLES:
+            return 0, text
+        code = len(_ROLES)
+        _ROLES.append(prefix)
+        _ROLE_CODES[prefix] = code
+    return code, text[len(prefix):]
+
+
+class MemoryLog(MutableSequence):
+
+    __slots__ = ("_ts", "_imp", "_role", "_off", "_len", "_blob",
+                 "_garbage", "_extra", "_head", "_maxlen", "_seq",
+                 "_generation", "_hooks", "__weakref__")
+
+    def __init__(self, entries: Iterable[Any] = (),
+                 maxlen: Optional[int] = None):
+        self._maxlen = maxlen
+        # secuencia absoluta de la entrada 0 (= descartadas por la cabeza)
+        self._seq = 0
+        # cambia con todo lo que no sea añadir al final o recortar la cabeza
+        self._generation = next(_GENERATIONS)
+        self._hooks: List[Callable[["MemoryLog", int, int], Any]] = []
+        self._clear_columns()
+        self.extend(entries)
+
+    def _clear_columns(self) -> None:
+        self._ts = array("d")
+        self._imp = array("d")
+        self._role = array("B")
+        self._off = array("Q")
+        self._len = array("I")
+        self._blob = bytearray()
+        # bytes del blob que ya no usa ninguna entrada
+        self._garbage = 0
+        # extras por índice físico (solo entradas con claves raras)
+        self._extra: Dict[int, Dict[str, Any]] = {}
+        self._head = 0
+
+    # --- columnas <-> dict ---
+    @staticmethod
+    def _split(entry: Any) -> Tuple[float, float, int, bytes, Optional[Dict]]:
+        if not isinstance(entry, dict):
+            return _NAN, _NAN, 0, b"", {_RAW: entry}
+        # caso habitual: {"ts": float, "text": str[, "importance": float]}
+        ts = entry.get("ts")
+        text = entry.get("text")
+        imp = entry.get("importance", _NAN)
+        if (type(ts) is float and type(text) is str and type(imp) is float
+                and len(entry) == (2 if imp is _NAN else 3)):
+            role, text = _split_role(text)
+            return ts, imp, role, text.encode("utf-8", "surrogatepass"), None
+        extra = None
+        ts = _NAN
+        text = ""
+        imp = _NAN
+        for key, value in entry.items():
+            if key in ("ts", "timestamp"):
+                converted = to_ts(value)
+                if converted is not None and not math.isnan(converted):
+                    ts = converted
+                    continue
+            elif key == "text" and isinstance(value, str):
+                text = value
+                continue
+            elif (key == "importance" and isinstance(value, (int, float))
+                  and not isinstance(value, bool)):
+                imp = float(value)
+                continue
+            if extra is None:
+                extra = {}
+            extra[key] = value
+        role, text = _split_role(text)
+        return ts, imp, role, text.encode("utf-8", "surrogatepass"), extra
+
+    def _text_at(self, j: int) -> str:
+        off = self._off[j]
+        raw = self._blob[off:off + self._len[j]]
+        return _ROLES[self._role[j]] + raw.decode("utf-8", "surrogatepass")
+
+    def _entry(self, j: int) -> Any:
+        extra = self._extra.get(j)
+        if extra is not None and _RAW in extra:
+            return extra[_RAW]
+        entry = {}
+        ts = self._ts[j]
+        if ts == ts:
+            entry["ts"] = ts
+        entry["text"] = self._text_at(j)
+        imp = self._imp[j]
+        if imp == imp:
+            entry["importance"] = imp
+        if extra:
+            entry.update(extra)
+        return entry
+
+    def _put(self, j: int, entry: Any) -> None:
+        ts, imp, role, raw, extra = self._split(entry)
+        self._ts[j] = ts
+        self._imp[j] = imp
+        self._role[j] = role
+        # el texto nuevo va al final del blob; el viejo queda como basura
+        self._garbage += self._len[j]
+        self._off[j] = len(self._blob)
+        self._len[j] = len(raw)
+        self._blob += raw
+        if extra:
+            self._extra[j] = extra
+        else:
+            self._extra.pop(j, None)
+        self._generation = next(_GENERATIONS)
+        self._maybe_compact()
+
+    # --- secuencia ---
+    def __len__(self) -> int:
+        return len(self._ts) - self._head
+
+    def _physical(self, i: int) -> int:
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("MemoryLog index out of range")
+        return self._head + i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._entry(self._head + k)
+                    for k in range(*i.indices(len(self)))]
+        return self._entry(self._physical(i))
+
+    def __iter__(self):
+        for j in range(self._head, len(self._ts)):
+            yield self._entry(j)
+
+    def __reversed__(self):
+        for j in range(len(self._ts) - 1, self._head - 1, -1):
+            yield self._entry(j)
+
+    def __setitem__(self, i, entry) -> None:
+        if isinstance(i, slice):
+            items = self.to_list()
+            items[i] = entry
+            self._reset(items)
+            return
+        self._put(self._physical(i), entry)
+
+    def __delitem__(self, i) -> None:
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1 and start == 0:
+                self.trim_head(max(0, stop))
+                return
+            items = self.to_list()
+            del items[i]
+            self._reset(items)
+            return
+        j = self._physical(i)
+        if j == self._head:
+            self.trim_head(1)
+            return
+        items = self.to_list()
+        del items[j - self._head]
+        self._reset(items)
+
+    def insert(self, i: int, entry: Any) -> None:
+        if i >= len(self):
+            self.append(entry)
+            return
+        items = self.to_list()
+        items.insert(i, entry)
+        self._reset(items)
+
+    def append(self, entry: Any) -> None:
+        ts, imp, role, raw, extra = self._split(entry)
+        if extra:
+            self._extra[len(self._ts)] = extra
+        self._ts.append(ts)
+        self._imp.append(imp)
+        self._role.append(role)
+        self._off.append(len(self._blob))
+        self._len.append(len(raw))
+        self._blob += raw
+        if self._maxlen is not None and len(self) > self._maxlen:
+            self.trim_head(len(self) - self._maxlen)
+
+    def extend(self, entries: Iterable[Any]) -> None:
+        if isinstance(entries, MemoryLog):
+            entries = entries.to_list()
+        # por columnas: un extend de array por columna en vez de n appends
+        split = self._split
+        base = len(self._ts)
+        pos = len(self._blob)
+        ts_col, imp_col, role_col, off_col, len_col = [], [], [], [], []
+        chunks = []
+        for k, entry in enumerate(entries):
+            ts, imp, role, raw, extra = split(entry)
+            if extra:
+                self._extra[base + k] = extra
+            ts_col.append(ts)
+            imp_col.append(imp)
+            role_col.append(role)
+            off_col.append(pos)
+            len_col.append(len(raw))
+            chunks.append(raw)
+            pos += len(raw)
+        self._ts.extend(ts_col)
+        self._imp.extend(imp_col)
+        self._role.extend(role_col)
+        self._off.extend(off_col)
+        self._len.extend(len_col)
+        self._blob += b"".join(chunks)
+        if self._maxlen is not None:
+            self.trim_to(self._maxlen)
+
+    def clear(self) -> None:
+        self.trim_head(len(self))
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (MemoryLog, list)):
+            return len(self) == len(other) and self.to_list() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"MemoryLog({len(self)} entradas)"
+
+    # --- capacidad y descartes ---
+    @property
+    def maxlen(self) -> Optional[int]:
+        return self._maxlen
+
+    @maxlen.setter
+    def maxlen(self, value: Optional[int]) -> None:
+        self._maxlen = None if value is None else max(0, int(value))
+        if self._maxlen is not None:
+            self.trim_to(self._maxlen)
+
+    @property
+    def head_seq(self) -> int:
+        """Secuencia absoluta de la entrada más antigua."""
+        return self._seq
+
+    @property
+    def end_seq(self) -> int:
+        """Secuencia que tendrá la próxima entrada añadida."""
+        return self._seq + len(self)
+
+    @property
+    def generation(self) -> int:
+        """
+        Cambia si se reescriben entradas (no con append ni recortes); única
+        en el proceso, así que identifica también la lista.
+        """
+        return self._generation
+
+    def on_evict(self, fn: Callable[["MemoryLog", int, int], Any]) -> None:
+        """fn(log, primera_seq, n) tras cada descarte por la cabeza."""
+        self._hooks.append(fn)
+
+    def remove_hook(self, fn) -> None:
+        try:
+            self._hooks.remove(fn)
+        except ValueError:
+            pass
+
+    # --- recorte ---
+    def trim_head(self, n: int) -> int:
+        """Descarta las n entradas más antiguas (O(1) amortizado)."""
+        n = min(max(0, n), len(self))
+        if not n:
+            return 0
+        head = self._head
+        if self._extra:
+            for j in range(head, head + n):
+                self._extra.pop(j, None)
+        self._garbage += sum(self._len[head:head + n])
+        self._head = head + n
+        first = self._seq
+        self._seq += n
+        self._maybe_compact()
+        for fn in list(self._hooks):
+            try:
+                if fn(self, first, n) is False:
+                    self.remove_hook(fn)
+            except Exception:
+                pass
+        return n
+
+    def trim_to(self, limit: int) -> int:
+        """Deja como mucho las limit más recientes. Devuelve las descartadas."""
+        return self.trim_head(len(self) - max(0, limit))
+
+    def _maybe_compact(self) -> None:
+        if ((self._head >= COMPACT_MIN and self._head >= len(self))
+                or (self._garbage >= COMPACT_MIN * 64
+                    and self._garbage >= len(self._blob) // 2)):
+            self._compact()
+
+    def _compact(self) -> None:
+        """Suelta la cabeza descartada y reempaqueta el blob de textos."""
+        head = self._head
+        blob = bytearray()
+        view = memoryview(self._blob)
+        off = array("Q")
+        for j in range(head, len(self._ts)):
+            start = self._off[j]
+            off.append(len(blob))
+            blob += view[start:start + self._len[j]]
+        view.release()
+        del self._ts[:head]
+        del self._imp[:head]
+        del self._role[:head]
+        del self._len[:head]
+        self._off = off
+        self._blob = blob
+        self._garbage = 0
+        if self._extra and head:
+            self._extra = {j - head: v for j, v in self._extra.items()}
+        self._head = 0
+
+    def _reset(self, items: Iterable[Any]) -> None:
+        # reescritura completa: las secuencias anteriores dejan de valer
+        items = list(items)
+        self._seq += len(self)
+        self._generation = next(_GENERATIONS)
+        self._clear_columns()
+        self.extend(items)
+
+    # --- acceso por columnas (sin materializar dicts) ---
+    def text(self, i: int) -> str:
+        """Texto de la entrada i (como memory.entry_text, sin el dict)."""
+        j = self._physical(i)
+        extra = self._extra.get(j)
+        if extra is not None and _RAW in extra:
+            raw = extra[_RAW]
+            return str(raw) if raw is not None else ""
+        return self._text_at(j)
+
+    def ts(self, i: int) -> Optional[float]:
+        value = self._ts[self._physical(i)]
+        return value if value == value else None
+
+    def importance(self, i: int, default: Optional[float] = None) -> Optional[float]:
+        value = self._imp[self._physical(i)]
+        return value if value == value else default
+
+    # --- serialización ---
+    def to_list(self) -> List[Any]:
+        """Forma JSON de siempre: lista de dicts."""
+        return [self._entry(j) for j in range(self._head, len(self._ts))]
+
+    def __reduce__(self):
+        return (MemoryLog, (self.to_list(), self._maxlen))
+
+    def nbytes(self) -> int:
+        """Memoria aproximada de las columnas, para diagnóstico."""
+        return (sum(sys.getsizeof(c) for c in
+                    (self._ts, self._imp, self._role, self._off, self._len,
+                     self._blob))
+                + sys.getsizeof(self._extra))
+
+
+LIST_TYPES = (list, MemoryLog)
+
+
+def plain(value: Any) -> Any:
+    return value.to_list() if isinstance(value, MemoryLog) else value
+
+
+def plain_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Copia de primer nivel con las MemoryLog como listas (para serializar)."""
+    return {k: plain(v) for k, v in state.items()}
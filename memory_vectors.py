@@ -0,0 +1,161 @@
+# memory_vectors.py
+"""
+Backend vectorizado (NumPy) para retrieval sobre long_memory.
+
+- Cada entrada se representa como un vector hasheado de trigramas de
+  caracteres (TF sublineal, normalizado L2), guardado disperso (CSR):
+  columnas y valores de todas las filas en dos arrays planos + el
+  offset de cada fila. Memoria proporcional a los trigramas guardados
+  (unos 6 bytes por trigrama distinto), no a filas x DIM.
+- La consulta se pondera con IDF (frecuencias de documento mantenidas
+  de forma incremental) y se puntúa de una vez: producto por elemento
+  con la consulta densa y suma por fila (np.add.reduceat).
+- El top-k se selecciona con argpartition.
+- Las filas se añaden al final (los arrays crecen al doble) y se
+  descartan por la cabeza cuando limit_memory recorta la lista.
+
+Se activa con PRIMORDIAL_RETRIEVAL=numpy.
+"""
+
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from memory_index import SyncedIndex, normalize, trigrams
+
+# dimensiones del espacio hasheado (potencia de 2, cabe en uint16)
+DIM = 512
+# capacidad inicial: filas y trigramas guardados (unos 25 KB por índice)
+INITIAL_ROWS = 256
+INITIAL_NNZ = 4096
+
+
+def _buckets(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(buckets únicos, tf sublineal) de los trigramas de un texto."""
+    counts: Dict[int, int] = {}
+    for g in trigrams(normalize(text)):
+        b = zlib.crc32(g.encode("utf-8")) & (DIM - 1)
+        counts[b] = counts.get(b, 0) + 1
+    if not counts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    return idx, 1.0 + np.log(tf)
+
+
+def _grown(array: np.ndarray, need: int) -> np.ndarray:
+    grown = np.zeros(max(need, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class VectorIndex(SyncedIndex):
+    """
+    Matriz dispersa (CSR) de filas hasheadas.
+    Fila r: columnas self._cols[p[r]:p[r+1]] y valores self._vals[...],
+    con p = self._rowptr. Filas vivas: self._head..self._tail; el doc_id
+    de la fila self._head es self._ids[0].
+    """
+
+    # coseno: escala distinta a la de Dice/SequenceMatcher
+    THRESHOLD = 0.3
+    # el idf depende de todas las filas: cualquier alta o baja invalida la caché
+    INCREMENTAL = False
+
+    def _clear_docs(self) -> None:
+        self._cols = np.zeros(INITIAL_NNZ, dtype=np.uint16)
+        self._vals = np.zeros(INITIAL_NNZ, dtype=np.float32)
+        self._rowptr = np.zeros(INITIAL_ROWS + 1, dtype=np.int64)
+        self._head = 0
+        self._tail = 0
+        self._texts: List[str] = []
+        self._df = np.zeros(DIM, dtype=np.float32)
+
+    def _reserve(self, nnz: int) -> None:
+        """Sitio para una fila más con nnz valores (compacta o duplica)."""
+        end = int(self._rowptr[self._tail])
+        if self._tail + 2 <= len(self._rowptr) and end + nnz <= len(self._cols):
+            return
+        if self._head and self._head >= self._tail // 2:
+            # compactar: las filas vivas vuelven al principio
+            base = int(self._rowptr[self._head])
+            live = self._tail - self._head
+            self._cols[:end - base] = self._cols[base:end]
+            self._vals[:end - base] = self._vals[base:end]
+            self._rowptr[:live + 1] = self._rowptr[self._head:self._tail + 1] - base
+            self._texts = self._texts[self._head:]
+            self._head = 0
+            self._tail = live
+            end -= base
+        if self._tail + 2 > len(self._rowptr):
+            self._rowptr = _grown(self._rowptr, self._tail + 2)
+        if end + nnz > len(self._cols):
+            self._cols = _grown(self._cols, end + nnz)
+            self._vals = _grown(self._vals, end + nnz)
+
+    def _add_doc(self, doc_id: int, text: str) -> None:
+        idx, tf = _buckets(text)
+        n = len(idx)
+        self._reserve(n)
+        start = int(self._rowptr[self._tail])
+        if n:
+            norm = float(np.sqrt(np.dot(tf, tf)))
+            self._cols[start:start + n] = idx
+            self._vals[start:start + n] = tf / norm
+            self._df[idx] += 1.0
+        self._rowptr[self._tail + 1] = start + n
+        self._texts.append(text)
+        self._tail += 1
+
+    def _drop_doc(self, doc_id: int) -> None:
+        # siempre es la fila más antigua (drop_oldest)
+        a, b = self._rowptr[self._head], self._rowptr[self._head + 1]
+        self._df[self._cols[a:b]] -= 1.0
+        self._texts[self._head] = ""
+        self._head += 1
+
+    def _search_ids(self, query: str, top_k: int, threshold: float,
+                    doc_ids: Optional[range] = None
+                    ) -> List[Tuple[float, int, str]]:
+        """[(score coseno, doc_id, texto)] del top-k (doc_ids: ignorado)."""
+        idx, tf = _buckets(query)
+        with self._lock:
+            live = self._tail - self._head
+            if not len(idx) or live == 0 or top_k <= 0:
+                return []
+            idf = np.log((1.0 + live) / (1.0 + self._df[idx])) + 1.0
+            w = tf * idf
+            q = np.zeros(DIM, dtype=np.float32)
+            q[idx] = w / float(np.sqrt(np.dot(w, w)))
+
+            # producto fila a fila: productos por elemento sumados por
+            # tramos (reduceat) sobre las filas no vacías, cuyos tramos
+            # van de su inicio al de la siguiente no vacía
+            ptr = self._rowptr[self._head:self._tail + 1]
+            base, end = int(ptr[0]), int(ptr[-1])
+            if end == base:
+                return []
+            # columnas < DIM siempre: "wrap" se ahorra la comprobación
+            products = q.take(self._cols[base:end], mode="wrap")
+            products *= self._vals[base:end]
+            starts = ptr[:-1] - base
+            filled = ptr[1:] > ptr[:-1]
+            scores = np.zeros(live, dtype=np.float32)
+            scores[filled] = np.add.reduceat(products, starts[filled])
+            k = min(top_k, live)
+            top = np.argpartition(scores, live - k)[live - k:]
+            # mayor score primero; a igualdad, lo más reciente
+            top = top[np.lexsort((-top, -scores[top]))]
+            first = self._ids[0]
+            return [(float(scores[i]), first + int(i),
+                     self._texts[self._head + i])
+                    for i in top if scores[i] > threshold]
+
+
+_INDEX = VectorIndex()
+
+
+def index_for(state: Dict[str, Any]) -> VectorIndex:
+    """Índice vectorial asociado al estado (hoy: uno por proceso)."""
+    return _INDEX
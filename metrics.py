@@ -0,0 +1,210 @@
+# metrics.py
+"""
+Instrumentación del camino caliente, expuesta en formato Prometheus.
+
+- span("etapa") / @timed("etapa"): duración de cada etapa de /ask
+  (load_state, retrieve, update_evolution, plan_to_text,
+  process_interaction, save_state...) en un histograma de buckets fijos
+  (potencias de 2 desde 50 µs); p50/p95/p99 se estiman de los buckets.
+  Coste por medida: dos perf_counter, un bisect y un lock.
+- add_bytes(destino, n): bytes escritos a disco por destino
+  (state, backups, proposals, versions).
+- gauge(nombre, ayuda, fn): valores calculados en cada scrape
+  (p. ej. tamaño de short_memory / long_memory).
+
+Las métricas son por proceso: con varios workers cada uno expone las
+suyas.
+
+    GET /metrics  ->  render()
+"""
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+PREFIX = "primordial"
+# límites superiores en segundos: 50 µs .. ~52 s
+BUCKETS: Tuple[float, ...] = tuple(0.00005 * 2 ** k for k in range(21))
+QUANTILES = (0.5, 0.95, 0.99)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+
+    def __init__(self, bounds: Tuple[float, ...] = BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        i = bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.total += seconds
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+    def quantile(self, q: float, counts: Optional[List[int]] = None) -> float:
+        """Estimación por interpolación lineal dentro del bucket."""
+        if counts is None:
+            counts = self.snapshot()[0]
+        n = sum(counts)
+        if not n:
+            return 0.0
+        rank = q * n
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                low = self.bounds[i - 1] if i > 0 else 0.0
+                high = self.bounds[i] if i < len(self.bounds) else low * 2
+                return low + (high - low) * (rank - seen) / c
+            seen += c
+        return self.bounds[-1]
+
+
+_lock = threading.Lock()
+_stages: Dict[str, Histogram] = {}
+_bytes: Dict[str, int] = {}
+_gauges: Dict[str, Tuple[str, Callable[[], Dict[str, float]]]] = {}
+
+
+def _histogram(stage: str) -> Histogram:
+    h = _stages.get(stage)
+    if h is None:
+        with _lock:
+            h = _stages.setdefault(stage, Histogram())
+    return h
+
+
+def observe(stage: str, seconds: float) -> None:
+    _histogram(stage).observe(seconds)
+
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timed(stage: str):
+    """Decorador: mide cada llamada como una span de stage."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - start)
+        return inner
+    return wrap
+
+
+def add_bytes(target: str, n: int) -> None:
+    if n:
+        with _lock:
+            _bytes[target] = _bytes.get(target, 0) + n
+
+
+def gauge(name: str, help_text: str, fn: Callable[[], Dict[str, float]]) -> None:
+    """
+    fn() -> {etiquetas: valor}; las etiquetas van como "k=v" (o "" sin
+    etiquetas). Se llama en cada render().
+    """
+    with _lock:
+        _gauges[name] = (help_text, fn)
+
+
+def summary() -> Dict[str, Dict[str, float]]:
+    """Por etapa: count, sum_ms, avg_ms, p50_ms, p95_ms, p99_ms."""
+    out = {}
+    for stage, h in sorted(_stages.items()):
+        counts, total, count = h.snapshot()
+        item = {"count": count, "sum_ms": round(total * 1000, 3),
+                "avg_ms": round(total * 1000 / count, 3) if count else 0.0}
+        for q in QUANTILES:
+            item[f"p{int(q * 100)}_ms"] = round(h.quantile(q, counts) * 1000, 3)
+        out[stage] = item
+    return out
+
+
+def reset() -> None:
+    with _lock:
+        _stages.clear()
+        _bytes.clear()
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(text: str) -> str:
+    if not text:
+        return ""
+    parts = []
+    for item in text.split(","):
+        k, _, v = item.partition("=")
+        v = v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def render() -> str:
+    """Texto de exposición de Prometheus (versión 0.0.4)."""
+    lines = []
+    name = f"{PREFIX}_stage_seconds"
+    lines.append(f"# HELP {name} Duración de cada etapa del pipeline.")
+    lines.append(f"# TYPE {name} histogram")
+    quantiles = []
+    for stage, h in sorted(_stages.items()):
+        counts, total, count = h.snapshot()
+        cumulative = 0
+        for bound, c in zip(h.bounds + (float("inf"),), counts):
+            cumulative += c
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{_fmt(bound)}"}} '
+                         f"{cumulative}")
+        lines.append(f'{name}_sum{{stage="{stage}"}} {_fmt(total)}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+        for q in QUANTILES:
+            quantiles.append((stage, q, h.quantile(q, counts)))
+
+    qname = f"{PREFIX}_stage_quantile_seconds"
+    lines.append(f"# HELP {qname} p50/p95/p99 estimados de los buckets.")
+    lines.append(f"# TYPE {qname} gauge")
+    for stage, q, value in quantiles:
+        lines.append(f'{qname}{{stage="{stage}",quantile="{q}"}} {_fmt(value)}')
+
+    bname = f"{PREFIX}_bytes_written_total"
+    lines.append(f"# HELP {bname} Bytes escritos a disco por destino.")
+    lines.append(f"# TYPE {bname} counter")
+    with _lock:
+        written = sorted(_bytes.items())
+        gauges = sorted(_gauges.items())
+    for target, n in written:
+        lines.append(f'{bname}{{target="{target}"}} {n}')
+
+    for gname, (help_text, fn) in gauges:
+        try:
+            values = fn()
+        except Exception:
+            continue
+        full = f"{PREFIX}_{gname}"
+        lines.append(f"# HELP {full} {help_text}")
+        lines.append(f"# TYPE {full} gauge")
+        for labels, value in sorted(values.items()):
+            lines.append(f"{full}{_labels(labels)} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
+
@@ -0,0 +1,129 @@
+# process_lock.py
+"""
+Bloqueos entre procesos (varios workers de gunicorn sobre el mismo directorio).
+
+- ProcessLock: lock reentrante que excluye a la vez a los hilos del
+  proceso (RLock) y a los demás procesos (flock exclusivo sobre un fichero).
+- LeaderElection: elige UN proceso líder con un flock no bloqueante sobre
+  otro fichero, que se mantiene mientras el proceso vive. Los demás
+  reintentan cada RETRY_SECONDS; si el líder muere, el kernel libera el
+  lock y otro proceso toma el relevo.
+
+Sin fcntl (Windows) degradan a un lock de hilos y a "siempre líder".
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+RETRY_SECONDS = 5.0
+
+
+def _open_lock_file(path: str) -> int:
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    return os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+
+class ProcessLock:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+        self._pid = None
+
+    def _file(self) -> int:
+        # tras un fork el descriptor heredado comparte el flock del padre:
+        # cada proceso abre el suyo
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = _open_lock_file(self.path)
+            self._pid = os.getpid()
+        return self._fd
+
+    def acquire(self) -> bool:
+        self._rlock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                fcntl.flock(self._file(), fcntl.LOCK_EX)
+            except Exception:
+                self._rlock.release()
+                raise
+        self._depth += 1
+        return True
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._rlock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __del__(self):
+        # las sesiones crean muchos locks: no dejar descriptores abiertos
+        if self._fd is not None and self._pid == os.getpid():
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+
+
+class LeaderElection:
+
+    def __init__(self, path: str, retry: float = RETRY_SECONDS):
+        self.path = path
+        self.retry = retry
+        self._fd: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def is_leader(self) -> bool:
+        if fcntl is None:
+            return True
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """Intenta ser líder sin bloquear. El lock se mantiene de por vida."""
+        with self._lock:
+            if self.is_leader():
+                return True
+            fd = _open_lock_file(self.path)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            os.ftruncate(fd, 0)
+            os.write(fd, str(os.getpid()).encode("ascii"))
+            self._fd = fd
+            return True
+
+    def run_when_leader(self, fn: Callable[[], None]) -> bool:
+        """
+        Ejecuta fn ya si este proceso es (o pasa a ser) líder y devuelve True.
+        Si no, la ejecuta desde un hilo en segundo plano cuando lo consiga.
+        """
+        if self.try_acquire():
+            fn()
+            return True
+
+        def wait():
+            while not self.try_acquire():
+                time.sleep(self.retry)
+            fn()
+
+        threading.Thread(target=wait, name="leader-election",
+                         daemon=True).start()
+        return False
@@ -0,0 +1,439 @@
+# proposal_store.py
+"""
+Almacén de propuestas (una por interacción).
+
+Antes cada propuesta era un fichero proposals/proposal_<ts>.json con una
+copia completa del estado (state_snapshot). Ahora:
+- Cada propuesta es UNA línea JSON en proposals/proposals.jsonl con el
+  mensaje, la respuesta y una referencia al estado (state_ref: versión,
+  nivel, meta y tamaños de memoria), no una copia.
+- Un manifiesto SQLite (id, ts, offset, tamaño, aplicada) permite leer
+  por id con un seek, paginar y contar/filtrar con índices.
+- Los ficheros legados proposal_<ts>.json siguen siendo legibles.
+- ProposalWriter saca la escritura del camino de /ask: cola acotada +
+  hilo que escribe los registros por lotes (una escritura por lote).
+"""
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import metrics
+from process_lock import ProcessLock
+
+PROPOSALS_DIR = "proposals"
+LOG_NAME = "proposals.jsonl"
+MANIFEST_NAME = "manifest.db"
+LOCK_NAME = ".lock"
+
+# escritor en segundo plano
+WRITER_QUEUE_SIZE = int(os.environ.get("PRIMORDIAL_PROPOSAL_QUEUE", "1000"))
+WRITER_BATCH_SIZE = 64
+# "drop": descartar si la cola está llena; "block": esperar (backpressure)
+WRITER_POLICY = os.environ.get("PRIMORDIAL_PROPOSAL_POLICY", "drop")
+WRITER_BLOCK_TIMEOUT = 5.0
+
+
+def state_ref(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Referencia compacta al estado en el momento de la interacción."""
+    state = state or {}
+    return {
+        "version": state.get("version"),
+        "level": state.get("level"),
+        "meta": dict(state.get("meta", {}) or {}),
+        "short_memory": len(state.get("short_memory", []) or []),
+        "long_memory": len(state.get("long_memory", []) or []),
+    }
+
+
+def build_record(user_message: str, ai_response: str,
+                 state: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # el id definitivo lo asigna ProposalStore.write_records
+    ts = time.time()
+    return {
+        "id": None,
+        "timestamp": ts,
+        "user_message": user_message,
+        "ai_response": ai_response,
+        "state_ref": state_ref(state),
+    }
+
+
+def _legacy_ts(name: str) -> float:
+    try:
+        return float(name[len("proposal_"):].split(".")[0])
+    except ValueError:
+        return 0.0
+
+
+class ProposalStore:
+    """
+    Log de propuestas + manifiesto indexado (SQLite, proposals/manifest.db).
+
+    Cada propuesta tiene un id único y monótono proposal_<ts>_<seq> y una
+    fila (seq, id, ts, offset, size, path, applied) en el manifiesto, así
+    que listar, paginar, contar pendientes o buscar por id son consultas
+    indexadas, no recorridos del directorio.
+    """
+
+    def __init__(self, root: str = PROPOSALS_DIR):
+        self.root = root
+        self.log_path = os.path.join(root, LOG_NAME)
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+        # ids/offsets del log se asignan bajo un lock entre procesos
+        self._lock = ProcessLock(os.path.join(root, LOCK_NAME))
+        self._db: Optional[sqlite3.Connection] = None
+
+    # --- manifiesto ---
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is not None:
+            return self._db
+        with self._lock:
+            if self._db is None:
+                os.makedirs(self.root, exist_ok=True)
+                db = sqlite3.connect(self.manifest_path,
+                                     check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.executescript("""
+                    CREATE TABLE IF NOT EXISTS proposals (
+                        seq INTEGER PRIMARY KEY,
+                        id TEXT UNIQUE NOT NULL,
+                        ts REAL NOT NULL,
+                        offset INTEGER,
+                        size INTEGER NOT NULL,
+                        path TEXT,
+                        applied INTEGER NOT NULL DEFAULT 0
+                    );
+                    CREATE INDEX IF NOT EXISTS proposals_ts ON proposals(ts);
+                    CREATE INDEX IF NOT EXISTS proposals_applied
+                        ON proposals(applied, seq);
+                    CREATE TABLE IF NOT EXISTS info (
+                        key TEXT PRIMARY KEY, value TEXT);
+                """)
+                self._db = db
+                self._migrate()
+        return self._db
+
+    def _migrate(self) -> None:
+        """Indexa (una vez) ficheros legados y registros del log sin fila."""
+        db = self._db
+        done = db.execute(
+            "SELECT value FROM info WHERE key='legacy_indexed'").fetchone()
+        if not done:
+            legacy = []
+            for name in os.listdir(self.root):
+                if (name.startswith("proposal_") and name.endswith(".json")):
+                    path = os.path.join(self.root, name)
+                    legacy.append((_legacy_ts(name), name,
+                                   os.path.getsize(path)))
+            with db:
+                for ts, name, size in sorted(legacy):
+                    db.execute(
+                        "INSERT OR IGNORE INTO proposals"
+                        "(id, ts, offset, size, path) VALUES (?, ?, NULL, ?, ?)",
+                        (name, ts, size, name))
+                db.execute("INSERT OR REPLACE INTO info VALUES "
+                           "('legacy_indexed', '1')")
+        self._index_log_tail()
+
+    def _index_log_tail(self) -> None:
+        """Indexa lo que haya en el log después de la última fila conocida."""
+        if not os.path.exists(self.log_path):
+            return
+        db = self._db
+        row = db.execute("SELECT MAX(offset + size) FROM proposals "
+                         "WHERE offset IS NOT NULL").fetchone()
+        start = row[0] or 0
+        if start >= os.path.getsize(self.log_path):
+            return
+        with open(self.log_path, "rb") as f, db:
+            f.seek(start)
+            offset = start
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    ts = float(rec["timestamp"])
+                    cur = db.execute(
+                        "INSERT OR IGNORE INTO proposals(id, ts, offset, size)"
+                        " VALUES (?, ?, ?, ?)",
+                        (rec.get("id") or "", ts, offset, len(line)))
+                    if cur.rowcount == 0 or not rec.get("id"):
+                        # ids antiguos (proposal_<ts>) podían repetirse
+                        db.execute(
+                            "INSERT INTO proposals(id, ts, offset, size)"
+                            " VALUES (?, ?, ?, ?)",
+                            (self._next_id(ts), ts, offset, len(line)))
+                except (ValueError, KeyError, TypeError):
+                    pass
+                offset += len(line)
+
+    def _next_id(self, ts: float) -> str:
+        row = self._db.execute("SELECT MAX(seq) FROM proposals").fetchone()
+        return f"proposal_{int(ts)}_{(row[0] or 0) + 1}"
+
+    # --- escritura ---
+    def add(self, user_message: str, ai_response: str,
+            state: Optional[Dict[str, Any]] = None) -> str:
+        record = build_record(user_message, ai_response, state)
+        return self.write_records([record])[0]
+
+    def write_records(self, records: Iterable[Dict[str, Any]]) -> List[str]:
+        """
+        Asigna ids, añade los registros al log en una sola escritura e
+        inserta sus filas en el manifiesto en una sola transacción.
+        """
+        db = self._conn()
+        records = list(records)
+        with self._lock:
+            row = db.execute("SELECT MAX(seq) FROM proposals").fetchone()
+            seq = row[0] or 0
+            lines = []
+            for rec in records:
+                seq += 1
+                rec["id"] = f"proposal_{int(rec['timestamp'])}_{seq}"
+                lines.append(
+                    (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8"))
+            blob = b"".join(lines)
+            with open(self.log_path, "ab") as f:
+                offset = f.tell()
+                f.write(blob)
+            metrics.add_bytes("proposals", len(blob))
+            rows = []
+            for rec, line in zip(records, lines):
+                rows.append((rec["id"], float(rec["timestamp"]), offset,
+                             len(line)))
+                offset += len(line)
+            with db:
+                db.executemany(
+                    "INSERT INTO proposals(id, ts, offset, size) "
+                    "VALUES (?, ?, ?, ?)", rows)
+            return [r["id"] for r in records]
+
+    def mark_applied(self, pid: str, applied: bool = True) -> bool:
+        db = self._conn()
+        with self._lock, db:
+            cur = db.execute("UPDATE proposals SET applied=? WHERE id=?",
+                             (1 if applied else 0, pid))
+            return cur.rowcount > 0
+
+    # --- lectura ---
+    def ids(self, offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """Ids en orden de creación, paginados."""
+        db = self._conn()
+        with self._lock:
+            rows = db.execute(
+                "SELECT id FROM proposals ORDER BY ts, seq LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset)).fetchall()
+        return [r[0] for r in rows]
+
+    def count(self, applied: Optional[bool] = None) -> int:
+        db = self._conn()
+        with self._lock:
+            if applied is None:
+                row = db.execute("SELECT COUNT(*) FROM proposals").fetchone()
+            else:
+                row = db.execute(
+                    "SELECT COUNT(*) FROM proposals WHERE applied=?",
+                    (1 if applied else 0,)).fetchone()
+        return row[0]
+
+    def last_seq(self) -> int:
+        """seq de la última propuesta escrita (por cualquier proceso)."""
+        db = self._conn()
+        with self._lock:
+            row = db.execute("SELECT MAX(seq) FROM proposals").fetchone()
+        return row[0] or 0
+
+    def info(self, pid: str) -> Optional[Dict[str, Any]]:
+        """Fila del manifiesto: id, timestamp, tamaño y flag de aplicada."""
+        db = self._conn()
+        with self._lock:
+            row = db.execute(
+                "SELECT id, ts, size, applied FROM proposals WHERE id=?",
+                (pid,)).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "timestamp": row[1], "size": row[2],
+                "applied": bool(row[3])}
+
+    def get(self, pid: str) -> Optional[Dict[str, Any]]:
+        db = self._conn()
+        with self._lock:
+            row = db.execute(
+                "SELECT offset, size, path FROM proposals WHERE id=?",
+                (pid,)).fetchone()
+        if row is None:
+            return None
+        offset, size, path = row
+        if path is not None:
+            return _read_legacy(os.path.join(self.root, path))
+        with open(self.log_path, "rb") as f:
+            f.seek(offset)
+            try:
+                return json.loads(f.read(size))
+            except ValueError:
+                return None
+
+    def query(self, since: Optional[float] = None, until: Optional[float] = None,
+              applied: Optional[bool] = None, offset: int = 0,
+              limit: Optional[int] = None) -> List[str]:
+        """Ids en [since, until], filtrados por aplicada/pendiente."""
+        where, args = [], []
+        if since is not None:
+            where.append("ts >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("ts <= ?")
+            args.append(until)
+        if applied is not None:
+            where.append("applied = ?")
+            args.append(1 if applied else 0)
+        sql = "SELECT id FROM proposals"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts, seq LIMIT ? OFFSET ?"
+        args += [-1 if limit is None else limit, offset]
+        db = self._conn()
+        with self._lock:
+            return [r[0] for r in db.execute(sql, args).fetchall()]
+
+    def clear(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+            if os.path.isdir(self.root):
+                for name in os.listdir(self.root):
+                    if name == LOCK_NAME:
+                        continue
+                    try:
+                        os.remove(os.path.join(self.root, name))
+                    except Exception:
+                        pass
+
+
+def _read_legacy(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return {"text": f.read()}
+        except Exception:
+            return None
+
+
+class ProposalWriter:
+    """
+    Escritor asíncrono de propuestas.
+    submit() construye el registro (la referencia al estado se toma en el
+    momento) y lo encola; un hilo lo escribe junto con los que haya en cola.
+    """
+
+    def __init__(self, store: ProposalStore, maxsize: int = WRITER_QUEUE_SIZE,
+                 batch_size: int = WRITER_BATCH_SIZE,
+                 policy: str = WRITER_POLICY):
+        self.store = store
+        self.batch_size = batch_size
+        self.policy = policy
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def submit(self, user_message: str, ai_response: str,
+               state: Optional[Dict[str, Any]] = None) -> bool:
+        """Encola una propuesta. False si se descartó."""
+        record = build_record(user_message, ai_response, state)
+        if self._stopping:
+            self.store.write_records([record])
+            self._count("written")
+            return True
+        self._ensure_worker()
+        try:
+            if self.policy == "block":
+                self._queue.put(record, timeout=WRITER_BLOCK_TIMEOUT)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("queued")
+        return True
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [r for r in batch if r is not None]
+            try:
+                if records:
+                    self.store.write_records(records)
+                    self._count("written", len(records))
+                    self._count("batches")
+            except Exception as e:
+                self._count("errors", len(records))
+                print("Error escribiendo propuestas:", e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if any(r is None for r in batch):
+                return
+
+    def flush(self) -> None:
+        """Espera a que todo lo encolado esté escrito."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self) -> None:
+        """Vacía la cola y detiene el hilo (se llama al salir)."""
+        self._stopping = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "pending": self._queue.qsize(),
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+
+PROPOSALS = ProposalStore(PROPOSALS_DIR)
+PROPOSAL_WRITER = ProposalWriter(PROPOSALS)
+atexit.register(PROPOSAL_WRITER.close)
@@ -12,6 +12,12 @@ import random
 import time
 from typing import List, Dict, Any, Optional
 
+import consolidation
+import memory_dedupe
+import memory_index
+import metrics
+from memory import make_entry, memory_list
+
 
 # -------------------------
 # utilidades de retrieval
@@ -20,11 +26,40 @@ def sim(a: str, b: str) -> float:
     return SequenceMatcher(None, a, b).ratio()
 
 
+@metrics.timed("retrieve")
 def retrieve(query: str, state: Dict[str, Any], top_k: int = 5) -> List[str]:
     """
     Busca coincidencias simples en long_memory.
     Retorna textos (no estructuras) que pasen un umbral.
+    Con PRIMORDIAL_RETRIEVAL=fts se busca en SQLite (memories_fts): lo
+    añadido en el lote en curso del actor no aparece hasta que se guarda.
+    """
+    if memory_index.BACKEND == "difflib":
+        return _retrieve_difflib(query, state, top_k)
+    index = memory_index.sync_state(state)
+    found = [t for score, t in index.search(query, top_k)]
+    consolidation.record_hits(memory_list(state, "long_memory"), found)
+    return found
+
+
+@metrics.timed("retrieve_unsynced")
+def retrieve_unsynced(query: str, top_k: int = 5) -> Optional[List[str]]:
+    """
+    Busca en el índice tal como lo dejó la última mutación, sin tocar el
+    estado: se puede llamar desde hilos fuera del actor (pool de retrieval
+    de asgi_app). None si el backend necesita el estado (difflib).
     """
+    if memory_index.BACKEND == "difflib":
+        return None
+    index = memory_index.index_for({})
+    found = [t for score, t in index.search(query, top_k)]
+    consolidation.record_hits(index.source(), found)
+    return found
+
+
+def _retrieve_difflib(query: str, state: Dict[str, Any],
+                      top_k: int = 5) -> List[str]:
+    """Escaneo lineal con SequenceMatcher (ruta original, para comparar)."""
     collection = state.get("long_memory", [])[-1200:]
     candidates = []
     for item in collection:
@@ -38,6 +73,11 @@ def retrieve(query: str, state: Dict[str, Any], top_k: int = 5) -> List[str]:
     return memories
 
 
+def _sync_index(state: Dict[str, Any]) -> None:
+    """Actualiza el índice de retrieval tras añadir a long_memory."""
+    memory_index.sync_state(state)
+
+
 # -------------------------
 # evolución adaptativa
 # -------------------------
@@ -55,6 +95,7 @@ def evaluar_interaccion(message: str) -> int:
     return score  # 0..3
 
 
+@metrics.timed("update_evolution")
 def update_evolution(state: Dict[str, Any], message: str) -> None:
     """
     Actualiza state["meta"] (curiosity, coherence) en 0..1 y el state["level"].
@@ -165,19 +206,20 @@ def build_plan(message: str, state: Dict[str, Any],
 # -------------------------
 # API pública
 # -------------------------
-def synthesize(message: str, state: Dict[str, Any]) -> Dict[str, Any]:
+def synthesize(message: str, state: Dict[str, Any],
+               memories: Optional[List[str]] = None) -> Dict[str, Any]:
     """
     Punto de entrada que devuelve un 'plan' (dict).
     - actualiza estado (evolution)
-    - extrae recuerdos útiles (retrieve)
+    - extrae recuerdos útiles (retrieve), salvo que ya vengan calculados
     - devuelve plan listo para convertirse en texto por agent.py
     """
     if state is None:
         state = {}
 
     # asegurarse de estructuras mínimas
-    state.setdefault("long_memory", [])
-    state.setdefault("short_memory", [])
+    memory_list(state, "long_memory")
+    memory_list(state, "short_memory")
     state.setdefault("meta", {
         "curiosity": 0.25,
         "coherence": 0.25,
@@ -186,7 +228,8 @@ def synthesize(message: str, state: Dict[str, Any]) -> Dict[str, Any]:
     state.setdefault("level", 1)
 
     # recuperar memorias relevantes
-    memories = retrieve(message or "", state, top_k=6)
+    if memories is None:
+        memories = retrieve(message or "", state, top_k=6)
 
     # actualizar evolución basada en el mensaje
     try:
@@ -194,17 +237,12 @@ def synthesize(message: str, state: Dict[str, Any]) -> Dict[str, Any]:
     except Exception:
         pass
 
-    # añadir al long_memory de manera controlada (no duplicar idénticos recientes)
+    # añadir al long_memory de manera controlada: un casi duplicado de
+    # cualquier entrada guardada solo suma a su contador (memory_dedupe)
     try:
-        lm = state.setdefault("long_memory", [])
-        last_text = lm[-1].get("text") if lm and isinstance(lm[-1],
-                                                            dict) else None
-        if (message or "").strip() and (last_text is None or
-                                        (message.strip() != last_text)):
-            state["long_memory"].append({
-                "text": message,
-                "timestamp": time.time()
-            })
+        if (message or "").strip() and memory_dedupe.add_unique(
+                state, make_entry(message)):
+            _sync_index(state)
             # evitar crecimiento descontrolado aquí (se recorta en save/maintenance)
     except Exception:
         pass
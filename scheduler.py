@@ -0,0 +1,261 @@
+# scheduler.py
+"""
+Planificador de trabajos de fondo (mantenimiento, evolución, poda...).
+
+Sustituye a los bucles `while True: ...; sleep(N)`: un hilo espera al
+próximo vencimiento (o a un evento) y lanza los trabajos en un pool.
+
+Disparadores de un Job (combinables):
+    every=s        cada s segundos
+    on=("x",)      eventos que lo activan (SCHEDULER.emit("x"))
+      after=n      cuando lleguen n eventos pendientes (por defecto 1)
+      debounce=s   s segundos sin eventos nuevos
+      max_delay=s  como mucho s segundos desde el primer evento pendiente
+    idle=s         una vez cuando lleven s segundos sin ningún evento
+    min_interval=s nunca dos ejecuciones con menos de s segundos
+
+Los eventos que llegan mientras un trabajo está pendiente o corriendo se
+acumulan en una sola ejecución (coalescing); nunca corre dos veces a la
+vez. stats() da por trabajo ejecuciones, saltos, eventos agrupados y
+tiempos. Sin eventos ni intervalos el hilo duerme sin despertar.
+
+    SCHEDULER.add("mantenimiento", fn, on=("interaction",), debounce=10)
+    SCHEDULER.start() / SCHEDULER.emit("interaction") / SCHEDULER.shutdown()
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional
+
+MAX_WORKERS = 4
+
+
+class Job:
+
+    def __init__(self, name: str, fn: Callable, every: Optional[float] = None,
+                 on: Iterable[str] = (), after: Optional[int] = None,
+                 debounce: Optional[float] = None,
+                 max_delay: Optional[float] = None,
+                 idle: Optional[float] = None, min_interval: float = 0.0,
+                 pass_events: bool = False):
+        self.name = name
+        self.fn = fn
+        self.every = every
+        self.on = frozenset(on)
+        # solo con on=: sin after ni tiempos, cada evento basta
+        self.after = after or (1 if not (debounce or max_delay) else None)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.idle = idle
+        self.min_interval = min_interval
+        self.pass_events = pass_events
+
+        self.pending = 0
+        self.first_event: Optional[float] = None
+        self.last_event: Optional[float] = None
+        self.last_start: Optional[float] = None
+        self.idle_done = True
+        self.running = False
+        self.deferred = False
+        self.stats = {"runs": 0, "errors": 0, "skipped": 0, "coalesced": 0,
+                      "events": 0, "last_ms": 0.0, "total_ms": 0.0,
+                      "max_ms": 0.0, "last_run": None}
+
+    def due(self, now: float, last_activity: Optional[float]) -> Optional[float]:
+        """Próximo instante en que toca ejecutar (None = nunca, sin eventos)."""
+        candidates = []
+        if self.every is not None:
+            base = self.last_start if self.last_start is not None else now
+            candidates.append(base + self.every)
+        if self.pending:
+            if self.after is not None and self.pending >= self.after:
+                candidates.append(now)
+            if self.debounce is not None:
+                candidates.append(self.last_event + self.debounce)
+            if self.max_delay is not None:
+                candidates.append(self.first_event + self.max_delay)
+        if (self.idle is not None and not self.idle_done
+                and last_activity is not None):
+            candidates.append(last_activity + self.idle)
+        if not candidates:
+            return None
+        when = min(candidates)
+        if self.min_interval and self.last_start is not None:
+            when = max(when, self.last_start + self.min_interval)
+        return when
+
+
+class Scheduler:
+
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self.max_workers = max_workers
+        self._jobs: Dict[str, Job] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._stopping = False
+        self._last_activity: Optional[float] = None
+        self._events = 0
+
+    # --- registro ---
+    def add(self, name: str, fn: Callable, **triggers) -> Job:
+        job = Job(name, fn, **triggers)
+        with self._cond:
+            if job.every is not None:
+                job.last_start = time.time()
+            self._jobs[name] = job
+            self._cond.notify_all()
+        return job
+
+    def remove(self, name: str) -> None:
+        with self._cond:
+            self._jobs.pop(name, None)
+
+    def set_every(self, name: str, every: float) -> None:
+        """Cambia el intervalo de un trabajo (cuenta desde su último inicio)."""
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is not None:
+                job.every = every
+                self._cond.notify_all()
+
+    def emit(self, event: str, n: int = 1) -> None:
+        """Notifica n eventos; barato si ningún trabajo los escucha."""
+        now = time.time()
+        with self._cond:
+            self._events += n
+            self._last_activity = now
+            wake = False
+            for job in self._jobs.values():
+                if job.idle is not None:
+                    job.idle_done = False
+                if event in job.on:
+                    if not job.pending:
+                        job.first_event = now
+                    job.pending += n
+                    job.last_event = now
+                    job.stats["events"] += n
+                    wake = True
+            if wake:
+                self._cond.notify_all()
+
+    def run_now(self, name: str) -> None:
+        """Fuerza una ejecución (se agrupa si ya está en marcha)."""
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is not None:
+                job.pending = max(job.pending, job.after or 1)
+                job.first_event = job.last_event = time.time()
+                self._cond.notify_all()
+
+    # --- ciclo de vida ---
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._pool = ThreadPoolExecutor(self.max_workers,
+                                            thread_name_prefix="scheduler")
+            self._thread = threading.Thread(target=self._run,
+                                            name="scheduler", daemon=True)
+            self._thread.start()
+
+    def shutdown(self, wait: bool = True, timeout: Optional[float] = None) -> None:
+        """Deja de lanzar trabajos; con wait espera a los que están en marcha."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread, pool = self._thread, self._pool
+        if thread is not None and wait:
+            thread.join(timeout)
+        if pool is not None:
+            pool.shutdown(wait=wait)
+        with self._cond:
+            self._thread = None
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._cond:
+            jobs = {}
+            for name, job in self._jobs.items():
+                out = dict(job.stats)
+                runs = out["runs"]
+                out["avg_ms"] = round(out["total_ms"] / runs, 3) if runs else 0.0
+                out["pending"] = job.pending
+                out["running"] = job.running
+                when = job.due(now, self._last_activity)
+                out["next_in"] = (None if when is None
+                                  else round(max(0.0, when - now), 3))
+                jobs[name] = out
+            return {"running": self._thread is not None and not self._stopping,
+                    "events": self._events, "jobs": jobs}
+
+    # --- hilo ---
+    def _run(self) -> None:
+        with self._cond:
+            while not self._stopping:
+                now = time.time()
+                next_due = None
+                for job in self._jobs.values():
+                    when = job.due(now, self._last_activity)
+                    if when is None:
+                        continue
+                    if when <= now:
+                        if job.running:
+                            # ya está en marcha: se reevalúa al terminar
+                            if not job.deferred:
+                                job.deferred = True
+                                job.stats["skipped"] += 1
+                            continue
+                        self._launch(job, now)
+                        continue
+                    next_due = when if next_due is None else min(next_due, when)
+                if next_due is None:
+                    self._cond.wait()
+                else:
+                    self._cond.wait(max(0.0, next_due - time.time()))
+
+    def _launch(self, job: Job, now: float) -> None:
+        events = job.pending
+        if events > 1:
+            job.stats["coalesced"] += events - 1
+        job.pending = 0
+        job.deferred = False
+        job.first_event = None
+        if job.idle is not None and self._last_activity is not None \
+                and now >= self._last_activity + job.idle:
+            job.idle_done = True
+        job.last_start = now
+        job.running = True
+        try:
+            self._pool.submit(self._execute, job, events)
+        except RuntimeError:
+            # pool cerrado durante el apagado
+            job.running = False
+
+    def _execute(self, job: Job, events: int) -> None:
+        start = time.perf_counter()
+        error = False
+        try:
+            if job.pass_events:
+                job.fn(events)
+            else:
+                job.fn()
+        except Exception:
+            error = True
+        ms = (time.perf_counter() - start) * 1000.0
+        with self._cond:
+            job.running = False
+            s = job.stats
+            s["runs"] += 1
+            s["errors"] += 1 if error else 0
+            s["last_ms"] = round(ms, 3)
+            s["total_ms"] = round(s["total_ms"] + ms, 3)
+            s["max_ms"] = round(max(s["max_ms"], ms), 3)
+            s["last_run"] = time.time()
+            self._cond.notify_all()
+
+
+SCHEDULER = Scheduler()
@@ -4,7 +4,12 @@ from flask_cors import CORS
 import os
 
 import agent
-from state_manager import load_state, save_state
+import memory_index
+import metrics
+from proposal_store import PROPOSAL_WRITER
+from scheduler import SCHEDULER
+from sessions import SESSIONS
+from state_actor import ACTOR
 import main
 
 app = Flask(__name__, static_folder="static")
@@ -30,7 +35,7 @@ def health():
 
 @app.route("/state")
 def get_state():
-    return jsonify(load_state())
+    return jsonify(ACTOR.snapshot())
 
 
 @app.route("/ask", methods=["POST"])
@@ -41,9 +46,22 @@ def ask():
     if not msg:
         return jsonify({"response": "Debes enviar un mensaje."})
 
-    # Cargar estado
-    state = load_state()
+    # "session"/"session_id": estado propio de esa conversación;
+    # si no, actor de estado global (se persiste al cerrar el lote)
+    sid = data.get("session") or data.get("session_id")
+    with metrics.span("ask"):
+        if sid:
+            ai_response, version = SESSIONS.call(str(sid), _ask, msg)
+        else:
+            ai_response, version = ACTOR.call(_ask, msg)
 
+    return jsonify({
+        "response": ai_response,
+        "version": version,
+    })
+
+
+def _ask(state, msg):
     # Guardar memoria del usuario antes de procesar
     main.add_short(state, f"USER: {msg}")
 
@@ -57,18 +75,41 @@ def ask():
     main._promote_short_to_long_if_needed(state)
     main.limit_memory(state)
 
-    save_state(state)
+    return ai_response, state.get("version", 1.0)
 
-    return jsonify({
-        "response": ai_response,
-        "version": state.get("version", 1.0),
-    })
+
+@app.route("/ask/batch", methods=["POST"])
+def ask_batch():
+    # {"messages": [...], "session": opcional} -> respuestas + tiempos
+    data = request.get_json(force=True) or {}
+    messages = data.get("messages")
+    if not isinstance(messages, list) or not messages:
+        return jsonify({"error": "messages debe ser una lista no vacía"}), 400
+    if len(messages) > main.MAX_BATCH_MESSAGES:
+        return jsonify({"error": f"como máximo {main.MAX_BATCH_MESSAGES} "
+                                 f"mensajes por lote"}), 413
+    result = main.think_batch(
+        messages, session=data.get("session") or data.get("session_id"))
+    return jsonify(result)
 
 
 @app.route("/proposals")
 def list_proposals():
-    state = load_state()
-    return jsonify(agent.list_proposals(state))
+    # filtros opcionales: ?since=<ts>&until=<ts>&applied=true|false
+    # paginación: ?offset=<n>&limit=<n>
+    since = request.args.get("since", type=float)
+    until = request.args.get("until", type=float)
+    applied = request.args.get("applied")
+    offset = request.args.get("offset", default=0, type=int)
+    limit = request.args.get("limit", type=int)
+    def select(state):
+        if since is None and until is None and applied is None:
+            return list(agent.list_proposals(state, offset, limit))
+        return agent.query_proposals(
+            since=since, until=until,
+            applied=None if applied is None else applied.lower() == "true",
+            offset=offset, limit=limit)
+    return jsonify(ACTOR.read(select))
 
 
 @app.route("/proposals/<pid>")
@@ -93,10 +134,8 @@ def apply_proposal(pid: str):
                 "autorun not enabled. Create file 'autorun_enabled'"
             }), 403)
 
-    state = load_state()
-    updated_state = agent.apply_proposal(state, pid)
+    ACTOR.call(agent.apply_proposal, pid)
 
-    save_state(updated_state)
     return jsonify({"ok": True, "msg": "Propuesta aplicada"})
 
 
@@ -110,7 +149,10 @@ def do_summarize():
 
 @app.route("/status")
 def status():
-    state = load_state()
+    return jsonify(ACTOR.read(_status_payload))
+
+
+def _status_payload(state):
     meta = state.get("meta", {})
     curiosity = meta.get("curiosity", 0)
     coherence = meta.get("coherence", 0)
@@ -125,11 +167,9 @@ def status():
             last_summary = text
             break
 
-    proposals = agent.list_proposals(state)
-    applied = len(state.get("applied_proposals", []))
-    total = len(proposals)
+    counts = agent.proposal_counts(state)
 
-    return jsonify({
+    return {
         "version": state.get("version", 1.0),
         "persona": meta.get("persona"),
         "curiosity": curiosity,
@@ -139,13 +179,19 @@ def status():
             "short_memory_entries": short_count,
             "long_memory_entries": long_count,
         },
-        "proposals": {
-            "total": total,
-            "applied": applied,
-            "pending": total - applied
-        },
+        "proposals": counts,
         "last_summary": last_summary,
-    })
+        "proposal_writer": PROPOSAL_WRITER.stats(),
+        "state_actor": ACTOR.stats(),
+        "sessions": SESSIONS.stats(),
+        "scheduler": SCHEDULER.stats(),
+        "retrieval_cache": memory_index.cache_stats(),
+    }
+
+
+@app.route("/metrics")
+def metrics_route():
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
 
 
 @app.route("/status-ui")
@@ -0,0 +1,167 @@
+# sessions.py
+"""
+Estado por conversación (multi-tenant), por remitente o id de sesión.
+
+- Cada sesión tiene su propio short_memory, long_memory, meta y level,
+  guardados con el mismo formato que el estado global (snapshot binario
+  + log) en un directorio con shard:
+      sessions/<hh>/<sha1(id)[:20]>/state.bin|state.log
+  (hh = dos primeros hex del hash; el id original va en meta["session"]).
+- Se cargan bajo demanda en un LRU de sesiones calientes
+  (PRIMORDIAL_SESSIONS_HOT); al salir del LRU se suelta su estado y su
+  índice de retrieval, así que la memoria queda acotada. Una sesión en
+  uso (con lease) no se descarta: el LRU puede pasar de su capacidad un
+  momento y se recorta al soltarla.
+- Cada sesión tiene su propio índice de retrieval (memory_index.use_index),
+  de modo que un usuario muy activo no agranda la ventana ni el coste de
+  guardado de los demás.
+- Cada sesión tiene su propio actor de estado (state_actor): un único
+  escritor por sesión, con lotes y un save por lote, como el global.
+
+    SESSIONS.call(sid, fn, *args)    fn(state, *args) en el actor de la sesión
+    SESSIONS.submit(sid, fn, *args)  lo mismo, devuelve un Future (asgi_app)
+    SESSIONS.think(sid, mensaje)     respuesta dentro de la sesión
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Dict
+
+import memory_index
+from process_lock import ProcessLock
+from state_actor import StateActor
+from state_log import StateLog
+from state_manager import StateStore
+
+SESSIONS_DIR = "sessions"
+HOT_SESSIONS = int(os.environ.get("PRIMORDIAL_SESSIONS_HOT", 128))
+MAX_SESSION_ID = 256
+
+
+def session_path(root: str, sid: str) -> str:
+    digest = hashlib.sha1(sid.encode("utf-8")).hexdigest()
+    return os.path.join(root, digest[:2], digest[:20])
+
+
+class Session:
+
+    def __init__(self, sid: str, path: str):
+        self.sid = sid
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        lock = ProcessLock(os.path.join(path, "state.lock"))
+        log = StateLog(os.path.join(path, "state.bin"),
+                       os.path.join(path, "state.log"),
+                       lock=lock,
+                       compact_lock=ProcessLock(
+                           os.path.join(path, "state.compact.lock")))
+        self.store = StateStore(log, lock=lock)
+        self.index = memory_index.new_index()
+        self.actor = StateActor(self.store)
+        # leases activos (SessionManager.lease); con 0 se puede descartar
+        self.leases = 0
+
+    def _command(self, state, fn, args, kwargs):
+        # en el hilo del actor de la sesión
+        with memory_index.use_index(self.index):
+            meta = state.setdefault("meta", {})
+            if meta.get("session") != self.sid:
+                meta["session"] = self.sid
+            return fn(state, *args, **kwargs)
+
+    def submit(self, fn, *args, **kwargs):
+        return self.actor.submit(self._command, fn, args, kwargs)
+
+    def call(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
+
+    def close(self) -> None:
+        self.actor.close()
+
+
+class SessionManager:
+
+    def __init__(self, root: str = SESSIONS_DIR, capacity: int = HOT_SESSIONS):
+        self.root = root
+        self.capacity = max(1, capacity)
+        self._hot: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "loads": 0, "evictions": 0}
+
+    def _acquire(self, sid: str) -> Session:
+        sid = str(sid or "unknown")[:MAX_SESSION_ID]
+        with self._lock:
+            session = self._hot.get(sid)
+            if session is not None:
+                self._hot.move_to_end(sid)
+                self._stats["hits"] += 1
+            else:
+                session = Session(sid, session_path(self.root, sid))
+                self._hot[sid] = session
+                self._stats["loads"] += 1
+            session.leases += 1
+            self._evict_idle()
+        return session
+
+    def _release(self, session: Session) -> None:
+        with self._lock:
+            session.leases -= 1
+            self._evict_idle()
+
+    @contextmanager
+    def lease(self, sid: str):
+        """La sesión sid, que no se descarta del LRU mientras dure."""
+        session = self._acquire(sid)
+        try:
+            yield session
+        finally:
+            self._release(session)
+
+    def _evict_idle(self) -> None:
+        """Descarta las más antiguas SIN lease hasta volver a la capacidad."""
+        excess = len(self._hot) - self.capacity
+        if excess <= 0:
+            return
+        idle = [sid for sid, s in self._hot.items() if not s.leases][:excess]
+        for sid in idle:
+            # ya persistida en cada lote: basta con parar su actor y soltarla
+            self._hot.pop(sid).close()
+            self._stats["evictions"] += 1
+
+    def submit(self, sid: str, fn, *args, **kwargs) -> Future:
+        """
+        Encola fn(state, *args) en el actor de la sesión sid y devuelve un
+        Future; la sesión tiene lease hasta que el Future se resuelve.
+        """
+        session = self._acquire(sid)
+        try:
+            future = session.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(session)
+            raise
+        future.add_done_callback(lambda _f: self._release(session))
+        return future
+
+    def call(self, sid: str, fn, *args, **kwargs):
+        """fn(state, *args) en el actor de la sesión sid (persiste al final)."""
+        return self.submit(sid, fn, *args, **kwargs).result()
+
+    def think(self, sid: str, message: str) -> str:
+        """main.think dentro de la sesión sid."""
+        import main
+        return self.call(sid, main._think, message)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+            out["hot"] = len(self._hot)
+            out["leased"] = sum(1 for s in self._hot.values() if s.leases)
+        out["capacity"] = self.capacity
+        return out
+
+
+SESSIONS = SessionManager()
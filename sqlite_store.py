@@ -0,0 +1,351 @@
+# sqlite_store.py
+"""
+Motor de almacenamiento SQLite (opcional) para el estado.
+
+Se activa con PRIMORDIAL_STORAGE=sqlite y se usa detrás de la misma
+superficie que el log (load_state / save_state / add_short / add_long):
+StateStore le pide load(), persist(state), changed_on_disk() y compact().
+
+Esquema (state.db, modo WAL):
+- memories(id, kind, ts, importance, text, entry)
+    una fila por entrada de short_memory / long_memory; "entry" guarda la
+    entrada original en JSON para devolverla con su forma exacta.
+- memories_fts: índice FTS5 sobre memories.text (si SQLite lo soporta),
+    usado por reasoning.retrieve con PRIMORDIAL_RETRIEVAL=fts.
+- meta(key, value): el resto de claves del estado (meta, version, level,
+    applied_proposals...) como JSON.
+
+persist() traduce el delta del estado (state_log.diff_state) a SQL:
+append -> INSERT, trim -> DELETE indexado de las filas más antiguas,
+set/del de claves -> meta. La primera vez migra el estado existente
+(state.bin/state.json + state.log) en una sola transacción.
+
+Cada COMPACT_EVERY escrituras, compact() en segundo plano: checkpoint
+del WAL y on_snapshot(estado) (backup incremental, como al compactar
+el log).
+"""
+
+import json
+import re
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+from memory import entry_text
+from memory_index import SyncedIndex, normalize
+from memory_log import to_ts
+from state_log import COMPACT_EVERY, build_shadow, diff_state, rebase_ops
+
+MEMORY_KINDS = {"short_memory": "short", "long_memory": "long"}
+
+# palabras vacías (ya normalizadas) que no entran en el MATCH: casi todas
+# las filas las contienen
+STOPWORDS = frozenset("""
+    a al algo como con de del desde e el ella ellos en era es esa ese eso
+    esta este esto fue ha hay la las le les lo los mas me mi mis muy nos o
+    para pero por que se ser si sin son su sus te tu tus u un una unos unas
+    y ya yo
+    an and are be do i in is it of on or the this that to was with you
+""".split())
+# candidatos de bm25 por resultado pedido (se puntúan y filtran después)
+FTS_CANDIDATES = 4
+
+_WORD = re.compile(r"\w+")
+
+_ACTIVE = None
+
+
+def _entry_ts(entry: Any) -> Optional[float]:
+    if not isinstance(entry, dict):
+        return None
+    # ISO sin zona = UTC, como en memory_log
+    return to_ts(entry.get("ts", entry.get("timestamp")))
+
+
+def _entry_row(kind: str, entry: Any) -> Tuple:
+    importance = entry.get("importance") if isinstance(entry, dict) else None
+    return (kind, _entry_ts(entry), importance, entry_text(entry),
+            json.dumps(entry, ensure_ascii=False))
+
+
+class SqliteStateEngine:
+
+    def __init__(self, path: str, migrate_from=None, lock=None,
+                 on_snapshot: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 compact_lock=None):
+        self.path = path
+        self.migrate_from = migrate_from
+        self.on_snapshot = on_snapshot
+        self._lock = lock if lock is not None else threading.RLock()
+        self._compact_lock = (compact_lock if compact_lock is not None
+                              else threading.Lock())
+        self._compacting = False
+        self._writes = 0
+        self._shadow: Dict[str, Any] = {}
+        self._data_version = None
+        self.fts = False
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS memories (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                ts REAL,
+                importance REAL,
+                text TEXT NOT NULL,
+                entry TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS memories_kind ON memories(kind, id);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        try:
+            self._db.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(
+                    text, content='memories', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2');
+                CREATE TRIGGER IF NOT EXISTS memories_ai AFTER INSERT ON memories
+                BEGIN
+                    INSERT INTO memories_fts(rowid, text) VALUES (new.id, new.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS memories_ad AFTER DELETE ON memories
+                BEGIN
+                    INSERT INTO memories_fts(memories_fts, rowid, text)
+                    VALUES ('delete', old.id, old.text);
+                END;
+            """)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite sin FTS5: retrieval sigue con el índice en memoria
+            self.fts = False
+        global _ACTIVE
+        _ACTIVE = self
+
+    # --- detección de cambios de otros procesos ---
+    def changed_on_disk(self) -> bool:
+        with self._lock:
+            version = self._db.execute("PRAGMA data_version").fetchone()[0]
+            return version != self._data_version
+
+    def _mark_seen(self) -> None:
+        self._data_version = self._db.execute(
+            "PRAGMA data_version").fetchone()[0]
+
+    # --- carga ---
+    def _is_empty(self) -> bool:
+        row = self._db.execute(
+            "SELECT (SELECT COUNT(*) FROM meta) + "
+            "(SELECT COUNT(*) FROM memories)").fetchone()
+        return row[0] == 0
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if self._is_empty() and self.migrate_from is not None:
+                legacy = self.migrate_from.load()
+                if legacy is not None:
+                    self._shadow = {}
+                    self.persist(legacy)
+            if self._is_empty():
+                self._mark_seen()
+                return None
+            state = self._read_state()
+            self._shadow = build_shadow(state)
+            self._mark_seen()
+            return state
+
+    def _read_state(self) -> Dict[str, Any]:
+        state: Dict[str, Any] = {}
+        for key, value in self._db.execute("SELECT key, value FROM meta"):
+            state[key] = json.loads(value)
+        for key, kind in MEMORY_KINDS.items():
+            state[key] = [
+                json.loads(row[0]) for row in self._db.execute(
+                    "SELECT entry FROM memories WHERE kind=? ORDER BY id",
+                    (kind,))
+            ]
+        return state
+
+    # --- escritura ---
+    def delta(self, state: Dict[str, Any]) -> List[Dict]:
+        """
+        Ops de state desde la última carga/escritura propia, sin escribir
+        (la sombra queda avanzada: hay que recargar después).
+        """
+        with self._lock:
+            return rebase_ops(self._shadow, state)
+
+    def persist(self, state: Dict[str, Any]) -> int:
+        """Aplica el delta como SQL en una transacción. Devuelve nº de ops."""
+        with self._lock:
+            ops = diff_state(self._shadow, state)
+            if not ops:
+                return 0
+            written = 0
+            try:
+                with self._db:
+                    for op in ops:
+                        written += self._apply(op)
+            except Exception:
+                self._shadow = {}
+                raise
+            metrics.add_bytes("state", written)
+            self._mark_seen()
+            self._writes += 1
+            if self._writes >= COMPACT_EVERY:
+                self._start_compaction()
+            return len(ops)
+
+    def _apply(self, op: Dict[str, Any]) -> int:
+        """Ejecuta una op. Devuelve los bytes de datos escritos (aprox.)."""
+        key = op["key"]
+        kind = MEMORY_KINDS.get(key)
+        db = self._db
+        if kind is None:
+            if op["op"] == "del":
+                db.execute("DELETE FROM meta WHERE key=?", (key,))
+            else:
+                # append/trim/set sobre otras listas: se guarda el valor entero
+                value = (op.get("value") if op["op"] == "set"
+                         else _meta_list_value(db, key, op))
+                encoded = json.dumps(value, ensure_ascii=False)
+                db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)",
+                           (key, encoded))
+                return len(encoded)
+            return 0
+
+        rows = []
+        if op["op"] == "append":
+            rows = [_entry_row(kind, e) for e in op["items"]]
+        elif op["op"] == "trim":
+            self._trim(kind, op["n"])
+        elif op["op"] in ("set", "del"):
+            db.execute("DELETE FROM memories WHERE kind=?", (kind,))
+            items = op.get("value") or []
+            if isinstance(items, list):
+                rows = [_entry_row(kind, e) for e in items]
+        if rows:
+            db.executemany(
+                "INSERT INTO memories(kind, ts, importance, text, entry) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+        return sum(len(r[3]) + len(r[4]) for r in rows)
+
+    def _trim(self, kind: str, n: int) -> None:
+        """Retención: DELETE indexado de las n filas más antiguas de kind."""
+        if n <= 0:
+            return
+        self._db.execute(
+            "DELETE FROM memories WHERE kind=? AND id <= ("
+            " SELECT id FROM memories WHERE kind=? ORDER BY id"
+            " LIMIT 1 OFFSET ?)", (kind, kind, n - 1))
+
+    # --- checkpoint + backup ---
+    def _start_compaction(self) -> None:
+        if self._compacting:
+            return
+        self._compacting = True
+        t = threading.Thread(target=self.compact, daemon=True)
+        t.start()
+
+    def compact(self) -> None:
+        """Checkpoint del WAL y backup del estado (uno a la vez)."""
+        try:
+            with self._compact_lock:
+                with self._lock:
+                    self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                    self._writes = 0
+                    state = (self._read_state() if self.on_snapshot is not None
+                             else None)
+                if state is not None:
+                    try:
+                        self.on_snapshot(state)
+                    except Exception:
+                        pass
+        finally:
+            self._compacting = False
+
+    # --- búsqueda ---
+    def search_long(self, query: str, top_k: int,
+                    threshold: float = 0.0) -> List[Tuple[float, str]]:
+        """
+        [(score, texto)] de long_memory: candidatos por bm25 (OR de las
+        palabras no vacías de la consulta); score = fracción de esas
+        palabras que contiene el texto (0..1), solo los > threshold.
+        """
+        terms = list(dict.fromkeys(
+            w for w in _WORD.findall(normalize(query)) if w not in STOPWORDS))
+        if not terms or not self.fts or top_k <= 0:
+            return []
+        match = " OR ".join(f'"{w}"' for w in terms)
+        with self._lock:
+            try:
+                rows = self._db.execute(
+                    "SELECT bm25(memories_fts), m.text FROM memories_fts"
+                    " JOIN memories m ON m.id = memories_fts.rowid"
+                    " WHERE memories_fts MATCH ? AND m.kind = 'long'"
+                    " ORDER BY bm25(memories_fts), m.id DESC LIMIT ?",
+                    (match, top_k * FTS_CANDIDATES)).fetchall()
+            except sqlite3.OperationalError:
+                return []
+        scored = []
+        for rank, (_bm25, text) in enumerate(rows):
+            words = set(_WORD.findall(normalize(text)))
+            score = sum(1 for w in terms if w in words) / len(terms)
+            if score > threshold:
+                # a igual cobertura, el orden de bm25
+                scored.append((score, -rank, text))
+        scored.sort(reverse=True)
+        return [(score, text) for score, _r, text in scored[:top_k]]
+
+
+def _meta_list_value(db, key: str, op: Dict[str, Any]) -> Any:
+    """Valor resultante de un append/trim sobre una lista guardada en meta."""
+    row = db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+    value = json.loads(row[0]) if row else []
+    if not isinstance(value, list):
+        value = []
+    if op["op"] == "append":
+        value.extend(op.get("items", []))
+    elif op["op"] == "trim":
+        del value[:op.get("n", 0)]
+    return value
+
+
+class FtsIndex(SyncedIndex):
+    """
+    Adaptador de retrieval sobre memories_fts. No mantiene nada en
+    memoria: SQLite ya indexa al persistir, así que sync() es un no-op
+    (las entradas aún no guardadas no aparecen hasta el siguiente save).
+    """
+
+    def __init__(self, engine: SqliteStateEngine):
+        self.engine = engine
+        super().__init__()
+
+    def _clear_docs(self) -> None:
+        pass
+
+    def sync(self, entries: List[Any], start: int = 0) -> None:
+        pass
+
+    def search(self, query: str, top_k: int = 5,
+               threshold: Optional[float] = None) -> List[Tuple[float, str]]:
+        if threshold is None:
+            threshold = self.THRESHOLD
+        return self.engine.search_long(query, top_k, threshold)
+
+
+_FTS_INDEX = None
+
+
+def fts_index() -> Optional[FtsIndex]:
+    """Índice FTS del motor activo (None si no hay motor SQLite con FTS5)."""
+    global _FTS_INDEX
+    if _ACTIVE is None or not _ACTIVE.fts:
+        return None
+    if _FTS_INDEX is None or _FTS_INDEX.engine is not _ACTIVE:
+        _FTS_INDEX = FtsIndex(_ACTIVE)
+    return _FTS_INDEX
@@ -1,17 +1,52 @@
-from flask import request, jsonify
 import main
+import memory
+from sessions import SESSIONS
+
+
+def parse_incoming(data):
+    """(remitente, texto) de un payload de WhatsApp."""
+    data = data or {}
+    incoming = data.get("text") or data.get("message") or data.get("body") or ""
+    sender = data.get("waId") or data.get("from") or "unknown"
+    return sender, incoming
+
+
+def record_incoming(state, sender, incoming):
+    """Comando del actor: guarda el mensaje entrante en short_memory."""
+    memory.memory_list(state, "short_memory").append(
+        memory.make_entry(f"WHATSAPP {sender}: {incoming}"))
+
+
+def reply_payload(reply):
+    # formato simple
+    return {"replies": [{"type": "text", "message": reply}]}
+
+
+def handle_whatsapp(data):
+    """
+    Procesa un webhook completo (bloqueante). Lo usa Flask; asgi_app
+    espera submit_whatsapp sin ocupar un hilo.
+    Cada remitente tiene su propia sesión (sessions.py).
+    """
+    return reply_payload(submit_whatsapp(data).result())
+
+
+def submit_whatsapp(data):
+    """Encola el mensaje en la sesión del remitente; Future con la respuesta."""
+    sender, incoming = parse_incoming(data)
+    return SESSIONS.submit(sender, _record_and_think, sender, incoming)
+
+
+def _record_and_think(st, sender, incoming):
+    # guardar en memoria
+    record_incoming(st, sender, incoming)
+    # responder con think()
+    return main._think(st, incoming)
+
 
 def register_whatsapp_routes(app):
+    from flask import request, jsonify
+
     @app.route("/whatsapp", methods=["POST"])
     def whatsapp_webhook():
-        data = request.get_json(force=True)
-        incoming = data.get("text") or data.get("message") or data.get("body") or ""
-        sender = data.get("waId") or data.get("from") or "unknown"
-        # guardar en memoria
-        st = main.load_state()
-        st["short_memory"].append({"ts": __import__('time').time(), "text": f"WHATSAPP {sender}: {incoming}"})
-        main.save_state(st)
-        # responder con think()
-        reply = main.think(incoming)
-        # devolver formato simple
-        return jsonify({"replies":[{"type":"text","message": reply}]})
+        return jsonify(handle_whatsapp(request.get_json(force=True)))
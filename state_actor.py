@@ -0,0 +1,177 @@
+# state_actor.py
+"""
+Dueño único del estado: un hilo escritor con cola de comandos.
+
+Todas las mutaciones (api/server /ask, main.think, webhook, bucle de
+mantenimiento y evolución) se envían como funciones fn(state, ...) y
+se ejecutan en orden en el hilo del actor. Los comandos que llegan
+juntos se ejecutan en lote y se persisten con UN solo save al final
+(group commit), en vez de un load/save por petición.
+
+El lote solo excluye a los hilos del proceso (STORE.mutex); el lock
+entre procesos se toma al recargar y al guardar, no mientras se calcula
+(ver StateStore), así que varios workers procesan lotes en paralelo.
+
+    ACTOR.call(fn, *args)    ejecuta y espera el resultado (tras persistir)
+    ACTOR.submit(fn, *args)  encola y devuelve un Future
+    ACTOR.read(fn)           lectura consistente (no persiste)
+    ACTOR.snapshot()         copia superficial del estado para serializar
+    actor.close()            para el hilo tras lo encolado (sesiones)
+
+Si un comando llama de nuevo al actor desde su propio hilo se ejecuta
+en línea (no hay bloqueo por reentrada).
+"""
+
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict
+
+from memory_log import LIST_TYPES
+from state_manager import STORE
+
+# comandos como máximo por lote (un save por lote)
+MAX_BATCH = 64
+
+# en la cola: el hilo del actor termina al llegar aquí
+_STOP = object()
+
+
+def shallow_copy(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Copia de listas/dicts de primer nivel, segura de serializar fuera."""
+    return {
+        k: (list(v) if isinstance(v, LIST_TYPES) else
+            dict(v) if isinstance(v, dict) else v)
+        for k, v in state.items()
+    }
+
+
+class StateActor:
+
+    def __init__(self, store, max_batch: int = MAX_BATCH):
+        self.store = store
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._stats = {"commands": 0, "reads": 0, "batches": 0,
+                       "saves": 0, "errors": 0}
+
+    # --- arranque ---
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="state-actor", daemon=True)
+                self._thread.start()
+
+    def _in_actor(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    # --- API ---
+    def submit(self, fn: Callable, *args, write: bool = True, **kwargs) -> Future:
+        future = Future()
+        if self._in_actor():
+            # reentrada: ya estamos dentro de un lote
+            try:
+                future.set_result(fn(self.store.get(), *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        if self._closed:
+            raise RuntimeError("actor de estado cerrado")
+        self._ensure_started()
+        self._queue.put((fn, args, kwargs, write, future))
+        return future
+
+    def call(self, fn: Callable, *args, timeout=None, **kwargs) -> Any:
+        return self.submit(fn, *args, **kwargs).result(timeout)
+
+    def read(self, fn: Callable, *args, timeout=None, **kwargs) -> Any:
+        return self.submit(fn, *args, write=False, **kwargs).result(timeout)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return self.read(shallow_copy)
+
+    def close(self) -> None:
+        """Termina el hilo cuando acabe lo encolado; no admite más comandos."""
+        with self._start_lock:
+            self._closed = True
+            if self._thread is not None and self._thread.is_alive():
+                self._queue.put(_STOP)
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            out = dict(self._stats)
+        out["queued"] = self._queue.qsize()
+        return out
+
+    def _count(self, **deltas) -> None:
+        with self._stats_lock:
+            for k, v in deltas.items():
+                self._stats[k] += v
+
+    # --- hilo ---
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._run_batch(batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch) -> None:
+        results = []
+        dirty = False
+        errors = 0
+        with self.store.mutex:
+            try:
+                state = self.store.get()
+            except Exception as e:
+                for *_rest, future in batch:
+                    future.set_exception(e)
+                self._count(errors=len(batch))
+                return
+            with self.store.pinned():
+                for fn, args, kwargs, write, future in batch:
+                    try:
+                        results.append((future, fn(state, *args, **kwargs),
+                                        None))
+                    except Exception as e:
+                        results.append((future, None, e))
+                        errors += 1
+                    dirty = dirty or write
+            if dirty:
+                try:
+                    self.store.save(state)
+                except Exception as e:
+                    # nada del lote quedó persistido: se informa a todos
+                    results = [(f, None, e) for f, _r, _e in results]
+                    errors = len(batch)
+        writes = sum(1 for *_x, write, _f in batch if write)
+        self._count(commands=writes, reads=len(batch) - writes, batches=1,
+                    saves=1 if dirty else 0, errors=errors)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+ACTOR = StateActor(STORE)
@@ -0,0 +1,356 @@
+# state_log.py
+"""
+Log de escritura anticipada (WAL) para el estado.
+
+En vez de reescribir el estado completo en cada guardado:
+- persist(state) calcula un delta contra la última versión persistida
+  ("sombra" en memoria) y añade UNA línea JSON a state.log:
+    {"seq": N, "ts": ..., "ops": [...]}
+  ops posibles:
+    {"op": "append", "key": k, "items": [...]}   añadir al final de una lista
+    {"op": "trim",   "key": k, "n": n}           recortar n por la cabeza
+    {"op": "set",    "key": k, "value": v}       reemplazar un valor (meta, version...)
+    {"op": "del",    "key": k}                   eliminar una clave
+- Cada COMPACT_EVERY registros se compacta en segundo plano:
+  el log se rota a state.log.compacting, se aplica sobre el snapshot
+  (state.bin) y el snapshot se reemplaza de forma atómica.
+- Al arrancar: snapshot + log(s) reproducidos en orden de seq.
+- El snapshot usa el formato binario de snapshot_codec; un snapshot
+  JSON legado (legacy_file) se migra automáticamente en la primera carga.
+
+El snapshot guarda "_wal_seq" (último seq incluido) para que reproducir
+un registro ya compactado sea un no-op tras una caída.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+import snapshot_codec
+from memory import align_entries, entry_key
+from memory_log import LIST_TYPES, MemoryLog, plain, plain_state
+
+COMPACT_EVERY = 500
+COMPACT_BYTES = 4 * 1024 * 1024
+SEQ_KEY = "_wal_seq"
+
+
+# -------------------------
+# deltas
+# -------------------------
+def _encode(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+
+def _generation(value: Any) -> Optional[int]:
+    return value.generation if isinstance(value, MemoryLog) else None
+
+
+def _list_shadow(value: List[Any]) -> Tuple[str, deque, Optional[int]]:
+    # la generación de una MemoryLog delata reescrituras por el medio
+    # (consolidación) que las claves de los extremos no ven
+    return ("list", deque(entry_key(e) for e in value), _generation(value))
+
+
+def diff_state(shadow: Dict[str, Any], state: Dict[str, Any]) -> List[Dict]:
+    """
+    Ops que llevan de la sombra a state. Actualiza la sombra en su sitio.
+    Listas: coste proporcional a lo añadido/recortado.
+    Resto de claves: se comparan serializadas (son pequeñas).
+    """
+    ops = []
+    for key in list(shadow.keys()):
+        if key not in state:
+            ops.append({"op": "del", "key": key})
+            del shadow[key]
+
+    for key, value in state.items():
+        known = shadow.get(key)
+        if isinstance(value, LIST_TYPES):
+            generation = _generation(value)
+            if (known is not None and known[0] == "list"
+                    and known[2] in (None, generation)):
+                keys = known[1]
+                aligned = align_entries(keys, value)
+                if aligned is not None:
+                    if known[2] != generation:
+                        shadow[key] = ("list", keys, generation)
+                    dropped, first_new = aligned
+                    if dropped:
+                        ops.append({"op": "trim", "key": key, "n": dropped})
+                        for _ in range(dropped):
+                            keys.popleft()
+                    if first_new < len(value):
+                        items = value[first_new:]
+                        ops.append({"op": "append", "key": key,
+                                    "items": items})
+                        keys.extend(entry_key(e) for e in items)
+                    continue
+            ops.append({"op": "set", "key": key, "value": plain(value)})
+            shadow[key] = _list_shadow(value)
+        else:
+            encoded = _encode(value)
+            if known is None or known != ("value", encoded):
+                ops.append({"op": "set", "key": key, "value": value})
+                shadow[key] = ("value", encoded)
+    return ops
+
+
+def rebase_ops(shadow: Dict[str, Any], state: Dict[str, Any]) -> List[Dict]:
+    """
+    Como diff_state, pero un dict cambiado (meta) va como "update" con
+    solo sus subclaves cambiadas: al reaplicar el delta sobre lo que
+    escribió otro proceso no pisa las demás.
+    """
+    before = {k: json.loads(v[1]) for k, v in shadow.items()
+              if v[0] == "value"}
+    ops = diff_state(shadow, state)
+    for i, op in enumerate(ops):
+        old, new = before.get(op["key"]), op.get("value")
+        if op["op"] == "set" and isinstance(old, dict) and isinstance(new, dict):
+            ops[i] = {"op": "update", "key": op["key"],
+                      "value": {k: v for k, v in new.items()
+                                if k not in old or _encode(old[k]) != _encode(v)},
+                      "removed": [k for k in old if k not in new]}
+    return ops
+
+
+def apply_ops(state: Dict[str, Any], ops: List[Dict]) -> None:
+    for op in ops:
+        key = op.get("key")
+        kind = op.get("op")
+        if kind == "set":
+            state[key] = op.get("value")
+        elif kind == "update":
+            target = state.get(key)
+            if not isinstance(target, dict):
+                target = state[key] = {}
+            for k in op.get("removed", ()):
+                target.pop(k, None)
+            target.update(op.get("value", {}))
+        elif kind == "del":
+            state.pop(key, None)
+        elif kind == "trim":
+            lst = state.setdefault(key, [])
+            del lst[:op.get("n", 0)]
+        elif kind == "append":
+            state.setdefault(key, []).extend(op.get("items", []))
+
+
+def build_shadow(state: Dict[str, Any]) -> Dict[str, Any]:
+    shadow = {}
+    for key, value in state.items():
+        if isinstance(value, LIST_TYPES):
+            shadow[key] = _list_shadow(value)
+        else:
+            shadow[key] = ("value", _encode(value))
+    return shadow
+
+
+def read_records(path: str):
+    """Registros de un log; ignora una última línea truncada."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(rec, dict):
+                yield rec
+
+
+# -------------------------
+# log
+# -------------------------
+class StateLog:
+    """Snapshot + log append-only de un estado."""
+
+    def __init__(self, snapshot_file: str, log_file: str,
+                 on_snapshot: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 legacy_file: Optional[str] = None,
+                 lock=None, compact_lock=None):
+        self.snapshot_file = snapshot_file
+        self.legacy_file = legacy_file
+        self.log_file = log_file
+        self.pending_file = log_file + ".compacting"
+        self.on_snapshot = on_snapshot
+        # con varios procesos se pasan ProcessLock (ver state_manager)
+        self._lock = lock if lock is not None else threading.RLock()
+        self._compact_lock = (compact_lock if compact_lock is not None
+                              else threading.Lock())
+        self._compacting = False
+        self._shadow: Dict[str, Any] = {}
+        self._seq = 0
+        self._records = 0
+        self._bytes = 0
+        self._disk_sig = None
+
+    # --- detección de cambios externos ---
+    def _signature(self) -> Tuple:
+        sig = []
+        for path in (self.snapshot_file, self.pending_file, self.log_file):
+            try:
+                st = os.stat(path)
+                sig.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append(None)
+        return tuple(sig)
+
+    def changed_on_disk(self) -> bool:
+        """True si los ficheros cambiaron desde la última lectura/escritura propia."""
+        return self._signature() != self._disk_sig
+
+    def _refresh_signature(self, fresh: bool) -> None:
+        # si otro proceso escribió antes de nuestra rotación/instalación,
+        # la firma se deja vieja para que el siguiente get() recargue
+        self._disk_sig = self._signature() if fresh else None
+
+    # --- snapshot ---
+    def _read_snapshot(self) -> Tuple[Optional[Dict[str, Any]], int]:
+        if not os.path.exists(self.snapshot_file):
+            return None, 0
+        state = snapshot_codec.load_file(self.snapshot_file)
+        seq = state.pop(SEQ_KEY, 0) if isinstance(state, dict) else 0
+        return state, int(seq or 0)
+
+    def _write_snapshot(self, state: Dict[str, Any], seq: int) -> str:
+        """Escribe el snapshot en un temporal; el llamador lo instala."""
+        tmp = self.snapshot_file + ".tmp"
+        data = plain_state(state)
+        data[SEQ_KEY] = seq
+        metrics.add_bytes("state", snapshot_codec.dump_file(data, tmp))
+        return tmp
+
+    def _migrate_legacy(self) -> None:
+        """state.json legado -> snapshot binario (una sola vez)."""
+        if (not self.legacy_file or os.path.exists(self.snapshot_file)
+                or not os.path.exists(self.legacy_file)):
+            return
+        with open(self.legacy_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            return
+        seq = int(data.pop(SEQ_KEY, 0) or 0)
+        tmp = self._write_snapshot(data, seq)
+        os.replace(tmp, self.snapshot_file)
+        os.replace(self.legacy_file, self.legacy_file + ".migrated")
+
+    # --- carga ---
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        Reconstruye el estado: snapshot + log pendiente + log.
+        Devuelve None si no hay nada en disco.
+        """
+        with self._lock:
+            self._migrate_legacy()
+            pending = list(read_records(self.pending_file))
+            state, seq = self._read_snapshot()
+            records = 0
+            found = state is not None
+            state = state if state is not None else {}
+            for source in (pending, read_records(self.log_file)):
+                for rec in source:
+                    found = True
+                    if source is not pending:
+                        records += 1
+                    if int(rec.get("seq", 0)) <= seq:
+                        continue
+                    apply_ops(state, rec.get("ops", []))
+                    seq = int(rec["seq"])
+            if not found:
+                self._disk_sig = self._signature()
+                return None
+            self._seq = seq
+            self._records = records
+            self._bytes = (os.path.getsize(self.log_file)
+                           if os.path.exists(self.log_file) else 0)
+            self._shadow = build_shadow(state)
+            self._disk_sig = self._signature()
+            return state
+
+    # --- escritura ---
+    def delta(self, state: Dict[str, Any]) -> List[Dict]:
+        """
+        Ops de state desde la última carga/escritura propia, sin escribir
+        (la sombra queda avanzada: hay que recargar después).
+        """
+        with self._lock:
+            return rebase_ops(self._shadow, state)
+
+    def persist(self, state: Dict[str, Any]) -> int:
+        """Añade el delta de state al log. Devuelve los bytes escritos."""
+        with self._lock:
+            ops = diff_state(self._shadow, state)
+            if not ops:
+                return 0
+            self._seq += 1
+            line = json.dumps({
+                "seq": self._seq,
+                "ts": time.time(),
+                "ops": ops
+            }, ensure_ascii=False) + "\n"
+            try:
+                with open(self.log_file, "a", encoding="utf-8") as f:
+                    f.write(line)
+                metrics.add_bytes("state", len(line.encode("utf-8")))
+            except Exception:
+                # la sombra ya avanzó: forzar un "set" completo la próxima vez
+                self._shadow = {}
+                raise
+            self._records += 1
+            self._bytes += len(line)
+            self._disk_sig = self._signature()
+            if self._records >= COMPACT_EVERY or self._bytes >= COMPACT_BYTES:
+                self._start_compaction()
+            return len(line)
+
+    # --- compactación ---
+    def _start_compaction(self) -> None:
+        if self._compacting:
+            return
+        self._compacting = True
+        t = threading.Thread(target=self.compact, daemon=True)
+        t.start()
+
+    def compact(self) -> None:
+        """Rota el log y lo pliega sobre el snapshot (una a la vez)."""
+        try:
+            with self._compact_lock:
+                with self._lock:
+                    if (not os.path.exists(self.pending_file)
+                            and os.path.exists(self.log_file)):
+                        fresh = self._signature() == self._disk_sig
+                        os.replace(self.log_file, self.pending_file)
+                        self._records = 0
+                        self._bytes = 0
+                        self._refresh_signature(fresh)
+                if os.path.exists(self.pending_file):
+                    self._fold_pending()
+        finally:
+            self._compacting = False
+
+    def _fold_pending(self) -> None:
+        state, seq = self._read_snapshot()
+        state = state if state is not None else {}
+        for rec in read_records(self.pending_file):
+            if int(rec.get("seq", 0)) <= seq:
+                continue
+            apply_ops(state, rec.get("ops", []))
+            seq = int(rec["seq"])
+        tmp = self._write_snapshot(state, seq)
+        with self._lock:
+            fresh = self._signature() == self._disk_sig
+            os.replace(tmp, self.snapshot_file)
+            os.remove(self.pending_file)
+            self._refresh_signature(fresh)
+        if self.on_snapshot is not None:
+            try:
+                self.on_snapshot(state)
+            except Exception:
+                pass
@@ -1,73 +1,217 @@
 # state_manager.py
 import os
-import json
-import time
-from datetime import datetime
+import threading
+from contextlib import contextmanager
 
-STATE_FILE = "state.json"
-BACKUP_DIR = "backups"
+import memory
+import memory_index
+import metrics
+import snapshot_codec
+from backup_store import BackupStore
+from memory_log import LIST_TYPES
+from process_lock import ProcessLock
+from state_log import StateLog, apply_ops
 
+STATE_FILE = "state.bin"
+LEGACY_STATE_FILE = "state.json"
+EXPORT_FILE = "state_export.json"
+LOG_FILE = "state.log"
+SQLITE_FILE = "state.db"
+# locks entre procesos (workers de gunicorn que comparten el directorio)
+STATE_LOCK_FILE = "state.lock"
+COMPACT_LOCK_FILE = "state.compact.lock"
+BACKUP_DIR = "backups"
+# motor de almacenamiento: "log" (state.bin + state.log) o "sqlite" (state.db)
+STORAGE = os.environ.get("PRIMORDIAL_STORAGE", "log")
 
-def _ensure_dirs():
-    os.makedirs(BACKUP_DIR, exist_ok=True)
 
+# backups incrementales por contenido (backups/objects + backups/manifests)
+BACKUPS = BackupStore(BACKUP_DIR)
 
-def load_state():
-    if not os.path.exists(STATE_FILE):
-        state = {
-            "version": 1.0,
-            "short_memory": [],
-            "long_memory": [],
-            "meta": {
-                "persona": "evolutiva reflexiva",
-                "curiosity": 0.1,
-                "coherence": 0.1
-            },
-            "applied_proposals": [],
-            "proposals": []
-        }
-        save_state(state)
-        return state
-    with open(STATE_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
 
-
-def save_state(state):
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, indent=2, ensure_ascii=False)
-    _ensure_dirs()
-    ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-    bf = os.path.join(BACKUP_DIR, f"state_{ts}.json")
+def _write_backup(state):
+    """Backup incremental (solo al compactar el log)."""
     try:
-        with open(bf, "w", encoding="utf-8") as bfout:
-            json.dump(state, bfout, indent=2, ensure_ascii=False)
+        BACKUPS.backup(state)
     except Exception:
         pass
-    # keep last 10 backups
-    try:
-        files = sorted([f for f in os.listdir(BACKUP_DIR)], reverse=True)
-        for old in files[10:]:
+
+
+def _default_state():
+    return {
+        "version": 1.0,
+        "short_memory": [],
+        "long_memory": [],
+        "meta": {
+            "persona": "evolutiva reflexiva",
+            "curiosity": 0.1,
+            "coherence": 0.1
+        },
+        "applied_proposals": [],
+        "proposals": []
+    }
+
+
+class StateStore:
+    """
+    Estado parseado en memoria, compartido por todo el proceso.
+    - get(): devuelve el estado cacheado; solo vuelve a disco si los
+      ficheros cambiaron (inode/mtime/tamaño) o tras reload().
+    - transaction(): acceso exclusivo + persistencia al salir.
+    - read(fn): lectura consistente.
+    Dos locks:
+    - mutex: exclusión entre hilos del proceso sobre el estado en memoria
+      (se mantiene mientras se calcula).
+    - lock: con un ProcessLock, exclusión entre procesos; solo se toma
+      para cargar y persistir, así que los workers calculan en paralelo.
+      Si otro worker escribió mientras tanto, save() recarga y reaplica
+      encima el delta propio (las listas de memoria se suman; el resto de
+      claves, gana la última escritura).
+    Dentro de pinned() (lotes del actor, transacciones) get() no recarga:
+    lo escrito por otros se incorpora al guardar.
+    """
+
+    def __init__(self, engine, lock=None):
+        self._engine = engine
+        self.lock = lock if lock is not None else threading.RLock()
+        self.mutex = threading.RLock()
+        self._state = None
+        self._pinned = 0
+
+    def get(self):
+        with self.mutex:
+            if self._state is None or (not self._pinned
+                                       and self._engine.changed_on_disk()):
+                with self.lock:
+                    self._load()
+            return self._state
+
+    @contextmanager
+    def pinned(self):
+        """El estado en memoria no se sustituye mientras se calcula."""
+        with self.mutex:
+            self._pinned += 1
             try:
-                os.remove(os.path.join(BACKUP_DIR, old))
-            except Exception:
-                pass
-    except Exception:
-        pass
+                yield self.get()
+            finally:
+                self._pinned -= 1
+
+    def reload(self):
+        with self.mutex, self.lock:
+            self._load()
+            return self._state
+
+    def _load(self):
+        with metrics.span("load_state"):
+            state = self._engine.load()
+        if state is None:
+            state = _default_state()
+            self._engine.persist(state)
+        # short_memory / long_memory en columnas (memory_log)
+        self._state = memory.columnar(state)
+
+    def save(self, state=None):
+        """
+        Persiste el estado. Devuelve el estado vigente: otro objeto si hubo
+        que reaplicar el delta sobre lo que escribió otro proceso.
+        """
+        with self.mutex, self.lock:
+            if state is not None:
+                self._state = state
+            if self._state is not None:
+                with metrics.span("save_state"):
+                    if self._engine.changed_on_disk():
+                        self._rebase()
+                    self._engine.persist(self._state)
+            return self._state
+
+    def _rebase(self):
+        """Delta propio (desde la última carga/escritura) sobre el disco."""
+        ops = self._engine.delta(self._state)
+        state = self._engine.load()
+        if state is None:
+            state = _default_state()
+        apply_ops(state, ops)
+        self._state = memory.columnar(state)
+
+    @contextmanager
+    def transaction(self):
+        with self.mutex:
+            with self.pinned() as state:
+                yield state
+            self.save(state)
+
+    def read(self, fn):
+        with self.mutex:
+            return fn(self.get())
+
+    def current(self):
+        """
+        Último estado en memoria, sin mutex ni recarga (para métricas: no
+        espera al actor ni al lock; puede ir un lote por detrás). None si
+        aún no se cargó.
+        """
+        return self._state
+
+    def snapshot(self):
+        """Copia superficial (listas/dicts de primer nivel) para serializar."""
+        def copy(state):
+            return {
+                k: (list(v) if isinstance(v, LIST_TYPES) else
+                    dict(v) if isinstance(v, dict) else v)
+                for k, v in state.items()
+            }
+        return self.read(copy)
+
+
+_process_lock = ProcessLock(STATE_LOCK_FILE)
+_compact_lock = ProcessLock(COMPACT_LOCK_FILE)
+
+# snapshot binario (state.bin) + log append-only (state.log)
+_log = StateLog(STATE_FILE, LOG_FILE, on_snapshot=_write_backup,
+               legacy_file=LEGACY_STATE_FILE, lock=_process_lock,
+               compact_lock=_compact_lock)
+if STORAGE == "sqlite":
+    from sqlite_store import SqliteStateEngine
+    # state.db; la primera carga migra state.bin/state.json + state.log.
+    # Backups en cada checkpoint del WAL, como al compactar el log.
+    _engine = SqliteStateEngine(SQLITE_FILE, migrate_from=_log,
+                                lock=_process_lock, on_snapshot=_write_backup,
+                                compact_lock=_compact_lock)
+else:
+    _engine = _log
+STORE = StateStore(_engine, lock=_process_lock)
+
+
+def load_state():
+    """Estado compartido del proceso (sin re-parsear si no cambió en disco)."""
+    return STORE.get()
+
+
+def save_state(state):
+    """Añade al log solo lo que cambió desde el último guardado."""
+    STORE.save(state)
+
+
+def compact_state():
+    """Pliega el log sobre state.bin (o checkpoint del WAL de SQLite)."""
+    _engine.compact()
+
+
+def export_state_json(path=EXPORT_FILE):
+    """Exporta el estado actual como JSON legible (para humanos)."""
+    snapshot_codec.dump_json(STORE.snapshot(), path)
+    return path
 
 
-def add_short(state, text, limit=500):
-    entry = {"ts": time.time(), "text": text}
-    state.setdefault("short_memory", []).append(entry)
-    if len(state["short_memory"]) > limit:
-        state["short_memory"] = state["short_memory"][-limit:]
+def add_short(state, text):
+    memory.add_short_entry(state, text)
     save_state(state)
 
 
 def add_long(state, text, importance=0.5):
-    entry = {"ts": time.time(), "text": text, "importance": importance}
-    state.setdefault("long_memory", []).append(entry)
-    if len(state["long_memory"]) > 5000:
-        state["long_memory"] = state["long_memory"][-5000:]
+    memory.add_long_entry(state, text, importance)
+    memory_index.sync_state(state)
     save_state(state)
 
 
@@ -0,0 +1,252 @@
+# version_store.py
+"""
+Versiones evolutivas del estado guardadas como deltas.
+
+- Cada versión es un fichero versions/agent_v<N>.json con las ops de
+  state_log (append/trim/set/del) respecto a la versión anterior; cada
+  KEYFRAME_EVERY versiones se guarda el estado completo (keyframe) para
+  acotar lo que hay que reproducir.
+- versions/index.jsonl lista las versiones en orden (append-only).
+- Los agent_v<N>.txt históricos (estado completo en JSON tras dos
+  líneas de cabecera) se indexan la primera vez como keyframes.
+- reconstruct(nombre) reproduce desde el keyframe más cercano.
+- Retención: se conservan las últimas KEEP_VERSIONS; si la más antigua
+  que queda es un delta, se reescribe como keyframe.
+
+Uso:
+    python version_store.py list
+    python version_store.py show <nombre> [salida.json]
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+import snapshot_codec
+from memory_log import plain_state
+from state_log import apply_ops, build_shadow, diff_state
+
+VERSIONS_DIR = "versions"
+INDEX_NAME = "index.jsonl"
+KEYFRAME_EVERY = 25
+KEEP_VERSIONS = 50
+
+_LEGACY = re.compile(r"^agent_v(\d+(?:\.\d+)?)\.txt$")
+
+
+def _read_legacy(path: str) -> Dict[str, Any]:
+    """agent_v<N>.txt: cabecera de texto + JSON del estado."""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    start = content.find("{")
+    return json.loads(content[start:]) if start >= 0 else {}
+
+
+class VersionStore:
+
+    def __init__(self, root: str = VERSIONS_DIR):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_NAME)
+        self._lock = threading.RLock()
+        self._index: Optional[List[Dict[str, Any]]] = None
+        self._shadow: Optional[Dict[str, Any]] = None
+
+    # --- índice ---
+    def _load_index(self) -> List[Dict[str, Any]]:
+        if self._index is not None:
+            return self._index
+        index = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        index.append(json.loads(line))
+                    except ValueError:
+                        continue
+        else:
+            index = self._index_legacy()
+            self._rewrite_index(index)
+        self._index = index
+        return index
+
+    def _index_legacy(self) -> List[Dict[str, Any]]:
+        legacy = []
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                m = _LEGACY.match(name)
+                if m:
+                    path = os.path.join(self.root, name)
+                    legacy.append((float(m.group(1)),
+                                   os.path.getmtime(path), name))
+        return [{"name": name, "version": version, "ts": mtime,
+                 "keyframe": True, "legacy": True}
+                for version, mtime, name in sorted(legacy)]
+
+    def _rewrite_index(self, index: List[Dict[str, Any]]) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for item in index:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.index_path)
+
+    def list_versions(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(v) for v in self._load_index()]
+
+    def _position(self, name_or_version) -> Optional[int]:
+        """Por nombre (con o sin extensión) o número de versión."""
+        try:
+            number = float(name_or_version)
+        except (TypeError, ValueError):
+            number = None
+        index = self._load_index()
+        for i in range(len(index) - 1, -1, -1):
+            item = index[i]
+            if name_or_version in (item["name"],
+                                   item["name"].rsplit(".", 1)[0]):
+                return i
+            if number is not None and item["version"] == number:
+                return i
+        return None
+
+    # --- lectura ---
+    def _read(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        path = os.path.join(self.root, item["name"])
+        if item.get("legacy"):
+            return {"state": _read_legacy(path)}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def reconstruct(self, name_or_version=None) -> Optional[Dict[str, Any]]:
+        """Estado de una versión (nombre, número o None = la última)."""
+        with self._lock:
+            index = self._load_index()
+            if not index:
+                return None
+            pos = (len(index) - 1 if name_or_version is None
+                   else self._position(name_or_version))
+            if pos is None:
+                return None
+            start = pos
+            while start > 0 and not index[start].get("keyframe"):
+                start -= 1
+            state: Dict[str, Any] = {}
+            for item in index[start:pos + 1]:
+                data = self._read(item)
+                if "state" in data:
+                    state = data["state"]
+                else:
+                    apply_ops(state, data.get("ops", []))
+            return state
+
+    # --- escritura ---
+    def prepare(self, state: Dict[str, Any], **info) -> Tuple[Dict, bytes]:
+        """
+        Delta contra la versión anterior, ya serializado (se llama con el
+        estado bloqueado; la escritura va después con commit()).
+        """
+        with self._lock:
+            index = self._load_index()
+            if self._shadow is None:
+                previous = self.reconstruct() if index else None
+                self._shadow = build_shadow(previous or {})
+            since_key = 0
+            for item in reversed(index):
+                if item.get("keyframe"):
+                    break
+                since_key += 1
+            keyframe = not index or since_key + 1 >= KEYFRAME_EVERY
+            ops = diff_state(self._shadow, state)
+            record = dict(info)
+            if keyframe:
+                record["state"] = plain_state(state)
+            else:
+                record["ops"] = ops
+            blob = json.dumps(record, ensure_ascii=False).encode("utf-8")
+            return {"keyframe": keyframe, "ops": len(ops)}, blob
+
+    def commit(self, version: float, meta: Dict, blob: bytes) -> str:
+        """Escribe la versión preparada y la añade al índice."""
+        with self._lock:
+            index = self._load_index()
+            os.makedirs(self.root, exist_ok=True)
+            base = f"agent_v{version}"
+            name = base + ".json"
+            n = 1
+            while os.path.exists(os.path.join(self.root, name)):
+                name = f"{base}-{n}.json"
+                n += 1
+            try:
+                path = os.path.join(self.root, name)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(blob)
+                os.replace(path + ".tmp", path)
+                item = {"name": name, "version": version, "ts": time.time(),
+                        "keyframe": meta["keyframe"]}
+                line = json.dumps(item, ensure_ascii=False) + "\n"
+                with open(self.index_path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                metrics.add_bytes("versions", len(blob) + len(line))
+            except Exception:
+                # la sombra ya avanzó: recalcular desde disco la próxima vez
+                self._shadow = None
+                raise
+            index.append(item)
+            self._apply_retention()
+            return name
+
+    # --- retención ---
+    def _apply_retention(self) -> None:
+        index = self._load_index()
+        if len(index) <= KEEP_VERSIONS:
+            return
+        drop = len(index) - KEEP_VERSIONS
+        first = index[drop]
+        if not first.get("keyframe"):
+            state = self.reconstruct(first["name"])
+            data = self._read(first)
+            data.pop("ops", None)
+            data["state"] = state
+            path = os.path.join(self.root, first["name"])
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+            first["keyframe"] = True
+        for item in index[:drop]:
+            try:
+                os.remove(os.path.join(self.root, item["name"]))
+            except OSError:
+                pass
+        del index[:drop]
+        self._rewrite_index(index)
+
+
+def _main(argv):
+    store = VersionStore()
+    if len(argv) >= 1 and argv[0] == "list":
+        for v in store.list_versions():
+            kind = "keyframe" if v.get("keyframe") else "delta"
+            print(f"{v['name']}\t{v['version']}\t{kind}")
+        return 0
+    if len(argv) >= 2 and argv[0] == "show":
+        state = store.reconstruct(argv[1])
+        if state is None:
+            print(f"No existe la versión {argv[1]}", file=sys.stderr)
+            return 1
+        if len(argv) >= 3:
+            snapshot_codec.dump_json(state, argv[2])
+        else:
+            print(json.dumps(state, indent=2, ensure_ascii=False))
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))